@@ -19,7 +19,7 @@ module.exports = function(grunt) {
                            },
             jade: {expand: true,
                               flatten: true,
-                              src: ['jade.html','jade.css','server.py', 'README.standalone'],
+                              src: ['jade.html','jade.css','server.py','labstore.py','libpatch.py', 'README.standalone'],
                               dest: 'build/'
                              },
             jade_6004: {expand: true,
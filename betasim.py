@@ -0,0 +1,350 @@
+# Instruction-level emulation of the Beta, the 6.004 processor.
+#
+# Runs a Beta program directly, without simulating any gates, and records
+# the signals the lab 5 checkoff test logs from a gate-level Beta,
+#
+#   .log RESET IRQ MOE MWR IA[31:0] ID[31:0] MA[31:0] MRD[31:0] MWD[31:0]
+#
+# as one line per clock cycle, eg, tests/beta_log.  tests/test.py turns a
+# trace into checkoff test vectors, so fresh (and much longer) vector sets
+# can be made from any program without a gate-level run.
+#
+# The emulated Beta is the lab 5 one: PC[31] is the supervisor bit,
+# interrupts are taken only in user mode, and MUL and DIV are illegal
+# instructions unless the Beta has a multiplier (mul=True).  Registers
+# that haven't been written since power-up are traced as X, and so is
+# anything computed from them.  MA is 0 on cycles that don't use the ALU
+# (branches, JMP, illegal instructions and interrupts), as on the Beta
+# tests/beta_log was recorded from; the checkoff doesn't check it.
+#
+#   import betasim
+#   beta = betasim.Beta(betasim.load_image('checkoff.bin'))
+#   with open('beta_log', 'w') as f:
+#       f.writelines(beta.trace(568, irq=[417]))
+
+import struct
+import sys
+
+try:
+    range = xrange      # python 2: don't build a list of cycles
+except NameError:
+    pass
+
+RESET = 0x80000000   # where execution starts after reset
+ILLOP = 0x80000004   # illegal instruction handler
+XADR = 0x80000008    # interrupt handler
+XP = 30              # exception pointer, gets PC+4 on illop/interrupt
+
+BETAOP = [
+    "???", "???", "???", "???", "???", "???", "???", "???",
+    "???", "???", "???", "???", "???", "???", "???", "???",
+    "???", "???", "???", "???", "???", "???", "???", "???",
+    "LD",  "ST",  "???", "JMP", "BEQ", "BNE", "???", "LDR",
+    "ADD", "SUB", "MUL", "DIV", "CMPEQ", "CMPLT", "CMPLE", "???",
+    "AND", "OR",  "XOR", "XNOR","SHL", "SHR", "SRA", "???",
+    "ADDC", "SUBC", "MULC", "DIVC", "CMPEQC", "CMPLTC", "CMPLEC", "???",
+    "ANDC", "ORC", "XORC", "XNORC", "SHLC", "SHRC", "SRAC", "???"
+    ]
+
+LD, ST, JMP, BEQ, BNE, LDR = 0x18, 0x19, 0x1B, 0x1C, 0x1D, 0x1F
+
+class BetaError(Exception):
+    pass
+
+##################################################
+##  ALU
+##################################################
+
+M32 = 0xFFFFFFFF
+
+def _signed(x):
+    return x - ((x & 0x80000000) << 1)
+
+# ALU functions of OP-class opcodes, the OPC-class opcode is the same
+# with 0x10 added.  MUL is added by Beta(mul=True).
+_alu = {
+    0x20: lambda a, b: (a + b) & M32,
+    0x21: lambda a, b: (a - b) & M32,
+    0x24: lambda a, b: 1 if a == b else 0,
+    0x25: lambda a, b: 1 if _signed(a) < _signed(b) else 0,
+    0x26: lambda a, b: 1 if _signed(a) <= _signed(b) else 0,
+    0x28: lambda a, b: a & b,
+    0x29: lambda a, b: a | b,
+    0x2A: lambda a, b: a ^ b,
+    0x2B: lambda a, b: ~(a ^ b) & M32,
+    0x2C: lambda a, b: (a << (b & 31)) & M32,
+    0x2D: lambda a, b: a >> (b & 31),
+    0x2E: lambda a, b: (_signed(a) >> (b & 31)) & M32,
+}
+
+_mul = lambda a, b: (a * b) & M32
+
+# Disassemble the instruction id fetched from address ia, eg,
+# "[0a4] ADDC(R1,0x1,R2)".  The address is shown without the supervisor bit.
+def disassemble(ia, id):
+    pc = '[{0:03x}] '.format(ia & 0x7FFFFFFF)
+    op = id >> 26
+    opcode = BETAOP[op]
+    if opcode[0] == '?':
+        return pc + 'illop op=0b{0:06b}'.format(op)
+
+    rc = (id >> 21) & 31
+    ra = (id >> 16) & 31
+    rb = (id >> 11) & 31
+    literal = id & 0xFFFF
+    if literal >= 0x8000: literal -= 0x10000
+    offset_addr = (ia & 0x7FFFFFFF) + 4*literal + 4
+
+    if op >> 4 == 2:
+        return pc + '%s(R%d,R%d,R%d)' % (opcode,ra,rb,rc)
+    elif op >> 4 == 3:
+        return pc + '%s(R%d,0x%x,R%d)' % (opcode,ra,literal & 0xFFFF,rc)
+    elif op == LD:
+        return pc + 'LD(R%d,0x%x,R%d)' % (ra,literal & 0xFFFF,rc)
+    elif op == ST:
+        return pc + 'ST(R%d,0x%x,R%d)' % (rc,literal & 0xFFFF,ra)
+    elif op == LDR:
+        return pc + 'LDR(0x%x,R%d)' % (offset_addr,rc)
+    elif op == JMP:
+        return pc + 'JMP(R%d,R%d)' % (ra,rc)
+    elif op == BEQ or op == BNE:
+        return pc + '%s(R%d,0x%x,R%d)' % (opcode,ra,offset_addr,rc)
+    else:
+        return 'unknown instruction'
+
+##################################################
+##  Memory images
+##################################################
+
+# Read a program: a .bin file is little-endian 32-bit words, as saved by
+# BSim, anything else is text with one word (decimal or 0x hex) per
+# whitespace-separated token.  Returns a list of words from address 0.
+def load_image(filename):
+    if filename.endswith('.bin'):
+        with open(filename, 'rb') as f: data = f.read()
+        data += b'\x00' * (-len(data) % 4)
+        return list(struct.unpack('<%dI' % (len(data) // 4), data))
+    with open(filename) as f:
+        try:
+            return [int(token, 0) & M32 for token in f.read().split()]
+        except ValueError as e:
+            raise BetaError('%s: %s' % (filename, e))
+
+# Rebuild as much of a program as a trace shows: the instruction fetched
+# at each IA and the data returned by each load from a location the
+# program hasn't stored to yet.  Also returns the cycles on which IRQ was
+# asserted and the number of leading reset cycles, which together
+# replay the trace: Beta(image).trace(len(lines), irq=irq, reset=reset).
+def image_from_trace(lines):
+    words = {}
+    stored = set()
+    irq = []
+    reset = 0
+    lines = [line for line in lines if line.strip()]
+    for cycle, line in enumerate(lines):
+        if len(line.rstrip()) != 164:
+            raise BetaError('trace line %d: expected 164 signal values' % (cycle + 1))
+        if line[0] == '1':
+            if cycle == reset: reset += 1
+            continue
+        if line[1] == '1': irq.append(cycle - reset)
+        fields = [line[i:i+32] for i in range(4, 164, 32)]
+        ia, id, ma, mrd, mwd = [int(v, 2) if v.strip('01') == '' else None for v in fields]
+        if ia is None or id is None: continue
+        words.setdefault((ia & 0x7FFFFFFF) >> 2, id)
+        if ma is None: continue
+        a = (ma & 0x7FFFFFFF) >> 2
+        if line[2] == '1' and mrd is not None and a not in stored:
+            words.setdefault(a, mrd)
+        elif line[3] == '1':
+            stored.add(a)
+    image = [0] * (max(words) + 1 if words else 0)
+    for a, v in words.items(): image[a] = v
+    return image, irq, reset
+
+##################################################
+##  Beta
+##################################################
+
+class Beta(object):
+    # image: list of memory words starting at address 0.  Memory is
+    # "size" words (default: image rounded up to a power of two) and, like
+    # the lab memories, ignores address bits above that.
+    def __init__(self, image, size=None, mul=False):
+        if size is None:
+            size = 1
+            while size < max(len(image), 1): size <<= 1
+        if size & (size - 1) or size < len(image):
+            raise BetaError('memory size must be a power of two at least as big as the image')
+        self.memory = [w & M32 for w in image] + [0] * (size - len(image))
+        self.alu = {}
+        for op, f in _alu.items():
+            self.alu[op] = self.alu[op | 0x10] = f
+        if mul:
+            self.alu[0x22] = self.alu[0x32] = _mul
+        self.regs = [0] * 32
+        self.known = 1 << 31      # bit i set once register i holds a known value
+        self.pc = RESET
+        self.cycles = 0
+
+    def reset(self):
+        self.pc = RESET
+
+    # Run for ncycles clock cycles (not counting reset cycles).  IRQ is
+    # asserted on the cycles (counted from the start of this run) listed
+    # in irq.  If log is a list, a tuple (irq, moe, mwr, ia, id, ma, mrd,
+    # mwd) is appended for each cycle, values None where they're X, and
+    # mrd None when MOE is 0.
+    def run(self, ncycles, irq=(), log=None):
+        regs = self.regs
+        memory = self.memory
+        mask = len(memory) - 1
+        alu = self.alu
+        irq = set(irq)
+        pc = self.pc
+        known = self.known
+
+        for cycle in range(ncycles):
+            ia = pc
+            id = memory[(pc >> 2) & mask]
+            pc_inc = (pc & 0x80000000) | ((pc + 4) & 0x7FFFFFFC)
+            op = id >> 26
+            rc = (id >> 21) & 31
+            ra = (id >> 16) & 31
+            rb = (id >> 11) & 31
+            lit = id & 0xFFFF
+            if lit & 0x8000: lit -= 0x10000
+            moe = mwr = 0
+            ma = 0             # ALU output when the ALU isn't used
+            mrd = None
+            wa = rc            # register to write, None for no write
+            wk = 1             # is the value written known?
+
+            if cycle in irq and not pc & 0x80000000:
+                # interrupt: the fetched instruction isn't executed
+                wa, wd, pc = XP, pc_inc, XADR
+            elif op >= 0x20 and op in alu:
+                f = alu[op]
+                if op & 0x10:
+                    ma = wd = f(regs[ra], lit & M32)
+                    wk = (known >> ra) & 1
+                else:
+                    ma = wd = f(regs[ra], regs[rb])
+                    wk = (known >> ra) & (known >> rb) & 1
+                pc = pc_inc
+            elif op == LD:
+                ma = (regs[ra] + lit) & M32
+                mrd = wd = memory[(ma >> 2) & mask]
+                wk = (known >> ra) & 1
+                moe = 1
+                pc = pc_inc
+            elif op == ST:
+                ma = (regs[ra] + lit) & M32
+                memory[(ma >> 2) & mask] = regs[rc]
+                wk = (known >> ra) & 1
+                wa = None
+                mwr = 1
+                pc = pc_inc
+            elif op == JMP:
+                a = regs[ra]
+                wd = pc_inc
+                pc = (a & 0x7FFFFFFC) | (a & pc & 0x80000000)
+            elif op == BEQ or op == BNE:
+                wd = pc_inc
+                if (regs[ra] == 0) == (op == BEQ):
+                    pc = (pc & 0x80000000) | ((pc + 4 + 4*lit) & 0x7FFFFFFC)
+                else:
+                    pc = pc_inc
+            elif op == LDR:
+                ma = (pc + 4 + 4*lit) & 0x7FFFFFFF
+                mrd = wd = memory[(ma >> 2) & mask]
+                moe = 1
+                pc = pc_inc
+            else:
+                # illegal instruction
+                wa, wd, pc = XP, pc_inc, ILLOP
+
+            if log is not None:
+                # MWD is the register file's second read port: Rc for ST, else Rb
+                r2 = rc if mwr else rb
+                mwd = regs[r2] if (known >> r2) & 1 else None
+                if not wk: ma = None
+                log.append((cycle in irq, moe, mwr, ia, id, ma, mrd, mwd))
+
+            if wa is not None and wa != 31:
+                regs[wa] = wd
+                if wk: known |= 1 << wa
+                else: known &= ~(1 << wa)
+
+        self.pc = pc
+        self.known = known
+        self.cycles += ncycles
+
+    # Generate trace lines (with newlines) for "reset" reset cycles
+    # followed by ncycles cycles of execution, in the format of
+    # tests/beta_log.  IRQ cycles are counted from the first cycle after
+    # reset.
+    def trace(self, ncycles, irq=(), reset=1, chunk=4096):
+        for i in range(reset):
+            self.reset()
+            yield '10X0' + 'X'*160 + '\n'
+        irq = sorted(irq)
+        done = 0
+        while done < ncycles:
+            n = min(chunk, ncycles - done)
+            log = []
+            self.run(n, [c - done for c in irq if done <= c < done + n], log)
+            done += n
+            for irq_, moe, mwr, ia, id, ma, mrd, mwd in log:
+                yield '0%d%d%d%s%s%s%s%s\n' % (
+                    irq_, moe, mwr, _bits(ia), _bits(id), _bits(ma),
+                    _bits(mrd) if moe else 'Z'*32, _bits(mwd))
+
+def _bits(v):
+    return 'X'*32 if v is None else '{0:032b}'.format(v)
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    import tracefile
+
+    parser = argparse.ArgumentParser(description='Run a Beta program, optionally writing a lab 5 style trace')
+    parser.add_argument('image', help='program: a .bin file of little-endian words, or a text file of words, or with --replay a trace to rebuild the program from')
+    parser.add_argument('--cycles', type=int, default=1000000, help='number of cycles to run after reset (default 1000000)')
+    parser.add_argument('--irq', default='', help='comma-separated cycles on which to assert IRQ, counted from the first cycle after reset')
+    parser.add_argument('--memory', type=int, default=None, help='memory size in words, a power of two (default: fits the program)')
+    parser.add_argument('--mul', action='store_true', help='the Beta has a multiplier (MUL and MULC aren\'t illegal)')
+    parser.add_argument('--replay', action='store_true', help='image is a trace, eg tests/beta_log (text or packed): rerun it with the same cycles and IRQs')
+    parser.add_argument('--trace', default=None, help='write a trace of each cycle to this file (- for stdout), packed if it ends in .trc')
+    args = parser.parse_args()
+
+    try:
+        irq = [int(c) for c in args.irq.split(',') if c.strip()]
+        reset = 1
+        if args.replay:
+            lines = tracefile.open_trace(args.image)
+            image, irq, reset = image_from_trace(lines)
+            args.cycles = len(lines) - reset
+        else:
+            image = load_image(args.image)
+        beta = Beta(image, size=args.memory, mul=args.mul)
+    except (IOError, ValueError, BetaError, tracefile.TraceError) as e:
+        sys.exit(str(e))
+
+    start = time.time()
+    if args.trace is None:
+        beta.run(args.cycles, irq)
+    elif args.trace.endswith('.trc'):
+        with tracefile.TraceWriter(args.trace, tracefile.BETA_SIGNALS) as out:
+            out.writelines(beta.trace(args.cycles, irq=irq, reset=reset))
+    else:
+        out = sys.stdout if args.trace == '-' else open(args.trace, 'w')
+        out.writelines(beta.trace(args.cycles, irq=irq, reset=reset))
+        if out is not sys.stdout: out.close()
+    elapsed = time.time() - start
+
+    sys.stderr.write('%d cycles in %.3fs (%.0f cycles/s), PC=0x%08x\n' % (
+        beta.cycles, elapsed, beta.cycles / max(elapsed, 1e-9), beta.pc))
+    if args.trace is None:
+        for r in range(0, 32, 4):
+            print('  '.join('R%-2d=0x%08x' % (i, beta.regs[i]) for i in range(r, r + 4)))
@@ -0,0 +1,493 @@
+# Zero-delay functional simulation of combinational gate netlists, many
+# test vectors at a time.
+#
+# gatesim.py models every contamination and propagation delay, which is
+# what a single test run needs but is slow for checking a 32-bit adder or
+# ALU against thousands of vectors.  Here the value of a node across a
+# batch of vectors is held as bit-planes with one bit per vector, packed
+# into numpy uint64 words, and each gate is evaluated once per batch.
+# Gates are levelized when the netlist is loaded and gates of the same
+# type and level are evaluated together.
+#
+# Each node has two planes: "zero" has a 1 where the node is 0, "one"
+# has a 1 where the node is 1.  X is neither and Z is both, so resolving
+# the drivers of a tristate bus is just an AND of their planes.  Gates
+# follow the same (lenient) logic tables as gatesim, so the values here
+# are the ones gatesim settles to once the inputs stop changing.
+#
+#   import netlist, bitsim
+#   modules = netlist.merge_libraries(netlist.load_library('files/gates'),
+#                                     netlist.load_library('files/ward'))
+#   circuit = bitsim.Circuit(netlist.gate_netlist(modules, '/beta/add32'))
+#   batch = circuit.simulate({'a[31:0]': a, 'b[31:0]': b, 'cin': 0}, len(a))
+#   print(batch.values('s[31:0]'), batch.known('s[31:0]'))
+
+import numbers
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils import parse_source, parse_signal
+from gatesim import V0, V1, VX, VZ
+
+class BitsimError(Exception):
+    pass
+
+##################################################
+##  Gate evaluation on bit-planes
+##################################################
+
+# Each function is handed the one and zero planes of a group of gates,
+# arrays indexed by [gate, input, word], and returns the one and zero
+# planes of the gates' outputs, indexed by [gate, word].
+
+# gates treat Z inputs as X
+def _clean(one, zero):
+    return one & ~zero, zero & ~one
+
+def _and(one, zero):
+    one, zero = _clean(one, zero)
+    return np.bitwise_and.reduce(one, axis=1), np.bitwise_or.reduce(zero, axis=1)
+
+def _or(one, zero):
+    one, zero = _clean(one, zero)
+    return np.bitwise_or.reduce(one, axis=1), np.bitwise_and.reduce(zero, axis=1)
+
+def _xor(one, zero):
+    one, zero = _clean(one, zero)
+    known = np.bitwise_and.reduce(one | zero, axis=1)
+    parity = np.bitwise_xor.reduce(one, axis=1)
+    return known & parity, known & ~parity
+
+def _invert(f):
+    def inverted(one, zero):
+        one, zero = f(one, zero)
+        return zero, one
+    return inverted
+
+def _buffer(one, zero):
+    return _clean(one[:, 0], zero[:, 0])
+
+# 2-input mux on clean planes: if the select is X the output is known
+# only where both data inputs agree
+def _select(s1, s0, d0, d1):
+    return (s0 & d0) | (s1 & d1) | (d0 & d1)
+
+def _mux2(one, zero):
+    one, zero = _clean(one, zero)
+    s1, s0 = one[:, 0], zero[:, 0]
+    return (_select(s1, s0, one[:, 1], one[:, 2]),
+            _select(s1, s0, zero[:, 1], zero[:, 2]))
+
+# inputs are s[0], s[1], d0, d1, d2, d3
+def _mux4(one, zero):
+    one, zero = _clean(one, zero)
+    s1, s0 = one[:, 0], zero[:, 0]
+    a1 = _select(s1, s0, one[:, 2], one[:, 3])
+    a0 = _select(s1, s0, zero[:, 2], zero[:, 3])
+    b1 = _select(s1, s0, one[:, 4], one[:, 5])
+    b0 = _select(s1, s0, zero[:, 4], zero[:, 5])
+    s1, s0 = one[:, 1], zero[:, 1]
+    return _select(s1, s0, a1, b1), _select(s1, s0, a0, b0)
+
+# inputs are e, a
+def _tristate(one, zero):
+    one, zero = _clean(one, zero)
+    e1, e0 = one[:, 0], zero[:, 0]
+    return (e1 & one[:, 1]) | e0, (e1 & zero[:, 1]) | e0
+
+# resolve the drivers of a node
+def _bus(one, zero):
+    return np.bitwise_and.reduce(one, axis=1), np.bitwise_and.reduce(zero, axis=1)
+
+# for each gate provide [input-terminal-list,output-terminal,evaluator]
+logic_gates = {
+    'and2': (['a', 'b'], 'z', _and),
+    'and3': (['a', 'b', 'c'], 'z', _and),
+    'and4': (['a', 'b', 'c', 'd'], 'z', _and),
+    'buffer': (['a'], 'z', _buffer),
+    'buffer_h': (['a'], 'z', _buffer),
+    'inverter': (['a'], 'z', _invert(_buffer)),
+    'mux2': (['s', 'd0', 'd1'], 'y', _mux2),
+    'mux4': (['s[0]', 's[1]', 'd0', 'd1', 'd2', 'd3'], 'y', _mux4),
+    'nand2': (['a', 'b'], 'z', _invert(_and)),
+    'nand3': (['a', 'b', 'c'], 'z', _invert(_and)),
+    'nand4': (['a', 'b', 'c', 'd'], 'z', _invert(_and)),
+    'nor2': (['a', 'b'], 'z', _invert(_or)),
+    'nor3': (['a', 'b', 'c'], 'z', _invert(_or)),
+    'nor4': (['a', 'b', 'c', 'd'], 'z', _invert(_or)),
+    'or2': (['a', 'b'], 'z', _or),
+    'or3': (['a', 'b', 'c'], 'z', _or),
+    'or4': (['a', 'b', 'c', 'd'], 'z', _or),
+    'tristate': (['e', 'a'], 'z', _tristate),
+    'xor2': (['a', 'b'], 'z', _xor),
+    'xnor2': (['a', 'b'], 'z', _invert(_xor)),
+}
+
+##################################################
+##  Circuit
+##################################################
+
+# convert a value in the form accepted by Circuit.simulate to a uint64
+# array.  Values must fit in width bits, unsigned or two's complement, and
+# are masked to width bits.
+def _vector_values(v, n, width):
+    lo, hi, mask = -(1 << (width - 1)), 1 << width, (1 << width) - 1
+    if isinstance(v, numbers.Integral):
+        v = int(v)
+        if not lo <= v < hi: raise BitsimError("%d doesn't fit in %d bits" % (v, width))
+        return np.full(n, v & mask, dtype=np.uint64)
+    if isinstance(v, np.ndarray) and v.dtype.kind in 'biu':
+        if v.shape != (n,): raise BitsimError('expected %d values, got %d' % (n, v.size))
+        for x in (int(v.min()), int(v.max())) if n else ():
+            if not lo <= x < hi: raise BitsimError("%d doesn't fit in %d bits" % (x, width))
+        return v.astype(np.uint64) & np.uint64(mask)
+    if not hasattr(v, '__iter__'): raise BitsimError('expected integer values, got %r' % (v,))
+    values = []
+    for x in v:
+        if not isinstance(x, numbers.Integral): raise BitsimError('expected integer values, got %r' % (x,))
+        x = int(x)
+        if not lo <= x < hi: raise BitsimError("%d doesn't fit in %d bits" % (x, width))
+        values.append(x & mask)
+    if len(values) != n: raise BitsimError('expected %d values, got %d' % (n, len(values)))
+    return np.array(values, dtype=np.uint64)
+
+# pack a boolean array, one entry per vector, into a plane of nwords words
+def _pack(bits, nwords):
+    packed = np.zeros(nwords * 8, dtype=np.uint8)
+    b = np.packbits(bits.astype(np.uint8), bitorder='little')
+    packed[:b.size] = b
+    return packed.view('<u8').astype(np.uint64)
+
+# unpack the first n bits of a plane into a boolean array
+def _unpack(plane, n):
+    return np.unpackbits(plane.astype('<u8').view(np.uint8), bitorder='little')[:n].astype(bool)
+
+class Circuit(object):
+    # netlist is a list of devices as produced by netlist.gate_netlist.
+    # Only combinational devices are allowed.
+    def __init__(self, netlist, options=None):
+        if np is None: raise BitsimError('bitsim needs numpy')
+        options = options or {}
+        vil = options.get('vil') or 0.1
+        vih = options.get('vih') or 0.9
+
+        self.aliases = {}
+        for component in netlist:
+            if component['type'] == 'ground':
+                self._make_alias('gnd', component['connections']['gnd'])
+        for component in netlist:
+            if component['type'] == 'connect':
+                c = list(component['connections'].values())
+                for name in c[1:]: self._make_alias(c[0], name)
+
+        self.node_map = {}   # name -> node index
+        self.nodes = []      # node names
+        drivers = {}         # node index -> [(kind, value or (evaluator, input indicies))]
+        gnd = self.node('gnd')
+        drivers[gnd] = [('fixed', V0)]
+
+        for component in netlist:
+            type = component['type']
+            if type in ('ground', 'connect', 'voltage probe'): continue
+            connections = component['connections']
+            name = component['properties'].get('name')
+
+            if type in logic_gates:
+                inputs, output, f = logic_gates[type]
+                d = ('gate', (f, [self.node(connections[t]) for t in inputs]))
+                drivers.setdefault(self.node(connections[output]), []).append(d)
+            elif type == 'constant0' or type == 'constant1':
+                n = self.node(connections['z'])
+                if n in drivers: continue   # already handled this one
+                drivers[n] = [('fixed', V0 if type == 'constant0' else V1)]
+            elif type == 'voltage source':
+                n = self.node(connections['nplus'])
+                if n in drivers: continue   # already handled this one
+                # a source contributes its value at time 0
+                v = parse_source(component['properties']['value']).dc
+                drivers[n] = [('fixed', V0 if v <= vil else (V1 if v >= vih else VX))]
+            elif type in ('dreg', 'dlatch', 'dlatchn', 'memory'):
+                raise BitsimError('%s (%s) is not combinational, use gatesim instead' % (name, type))
+            else:
+                raise BitsimError('Unrecognized gate: ' + type)
+
+        # the test jig always powers the circuit
+        vdd = self.node_map.get(self.unalias('vdd'))
+        if vdd is not None and vdd not in drivers: drivers[vdd] = [('fixed', V1)]
+
+        # nodes that gates read but nothing drives, these have to be inputs
+        self.floating = sorted(set(i for dlist in drivers.values() for kind, d in dlist
+                                   if kind == 'gate' for i in d[1] if i not in drivers))
+
+        self.nslots = len(self.nodes)
+        self.fixed = []      # [(slot, value)]
+        self.driven = set()  # nodes driven by a gate
+        gates = []           # [(evaluator, input slots, output slot)]
+        for n, dlist in drivers.items():
+            if len(dlist) == 1: slots = [n]
+            else:
+                # each driver of a bus gets its own slot, resolved by a BUS gate
+                slots = list(range(self.nslots, self.nslots + len(dlist)))
+                self.nslots += len(dlist)
+                gates.append((_bus, slots, n))
+            for (kind, d), slot in zip(dlist, slots):
+                if kind == 'fixed': self.fixed.append((slot, d))
+                else:
+                    self.driven.add(n)
+                    gates.append((d[0], d[1], slot))
+
+        self.schedule = self._levelize(gates)
+
+    # make name1 and name2 refer to the same node
+    def _make_alias(self, name1, name2):
+        name1 = self.unalias(name1)
+        name2 = self.unalias(name2)
+        if name1 == name2: return
+        if name2 == 'gnd': name1, name2 = name2, name1
+        self.aliases[name2] = name1
+
+    # find anchor of alias chain
+    def unalias(self, name):
+        while name in self.aliases: name = self.aliases[name]
+        return name
+
+    # return index of node for specified name, create if necessary
+    def node(self, name):
+        name = self.unalias(name)
+        n = self.node_map.get(name)
+        if n is None:
+            n = len(self.nodes)
+            self.node_map[name] = n
+            self.nodes.append(name)
+        return n
+
+    # order gates so each is evaluated after the gates driving its inputs.
+    # Returns a list of (evaluator, input slots, output slots) with one
+    # entry per level and kind of gate.
+    def _levelize(self, gates):
+        producer = {}   # slot -> index of gate driving it
+        for i, (f, inputs, output) in enumerate(gates): producer[output] = i
+
+        level = [None] * len(gates)
+        for start in range(len(gates)):
+            if level[start] is not None: continue
+            # depth-first, with an explicit stack since netlists get deep
+            stack = [(start, 0)]
+            level[start] = -1   # on the stack
+            while stack:
+                g, k = stack[-1]
+                inputs = gates[g][1]
+                if k < len(inputs):
+                    stack[-1] = (g, k + 1)
+                    p = producer.get(inputs[k])
+                    if p is None: continue
+                    if level[p] == -1:
+                        raise BitsimError('Combinational cycle through node ' + self.slot_name(inputs[k]))
+                    if level[p] is None:
+                        level[p] = -1
+                        stack.append((p, 0))
+                else:
+                    stack.pop()
+                    level[g] = 1 + max([level[producer[i]] for i in inputs if i in producer] or [0])
+
+        groups = {}
+        for (f, inputs, output), lvl in zip(gates, level):
+            groups.setdefault((lvl, f, len(inputs)), []).append((inputs, output))
+        schedule = []
+        for lvl, f, arity in sorted(groups, key=lambda k: (k[0], k[2], k[1].__name__)):
+            g = groups[(lvl, f, arity)]
+            schedule.append((f, np.array([i for i, o in g], dtype=np.intp).reshape(len(g), arity),
+                             np.array([o for i, o in g], dtype=np.intp)))
+        return schedule
+
+    def slot_name(self, slot):
+        return self.nodes[slot] if slot < len(self.nodes) else 'bus driver %d' % slot
+
+    # return node index for name, which must be an input to the circuit
+    def input_node(self, name):
+        n = self.node_map.get(self.unalias(name))
+        if n is None: raise BitsimError('No such node: ' + name)
+        if n in self.driven: raise BitsimError("Can't drive %s, it's an output of the circuit" % name)
+        return n
+
+    def output_node(self, name):
+        n = self.node_map.get(self.unalias(name))
+        if n is None: raise BitsimError('No such node: ' + name)
+        return n
+
+    # evaluate the circuit for a batch of nvectors vectors.  inputs is a
+    # dictionary of signal -> values, where signal is a list of nodes in
+    # Jade's notation (eg, "a[31:0]", most significant bit first) and
+    # values is a sequence of nvectors integers, or a single integer used
+    # for every vector (negative values are two's complement).  Returns a
+    # Batch.
+    def simulate(self, inputs, nvectors):
+        nwords = (nvectors + 63) // 64
+        planes = {}
+        for sig, v in inputs.items():
+            names = parse_signal(sig)
+            if len(names) > 64: raise BitsimError('%s is wider than 64 bits' % sig)
+            v = _vector_values(v, nvectors, len(names))
+            for i, name in enumerate(reversed(names)):
+                bit = ((v >> np.uint64(i)) & np.uint64(1)).astype(bool)
+                planes[self.input_node(name)] = (_pack(bit, nwords), _pack(~bit, nwords))
+        return self.evaluate(planes, nvectors)
+
+    # evaluate the circuit given {node index: (one plane, zero plane)} for
+    # its inputs
+    def evaluate(self, planes, nvectors):
+        for n in self.floating:
+            if n not in planes:
+                raise BitsimError('Node %s is not connected to any output and has no input value' % self.nodes[n])
+        nwords = (nvectors + 63) // 64
+        one = np.zeros((self.nslots, nwords), dtype=np.uint64)
+        zero = np.zeros((self.nslots, nwords), dtype=np.uint64)
+        ones = ~np.uint64(0)
+        for slot, v in self.fixed:
+            if v == V1 or v == VZ: one[slot] = ones
+            if v == V0 or v == VZ: zero[slot] = ones
+        for n, (p1, p0) in planes.items():
+            one[n] = p1
+            zero[n] = p0
+
+        for f, ins, outs in self.schedule:
+            one[outs], zero[outs] = f(one[ins], zero[ins])
+        return Batch(self, nvectors, one, zero)
+
+# the result of evaluating a Circuit on a batch of vectors
+class Batch(object):
+    def __init__(self, circuit, nvectors, one, zero):
+        self.circuit = circuit
+        self.nvectors = nvectors
+        self.one = one
+        self.zero = zero
+
+    # return array of node values, 0, 1, 2=X, 3=Z, one per vector
+    def node_values(self, name):
+        n = self.circuit.output_node(name)
+        one = _unpack(self.one[n], self.nvectors)
+        zero = _unpack(self.zero[n], self.nvectors)
+        v = np.full(self.nvectors, VX, dtype=np.uint8)
+        v[one & ~zero] = V1
+        v[zero & ~one] = V0
+        v[one & zero] = VZ
+        return v
+
+    # return values of signal as an array of integers, one per vector.
+    # Bits that are X or Z read as 0, see known().
+    def values(self, sig):
+        names = parse_signal(sig)
+        if len(names) > 64: raise BitsimError('%s is wider than 64 bits' % sig)
+        result = np.zeros(self.nvectors, dtype=np.uint64)
+        for i, name in enumerate(reversed(names)):
+            n = self.circuit.output_node(name)
+            bit = _unpack(self.one[n] & ~self.zero[n], self.nvectors)
+            result |= bit.astype(np.uint64) << np.uint64(i)
+        return result
+
+    # return boolean array, True for vectors where every bit of signal is 0 or 1
+    def known(self, sig):
+        result = np.ones(self.nvectors, dtype=bool)
+        for name in parse_signal(sig):
+            n = self.circuit.output_node(name)
+            result &= _unpack(self.one[n] ^ self.zero[n], self.nvectors)
+        return result
+
+##################################################
+##  Test vectors
+##################################################
+
+# strip comments from test vector text, return list of vector lines
+# with whitespace removed
+def parse_vectors(text):
+    text = re.sub(r'/\*(.|\n)*?\*/', '', text)   # multi-line using slash-star
+    text = re.sub(r'//.*', '', text)             # single-line comment
+    return [re.sub(r'\s+', '', line) for line in text.split('\n') if line.strip()]
+
+# check test vectors in the format used by Jade's test aspect and the
+# scripts in scripts/: each line has one character per signal, inputs
+# first, then outputs.  Inputs are 0, 1 or Z ("-" leaves the input
+# undriven, ie, Z), outputs are checked against L, H or Z, "-" is don't
+# care.  Vectors are evaluated batch_size at a time.  Returns a list of
+# (line index, [(signal, expected, actual), ...]) for failing vectors,
+# where actual is one of "01XZ".
+def check_vectors(circuit, inputs, outputs, vectors, batch_size=65536):
+    inputs = [s for sig in inputs for s in parse_signal(sig)]
+    outputs = [s for sig in outputs for s in parse_signal(sig)]
+    nsignals = len(inputs) + len(outputs)
+    for i, line in enumerate(vectors):
+        if len(line) != nsignals:
+            raise BitsimError('Test line %d does not specify %d signals: %s' % (i + 1, nsignals, line))
+        bad = set(line[:len(inputs)]) - set('01Z-') or set(line[len(inputs):]) - set('LHZ-')
+        if bad:
+            raise BitsimError('Illegal test value %s on test line %d: %s' % (bad.pop(), i + 1, line))
+    input_nodes = [circuit.input_node(s) for s in inputs]
+    output_nodes = [circuit.output_node(s) for s in outputs]
+
+    failures = []
+    for start in range(0, len(vectors), batch_size):
+        chunk = vectors[start:start + batch_size]
+        n = len(chunk)
+        nwords = (n + 63) // 64
+        text = np.frombuffer(''.join(chunk).encode('ascii'), dtype=np.uint8).reshape(n, nsignals)
+
+        planes = {}
+        for j, node in enumerate(input_nodes):
+            col = text[:, j]
+            z = (col == ord('Z')) | (col == ord('-'))
+            planes[node] = (_pack(z | (col == ord('1')), nwords), _pack(z | (col == ord('0')), nwords))
+        batch = circuit.evaluate(planes, n)
+
+        # compare every output bit at once, then report failing vectors
+        bad = np.zeros((n, len(outputs)), dtype=bool)
+        actual = np.zeros((n, len(outputs)), dtype=np.uint8)
+        for j, node in enumerate(output_nodes):
+            col = text[:, len(inputs) + j]
+            one = _unpack(batch.one[node], n)
+            zero = _unpack(batch.zero[node], n)
+            actual[:, j] = np.where(one & zero, VZ, np.where(one, V1, np.where(zero, V0, VX)))
+            expected = np.where(col == ord('L'), V0, np.where(col == ord('H'), V1, VZ))
+            bad[:, j] = (col != ord('-')) & (actual[:, j] != expected)
+        for k in np.flatnonzero(bad.any(axis=1)):
+            line = chunk[k]
+            failures.append((start + k, [(outputs[j], line[len(inputs) + j], '01XZ'[actual[k, j]])
+                                         for j in np.flatnonzero(bad[k])]))
+    return failures
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import time
+    import netlist
+
+    parser = argparse.ArgumentParser(description='Check a combinational Jade module against test vectors')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/)')
+    parser.add_argument('module', help='name of module to test, eg /beta/add32')
+    parser.add_argument('--inputs', required=True, help='input signals in vector order, separated by commas or spaces, eg "A[31:0] B[31:0] Cin"')
+    parser.add_argument('--outputs', required=True, help='output signals in vector order, eg "S[31:0] Cout"')
+    parser.add_argument('--vectors', default='-', help='file of test vectors, eg the output of scripts/add32-test.py (default: stdin)')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    if args.vectors == '-': text = sys.stdin.read()
+    else:
+        with open(args.vectors) as f: text = f.read()
+    vectors = parse_vectors(text)
+
+    try:
+        circuit = Circuit(netlist.gate_netlist(modules, args.module))
+        start = time.time()
+        failures = check_vectors(circuit, args.inputs.replace(',', ' ').split(),
+                                 args.outputs.replace(',', ' ').split(), vectors)
+        elapsed = time.time() - start
+    except (netlist.NetlistError, BitsimError) as e:
+        sys.exit(str(e))
+
+    for i, errors in failures[:20]:
+        print('vector %d: %s' % (i + 1, ', '.join('%s expected %s, got %s' % e for e in errors)))
+    print('%d vectors, %d failed, %.3fs' % (len(vectors), len(failures), elapsed))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,1404 @@
+# Analog (device-level) simulation without a browser.
+#
+# A port of the circuit simulator in cktsim.js: the same device models,
+# the same Newton iteration with voltage limiting, trapezoidal
+# integration with LTE timestep control and AC analysis, so a netlist
+# gets the same DC, AC and transient results here as it does in Jade.
+#
+# cktsim.js keeps the modified nodal analysis (MNA) matrices as dense
+# arrays and eliminates them at every Newton step, which is O(n^3) and
+# limits it to a few hundred nodes.  Here the matrices are sparse: the
+# positions of all the entries devices can load are found once, when the
+# circuit is finalized, each Newton step sums the device contributions
+# into that fixed pattern and the system is solved with scipy's sparse
+# LU, so circuits with thousands of nodes are practical.  Without scipy
+# the same matrices are solved as dense numpy arrays.  Netlists come
+# from netlist.device_netlist.
+#
+#   import netlist, cktsim
+#   modules = netlist.merge_libraries(netlist.load_library('files/analog'),
+#                                     netlist.load_library('mylib'))
+#   result = cktsim.transient_analysis(netlist.device_netlist(modules, '/user/test'), 10e-9)
+#   print(result['_xvalues_'], result['out'])
+
+import math
+import time
+
+from utils import parse_source
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from scipy import sparse
+    from scipy.sparse import linalg as sparse_linalg
+except ImportError:
+    sparse = None
+
+class CktsimError(Exception):
+    pass
+
+##################################################
+##  Analyses
+##################################################
+
+# DC analysis, optionally sweeping the value of one or two independent
+# sources: sweep1 and sweep2 are dicts with source, start, stop and step.
+# Returns a dict mapping node names (and I(vsource) for branch currents)
+# to DC values, lists of values for a sweep, with the values of the first
+# source in _sweep1_.  For two sweeps the result is a list of those dicts,
+# one per value of the second source.  With jobs other than 1, the sweep
+# is run by dc_sweep on that many processes (None: one per cpu).
+def dc_analysis(netlist, sweep1=None, sweep2=None, options=None, jobs=1):
+    if not netlist: return None
+    ckt = Circuit(netlist, options)
+    (source1, values1), (source2, values2) = _sweeps(ckt, sweep1, sweep2)
+
+    if jobs == 1: points = _dc_points(ckt, source1, source2, _sweep_points(values1, values2))
+    else: points = dc_sweep(netlist, sweep1, sweep2, options, jobs)
+
+    # add each point's result to the accumulated results for each node
+    # and branch, starting over for each value of the second source
+    results2 = []
+    for val1, val2, result in points:
+        if not results2 or results2[-1]['_sweep2_'] != val2:
+            results2.append({'_sweep1_': [], '_sweep2_': val2, '_network_': ckt})
+        results = results2[-1]
+        for n, v in result.items():
+            if n != '_network_': results.setdefault(n, []).append(v)
+        results['_sweep1_'].append(val1)
+    return results2 if source2 else results2[0]
+
+# The source and the list of values of each sweep, (None, [None]) for a
+# missing one.  The values go from start to stop by step, ending at stop.
+def _sweeps(ckt, sweep1, sweep2):
+    sweeps = []
+    for which, sweep in ((1, sweep1), (2, sweep2)):
+        if not sweep or not sweep.get('source'):
+            sweeps.append((None, [None]))
+            continue
+        source = ckt.device_map.get(sweep['source'].lower())
+        if isinstance(source, VSource): sweep['units'] = 'V'
+        elif isinstance(source, ISource): sweep['units'] = 'A'
+        else: raise CktsimError('Device %d not independent source in DC sweep: %s' % (which, sweep['source']))
+        start, stop = sweep['start'], sweep['stop']
+        # make sure sign of step is compatible with bounds
+        step = abs(sweep['step']) if start <= stop else -abs(sweep['step'])
+        values = [start]
+        while abs(values[-1] - stop) >= abs(0.01*step):
+            # make sure we stop at specified end point
+            val = values[-1] + step
+            if (step > 0 and val > stop) or (step < 0 and val < stop): val = stop
+            values.append(val)
+        sweeps.append((source, values))
+    return sweeps
+
+# (value of source 1, value of source 2) for each point of a sweep, in order
+def _sweep_points(values1, values2):
+    return [(val1, val2) for val2 in values2 for val1 in values1]
+
+# Yields (val1, val2, DC result) for each point, in order.  Each point's
+# Newton iteration starts from the previous point's operating point.
+def _dc_points(ckt, source1, source2, points):
+    # save source functions user specified
+    saved1 = source1 and source1.src
+    saved2 = source2 and source2.src
+    try:
+        for val1, val2 in points:
+            # start by setting source values
+            if source1: source1.src = parse_source({'type': 'dc', 'args': [val1]})
+            if source2: source2.src = parse_source({'type': 'dc', 'args': [val2]})
+            yield val1, val2, ckt.dc(True)
+    finally:
+        # all done, restore saved source functions
+        if source1: source1.src = saved1
+        if source2: source2.src = saved2
+
+_sweep = None   # (circuit, sources, initial solution) in each sweep worker
+
+def _init_sweep_worker(netlist, sweep1, sweep2, options):
+    global _sweep
+    ckt = Circuit(netlist, options)
+    ckt.finalize()
+    sources = [source for source, values in _sweeps(ckt, sweep1, sweep2)]
+    _sweep = (ckt, sources, ckt.solution.copy(), ckt.soln_max.copy())
+
+# DC results for a run of neighbouring points, each warm started from the
+# one before.  The run starts from the circuit's initial state, whatever
+# the worker did before, so results don't depend on the scheduling.
+def _sweep_run(points):
+    ckt, (source1, source2), solution, soln_max = _sweep
+    ckt.solution[:] = solution
+    ckt.soln_max[:] = soln_max
+    results = []
+    for val1, val2, result in _dc_points(ckt, source1, source2, points):
+        result = dict(result)
+        del result['_network_']
+        results.append((val1, val2, result))
+    return results
+
+# Run a one or two dimensional DC sweep (see dc_analysis) on a pool of
+# jobs processes (None: one per cpu), yielding (val1, val2, DC result)
+# for each point in sweep order, as they finish.  Each process builds the
+# circuit once, the points are split into runs of chunk neighbouring
+# points (default: about four runs per process) and each run is solved in
+# order, so all but its first point are warm started from the previous
+# point's operating point.  That first point starts from scratch, as the
+# first point of a serial sweep does, so a circuit with more than one
+# operating point, eg, a latch, can settle differently at run boundaries
+# than it would in a serial sweep.
+def dc_sweep(netlist, sweep1, sweep2=None, options=None, jobs=None, chunk=None):
+    import multiprocessing
+
+    (source1, values1), (source2, values2) = _sweeps(Circuit(netlist, options), sweep1, sweep2)
+    points = _sweep_points(values1, values2)
+    jobs = jobs or multiprocessing.cpu_count()
+    chunk = chunk or max(1, -(-len(points) // (4 * jobs)))
+    runs = [points[i:i + chunk] for i in range(0, len(points), chunk)]
+
+    if jobs == 1 or len(runs) <= 1:
+        _init_sweep_worker(netlist, sweep1, sweep2, options)
+        for run in runs:
+            for point in _sweep_run(run): yield point
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_sweep_worker, (netlist, sweep1, sweep2, options))
+    try:
+        for results in pool.imap(_sweep_run, runs):
+            for point in results: yield point
+    finally:
+        pool.terminate()
+
+# AC analysis with npts points per decade from fstart to fstop (Hz), the
+# small signal injected at the source named ac_source_name.  Returns a
+# dict mapping node names to {'magnitude': array, 'phase': array (degrees)},
+# with the frequencies in _frequencies_.
+def ac_analysis(netlist, fstart, fstop, ac_source_name, options=None, npts=50):
+    if not netlist: return None
+    ckt = Circuit(netlist, options)
+    return ckt.ac(npts, fstart, fstop, ac_source_name)
+
+# Transient analysis out to time tstop (seconds).  probe_names are nodes
+# whose LTE should also be checked when picking timesteps.  If given,
+# progress(percent_complete) is called periodically and can return True
+# to halt the simulation.  Returns a dict mapping node names (and
+# I(vsource) for branch currents) to arrays of values at the times in
+# _xvalues_.
+def transient_analysis(netlist, tstop, probe_names=(), progress=None, options=None):
+    if not netlist or tstop is None: return None
+    ckt = Circuit(netlist, options)
+    return ckt.tran(100, 0, tstop, probe_names, progress)
+
+##################################################
+##  Circuit analysis
+##################################################
+
+# types of "nodes" in the linear system
+T_VOLTAGE = 0
+T_CURRENT = 1
+
+v_newt_lim = 0.3                    # voltage limited Newton great for Mos/diodes
+v_abstol = 1e-6                     # absolute voltage error tolerance
+i_abstol = 1e-12                    # absolute current error tolerance
+eps = 1.0e-12                       # a very small number compared to one
+dc_max_iters = 1000                 # max iterations before giving up
+max_tran_iters = 20                 # max iterations before giving up
+time_step_increase_factor = 2.0     # how much can lte let timestep grow
+lte_step_decrease_factor = 8        # limit lte one-iter timestep shrink
+nr_step_decrease_factor = 4         # Newton failure timestep shrink
+reltol = 0.0001                     # relative tol to max observed value
+lterel = 10                         # LTE/Newton tolerance ratio (> 10!)
+ac_dense_max = 50                   # largest circuit solved densely in ac
+
+# union-find over node indices
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+# Sparse LU factorizations of a sequence of matrices with the same
+# pattern, eg, the Newton steps of a DC or transient analysis.  SuperLU
+# doesn't separate the symbolic and numeric phases, so the work that
+# depends only on the pattern is kept here instead: the fill-reducing
+# column ordering is picked (by COLAMD) on the first factorization and the
+# pattern is permuted into that order once, so later factorizations just
+# gather the data into place and factor it in natural order.  A matrix
+# that's the same as the last one factored, eg, at every step of a linear
+# circuit with a fixed timestep, reuses its factors.  With reuse_tol > 0,
+# so does one for the same key (the timestep) whose entries are all within
+# reuse_tol (relative) of those, ie, whose device conductances have barely
+# changed: Newton then converges a little slower, but more of its steps
+# are triangular solves instead of factorizations.  A new timestep always
+# refactors, since stale C/dt terms slow Newton down far more.
+class SparseLU(object):
+    def __init__(self, rows, indptr, reuse_tol=0):
+        self.rows = rows
+        self.indptr = indptr
+        self.n = len(indptr) - 1
+        self.reuse_tol = reuse_tol
+        self.order = None     # slot of each entry of the permuted matrix
+        self.lu = None
+        self.data = None      # data and key of the factored matrix
+        self.key = None
+        self.factorizations = 0
+        self.solves = 0
+
+    def factor(self, data, key=None):
+        if self.order is None:
+            n = self.n
+            m = sparse.csc_matrix((data, self.rows, self.indptr), shape=(n, n))
+            self.perm_c = sparse_linalg.splu(m).perm_c
+            # column k of the permuted matrix is column q[k]
+            q = np.argsort(self.perm_c)
+            counts = np.diff(self.indptr)[q]
+            self.p_indptr = np.concatenate(([0], np.cumsum(counts)))
+            self.order = np.concatenate([np.arange(self.indptr[c], self.indptr[c + 1]) for c in q])
+            self.p_rows = self.rows[self.order]
+        m = sparse.csc_matrix((data[self.order], self.p_rows, self.p_indptr), shape=(self.n, self.n))
+        self.lu = None   # no stale factors if this one fails
+        self.lu = sparse_linalg.splu(m, permc_spec='NATURAL')
+        self.data = data.copy()
+        self.key = key
+        self.factorizations += 1
+
+    def reusable(self, data, key):
+        if self.lu is None or data.dtype != self.data.dtype: return False
+        if not self.reuse_tol or key != self.key: return np.array_equal(data, self.data)
+        return bool((np.abs(data - self.data) <= self.reuse_tol * np.abs(self.data)).all())
+
+    # solve the matrix with the given data (in pattern order) for x
+    def solve(self, data, b, key=None):
+        if not self.reusable(data, key): self.factor(data, key)
+        self.solves += 1
+        # the permuted matrix's unknowns are x in column order
+        return self.lu.solve(b)[self.perm_c]
+
+class Circuit(object):
+    def __init__(self, netlist=None, options=None):
+        if np is None: raise CktsimError('Analog simulation needs numpy')
+
+        # tolerances are per circuit, not global as in cktsim.js
+        options = options or {}
+        self.v_abstol = options.get('v_abstol') or v_abstol
+        self.i_abstol = options.get('i_abstol') or i_abstol
+        self.reltol = options.get('reltol') or reltol
+        self.res_check_abs = math.sqrt(self.i_abstol)   # loose Newton residue check
+        self.res_check_rel = math.sqrt(self.reltol)
+        # reuse LU factors while the matrix stays this close (see SparseLU)
+        self.lu_reuse_tol = options.get('lu_reuse_tol') or 0
+
+        self.node_map = {}
+        self.ntypes = []
+
+        self.devices = []            # list of devices
+        self.device_map = {}         # map name -> device
+        self.voltage_sources = []
+        self.current_sources = []
+        self.initial_voltages = []
+
+        self.finalized = False
+        self.diddc = False
+        self.node_index = -1
+        self.periods = 1
+        self.result = None
+
+        if netlist is not None: self.load_netlist(netlist)
+
+    def history(self, node):
+        if self.result is None or node not in self.result: return None
+        yvalues = self.result[node]
+        if not hasattr(yvalues, '__len__'):
+            # change a single numeric value into an array of that value
+            yvalues = self.result[node] = np.zeros(len(self.result['_xvalues_'])) + yvalues
+        return {'xvalues': self.result['_xvalues_'], 'yvalues': yvalues}
+
+    def result_type(self):
+        return 'analog'
+
+    def node_list(self):
+        return [n for n in (self.result or {}) if n not in ('_network_', '_xvalues_', '_frequencies_')]
+
+    # index of ground node
+    def gnd_node(self):
+        return -1
+
+    # allocate a new node index
+    def node(self, name, ntype):
+        self.node_index += 1
+        if name is not None: self.node_map[name] = self.node_index
+        self.ntypes.append(ntype)
+        return self.node_index
+
+    # call to finalize the circuit in preparation for simulation
+    def finalize(self):
+        if self.finalized: return True
+        self.finalized = True
+        N = self.N = self.node_index + 1
+
+        # load up the linear elements once and for all, as lists of
+        # (row, column, value)
+        self._Gl = []
+        self._C = []
+        for d in reversed(self.devices): d.load_linear(self)
+
+        # the sparsity pattern: the linear entries, the diagonal and the
+        # entries devices load into G on each Newton step
+        entries = [(i, i) for i in range(N)]
+        entries.extend((i, j) for i, j, v in self._Gl)
+        entries.extend((i, j) for i, j, v in self._C)
+        for d in self.devices: entries.extend(d.entries())
+        self.keys = np.unique(np.array([j*N + i for i, j in entries if i >= 0 and j >= 0], dtype=np.int64))
+        self.rows = self.keys % N
+        self.cols = self.keys // N
+        self.indptr = np.searchsorted(self.cols, np.arange(N + 1))
+        self.nnz = len(self.keys)
+        self.diagonal = self.slots(np.arange(N), np.arange(N))
+        self.slot_rows = np.append(self.rows, N)
+
+        # matrices are held as their entries in the pattern, plus one
+        # extra element at the end for entries in ground's row or column
+        self.Gl = self.matrix_data(self._Gl)   # linear conductances
+        self.C = self.matrix_data(self._C)     # linear L's and C's
+        self.G = self.Gl.copy()                # complete conductance matrix
+        self.matrix = self.G
+        self.matrix_key = None     # what the matrix was loaded for, see SparseLU
+        self.Gl_matrix = self.make_matrix(self.Gl)
+        self.C_matrix = self.make_matrix(self.C)
+
+        # fets and diodes are evaluated all together, each kind in one
+        # pass over arrays of their parameters (see Fets and Diodes)
+        self.loads = [d for d in reversed(self.devices) if not isinstance(d, (Fet, Diode))]
+        self.loads.append(Diodes(self, [d for d in reversed(self.devices) if isinstance(d, Diode)]))
+        self.loads.append(Fets(self, [d for d in reversed(self.devices) if isinstance(d, Fet)]))
+
+        # factorizations of the Newton matrices and of the complex AC ones
+        if sparse is not None:
+            self.lu = SparseLU(self.rows, self.indptr, self.lu_reuse_tol)
+            self.ac_lu = SparseLU(self.rows, self.indptr)
+
+        # unknowns also have an extra element at the end for ground, so
+        # x[-1] is 0 and devices can index node -1 like any other
+        self.voltage_rows = np.array(self.ntypes, dtype=np.int8) == T_VOLTAGE
+        self.abstol = np.where(self.voltage_rows, self.v_abstol, self.i_abstol)
+        self.soln_max = np.zeros(N)   # max abs value seen for each unknown
+        self.solution = np.zeros(N + 1)
+        self.rhs = np.zeros(N + 1)
+
+        # apply any initial voltages
+        for node, v in self.initial_voltages:
+            if node >= 0:
+                self.solution[node] = v
+                self.soln_max[node] = v
+
+        # check for voltage source loops: the voltage sources' rows of Gl
+        # are independent unless the sources (treated as edges between
+        # their nodes) form a loop
+        parent = list(range(N + 1))   # N stands for ground
+        for v in self.voltage_sources:
+            a = _find(parent, v.npos if v.npos >= 0 else N)
+            b = _find(parent, v.nneg if v.nneg >= 0 else N)
+            if a == b:
+                raise CktsimError('Warning!!! Circuit has a voltage source loop or a source or current probe shorted by a wire, please remove the source or the wire causing the short.')
+            parent[a] = b
+        return True
+
+    # indices into matrix data of the entries at (rows[k], cols[k]), for
+    # arrays of rows and columns
+    def slots(self, rows, cols):
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        index = np.searchsorted(self.keys, cols*self.N + rows)
+        return np.where((rows < 0) | (cols < 0), self.nnz, index)
+
+    # matrix data from a list of (row, column, value)
+    def matrix_data(self, stamps):
+        data = np.zeros(self.nnz + 1)
+        if stamps:
+            rows, cols, values = zip(*stamps)
+            index = np.searchsorted(self.keys, np.array(cols, dtype=np.int64)*self.N + np.array(rows))
+            data[:self.nnz] = np.bincount(index, weights=values, minlength=self.nnz)
+        return data
+
+    # matrix with the given data: a scipy sparse matrix if we have scipy,
+    # otherwise a dense numpy array
+    def make_matrix(self, data):
+        N = self.N
+        if sparse is not None:
+            return sparse.csc_matrix((data[:self.nnz], self.rows, self.indptr), shape=(N, N))
+        return self.make_dense(data)
+
+    def make_dense(self, data):
+        m = np.zeros((self.N, self.N), dtype=data.dtype)
+        m[self.rows, self.cols] = data[:self.nnz]
+        return m
+
+    # solve the matrix with the given data for x, given b
+    def solve(self, data, b):
+        x = self._solve(data, b)
+        if x is not None: return x
+        # singular, eg, a node with only capacitors attached during dc: a
+        # tiny conductance on the diagonal picks the solution that leaves
+        # such nodes alone, as the RQ solver in cktsim.js does
+        data = data.copy()
+        data[self.diagonal] += eps * max(1.0, np.abs(data).max())
+        x = self._solve(data, b)
+        if x is None: raise CktsimError('Circuit matrix is singular')
+        return x
+
+    # None if the matrix is singular, which for a nearly singular one
+    # splu reports by returning infinities or NaNs
+    def _solve(self, data, b):
+        try:
+            if sparse is not None:
+                lu = self.ac_lu if np.iscomplexobj(data) else self.lu
+                x = lu.solve(data[:self.nnz], b, self.matrix_key)
+            else:
+                x = np.linalg.solve(self.make_matrix(data), b)
+        except (RuntimeError, np.linalg.LinAlgError):
+            return None
+        return x if np.isfinite(x).all() else None
+
+    # add val component between two nodes to list of stamps M
+    # index of -1 refers to ground node
+    def add_two_terminal(self, i, j, g, M):
+        if i >= 0:
+            M.append((i, i, g))
+            if j >= 0:
+                M.append((i, j, -g))
+                M.append((j, i, -g))
+                M.append((j, j, g))
+        elif j >= 0:
+            M.append((j, j, g))
+
+    def add_conductance_l(self, i, j, g):
+        self.add_two_terminal(i, j, g, self._Gl)
+
+    def add_capacitance(self, i, j, c):
+        self.add_two_terminal(i, j, c, self._C)
+
+    # add individual conductance to Gl matrix
+    def add_to_Gl(self, i, j, g):
+        if i >= 0 and j >= 0: self._Gl.append((i, j, g))
+
+    # add individual capacitance to C matrix
+    def add_to_C(self, i, j, c):
+        if i >= 0 and j >= 0: self._C.append((i, j, c))
+
+    # load circuit from netlist: [{type:, connections:, properties:}, ...]
+    def load_netlist(self, netlist):
+        # connections are a dict of terminal: node, or a list of nodes
+        def nodes(component):
+            c = component['connections']
+            return list(c.values()) if isinstance(c, dict) else list(c)
+
+        # set up mapping for all ground connections
+        for component in reversed(netlist):
+            if component['type'] == 'ground':
+                for c in nodes(component): self.node_map[c] = self.gnd_node()
+
+        # "connect a b ..." makes a, b, ... aliases for the same node
+        aliases = {}   # keep track of canonical name for a node
+        for component in reversed(netlist):
+            if component['type'] != 'connect': continue
+            connections = nodes(component)
+            if len(connections) <= 1: continue
+            # a ground node is the canonical name if there is one,
+            # otherwise connections[0]
+            cname = connections[0]
+            for c in connections[1:]:
+                if c in self.node_map:
+                    cname = c
+                    break
+            while cname in aliases: cname = aliases[cname]   # follow alias chain
+            for c in connections[1:]:
+                while c in aliases: c = aliases[c]
+                if cname != c: aliases[c] = cname
+
+        # process each component in the netlist
+        found_ground = False   # is some component hooked to gnd?
+        self.counts = {}
+        for component in reversed(netlist):
+            type = component['type']
+            properties = component['properties']
+            self.counts[type] = self.counts.get(type, 0) + 1
+
+            # convert node names to circuit indices
+            connections = {}
+            c = component['connections']
+            for terminal, node in (c.items() if isinstance(c, dict) else enumerate(c)):
+                while node in aliases: node = aliases[node]
+                index = self.node_map.get(node)
+                if index is None: index = self.node(node, T_VOLTAGE)
+                elif index == self.gnd_node(): found_ground = True
+                connections[terminal] = index
+
+            name = properties.get('name')
+            if type == 'resistor':
+                self.r(connections['n1'], connections['n2'], properties['value'], name)
+            elif type == 'diode':
+                self.d(connections['anode'], connections['cathode'], properties['area'], properties.get('type'), name)
+            elif type == 'capacitor':
+                self.c(connections['n1'], connections['n2'], properties['value'], name)
+            elif type == 'inductor':
+                self.l(connections['n1'], connections['n2'], properties['value'], name)
+            elif type == 'voltage source':
+                self.v(connections['nplus'], connections['nminus'], properties['value'], name)
+            elif type == 'current source':
+                self.i(connections['nplus'], connections['nminus'], properties['value'], name)
+            elif type == 'opamp':
+                self.opamp(connections['nplus'], connections['nminus'], connections['output'], connections['gnd'], properties['A'], name)
+            elif type == 'nfet':
+                self.n(connections['d'], connections['g'], connections['s'], properties['W'], properties['L'], name)
+            elif type == 'pfet':
+                self.p(connections['d'], connections['g'], connections['s'], properties['W'], properties['L'], name)
+            elif type == 'initial voltage':
+                self.initial_voltages.append((connections['node'], properties['IV']))
+            elif type not in ('voltage probe', 'ground', 'connect'):
+                raise CktsimError('Unrecognized device type ' + type)
+
+        if not found_ground:   # no ground connection from some device
+            raise CktsimError('Please make at least one connection to ground (node gnd)')
+
+        # finally, update node_map to reflect aliases created by connect
+        for node in aliases:
+            c = node
+            while c in aliases: c = aliases[c]
+            if c in self.node_map: self.node_map[node] = self.node_map[c]
+
+        self.find_cmos_gates()
+        self.size = sum(self.counts.values())
+
+    # count output nodes of CMOS gates: nodes that connect to the source
+    # or drain of both P and N fets
+    def find_cmos_gates(self):
+        found = {}
+        for d in self.devices:
+            if isinstance(d, Fet):
+                for node in (d.d, d.s): found.setdefault(node, set()).add(d.type_sign)
+        self.counts['cmos_gates'] = sum(1 for signs in found.values() if len(signs) == 2)
+
+    # if converges: updates self.solution, self.soln_max, returns iter count
+    # otherwise: return None and set self.problem_node
+    # load should compute -f and df/dx (note the sign pattern!)
+    def find_solution(self, load, maxiters):
+        N = self.N
+        soln = self.solution
+        rhs = self.rhs
+        voltage_rows = self.voltage_rows
+        d_sol = None
+        abssum_old = 0
+        abssum_compare = 0
+        use_limiting = False
+        down_count = 0
+
+        # iteratively solve until values converge or iteration limit exceeded
+        iter = 0
+        while iter < maxiters:
+            # set up equations
+            load(soln, rhs)
+
+            # compute norm of rhs, assume variables of v type go with eqns of i type
+            abssum_rhs = np.abs(rhs[:N][voltage_rows]).sum()
+
+            if iter > 0 and not use_limiting and abssum_old < abssum_rhs:
+                # old rhsnorm was better, undo last iter and turn on limiting
+                soln[:N] -= d_sol
+                iter -= 1
+                use_limiting = True
+            else:
+                # compute the Newton delta
+                d_sol = self.solve(self.matrix, rhs[:N])
+
+                # if norm going down for ten iters, stop limiting
+                if abssum_rhs < abssum_old: down_count += 1
+                else: down_count = 0
+                if down_count > 10:
+                    use_limiting = False
+                    down_count = 0
+
+                abssum_old = abssum_rhs
+
+            # update the worst case abssum for comparison
+            if iter == 0 or abssum_rhs > abssum_compare: abssum_compare = abssum_rhs
+
+            # check residue convergence, but loosely, and give up on last iteration
+            converged = not (iter < maxiters - 1 and
+                             abssum_rhs > self.res_check_abs + self.res_check_rel * abssum_compare)
+
+            # simple voltage step limiting to encourage Newton convergence
+            if use_limiting:
+                d_sol[voltage_rows] = np.clip(d_sol[voltage_rows], -v_newt_lim, v_newt_lim)
+
+            # update solution and check delta convergence
+            soln[:N] += d_sol
+            unconverged = np.nonzero(np.abs(d_sol) > self.abstol + self.reltol * self.soln_max)[0]
+            if len(unconverged):
+                converged = False
+                self.problem_node = unconverged[0]
+
+            if converged:
+                np.maximum(self.soln_max, np.abs(soln[:N]), out=self.soln_max)
+                return iter + 1
+            iter += 1
+        return None
+
+    # define -f and df/dx for Newton solver
+    def load_dc(self, soln, rhs):
+        # rhs is initialized to -Gl * soln
+        rhs[:self.N] = -self.Gl_matrix.dot(soln[:self.N])
+        rhs[self.N] = 0
+        # G matrix is initialized with linear Gl
+        self.G[:] = self.Gl
+        # now load up the nonlinear parts of rhs and G
+        for d in self.loads: d.load_dc(self, soln, rhs)
+        self.matrix = self.G
+        self.matrix_key = 'dc'
+
+    # DC analysis
+    def dc(self, report_results=True):
+        self.finalize()
+
+        # find the operating point
+        iterations = self.find_solution(self.load_dc, dc_max_iters)
+
+        if iterations is None:
+            # too many iterations
+            if not report_results: return False
+            if self.current_sources:
+                raise CktsimError("Unable to find circuit's operating point: do your current sources have a conductive path to ground?")
+            raise CktsimError("Unable to find circuit's operating point: is there a loop in your circuit that's oscillating?")
+
+        # note that a dc solution was computed
+        self.diddc = True
+        if not report_results: return True
+
+        # capture node voltages and branch currents from voltage sources
+        self.result = {}
+        for name, index in self.node_map.items():
+            self.result[name] = 0 if index == -1 else float(self.solution[index])
+        for v in self.voltage_sources:
+            self.result['I(%s)' % v.name] = float(self.solution[v.branch])
+        self.result['_network_'] = self
+        return self.result
+
+    # transient analysis from tstart to tstop with about ntpts timepoints
+    # per period of the shortest periodic source.  See transient_analysis
+    # for probe_names and progress.
+    def tran(self, ntpts, tstart, tstop, probe_names=(), progress=None, update_interval=0.25):
+        # standard to do a dc analysis before transient
+        if not self.diddc:
+            if not self.dc(False):
+                # dc failed, start over from zero
+                self.finalized = False
+                self.finalize()
+        else:
+            self.finalize()
+        N = self.N
+
+        # back vectors for up to a second order method
+        self.c = np.zeros(N + 1)
+        self.oldc = np.zeros(N + 1)
+        self.q = np.zeros(N)
+        self.oldq = np.zeros(N)
+        self.old2q = np.zeros(N)
+        self.alpha0 = 1.0
+        self.alpha1 = 0.0
+        self.alpha2 = 0.0
+        self.beta0 = np.ones(N + 1)
+        self.beta1 = np.zeros(N + 1)
+
+        # mark a set of algebraic variables (don't miss hidden ones!)
+        self.ar = self.algebraic()
+
+        # non-algebraic variables and probe variables get lte
+        self.ltecheck = self.ar == 0
+        for name in probe_names:
+            index = self.node_map.get(name)
+            if index is not None and index >= 0: self.ltecheck[index] = True
+
+        # check for periodic sources
+        period = tstop - tstart
+        for src in self.voltage_sources + self.current_sources:
+            if src.src.period > 0: period = min(period, src.src.period)
+        self.periods = int(math.ceil((tstop - tstart) / period))
+        # maximum 50000 steps/period
+        max_nsteps = self.periods * 50000
+
+        self.time = tstart
+        # ntpts adjusted by numbers of periods in input
+        self.max_step = (tstop - tstart) / (self.periods * ntpts)
+        self.min_step = self.max_step / 1e8
+        self.new_step = self.max_step / 1e6
+        self.oldt = self.time - self.new_step
+        self.old2t = self.old3t = float('nan')
+
+        # initialize old crnts, charges, and solutions
+        self.load_tran(self.solution, self.rhs)
+        self.old3sol = self.solution[:N].copy()
+        self.old2sol = self.solution[:N].copy()
+        self.oldsol = self.solution[:N].copy()
+        self.old2q[:] = self.q
+        self.oldq[:] = self.q
+        self.oldc[:] = self.c
+
+        self.tstart = tstart
+        self.tstop = tstop
+        response = []   # solution at each timepoint
+        times = []
+        tupdate = time.time() + update_interval
+
+        step_index = -3   # start with pseudo-Euler steps
+        while step_index < max_nsteps:
+            # save the just computed solution, and move back q and c
+            if step_index >= 0: response.append(self.solution[:N].copy())
+            self.oldc[:] = self.c
+            self.old3sol, self.old2sol = self.old2sol, self.oldsol
+            self.oldsol = self.solution[:N].copy()
+            self.old2q[:] = self.oldq
+            self.oldq[:] = self.q
+
+            if step_index < 0:
+                # take a prestep using BE
+                self.old3t = self.old2t - (self.oldt - self.old2t)
+                self.old2t = self.oldt - (tstart - self.oldt)
+                self.oldt = tstart - (self.time - self.oldt)
+                self.time = tstart
+                beta0, beta1 = 1.0, 0.0
+            else:
+                # take a regular step: save the time, and rotate time wheel
+                times.append(self.time)
+                self.old3t = self.old2t
+                self.old2t = self.oldt
+                self.oldt = self.time
+                # make sure we come smoothly in to the interval end
+                if self.time >= tstop: break   # we're done!
+                elif self.time + self.new_step > tstop: self.time = tstop
+                elif self.time + 1.5*self.new_step > tstop: self.time += (2.0/3) * (tstop - self.time)
+                else: self.time += self.new_step
+                # use trap (average old and new crnts)
+                beta0, beta1 = 0.5, 0.5
+
+            # for trap rule, turn off current averaging for algebraic eqns
+            self.beta0[:N] = beta0 + self.ar * beta1
+            self.beta1[:N] = (1.0 - self.ar) * beta1
+
+            # loop to find NR converging timestep with okay LTE
+            while True:
+                # set the timestep coefficients (alpha2 is for bdf2)
+                self.alpha0 = 1.0 / (self.time - self.oldt)
+                self.alpha1 = -self.alpha0
+                self.alpha2 = 0
+
+                # if timestep is 1/10,000th of tstop, just use BE
+                if self.time - self.oldt < 1.0e-4 * tstop:
+                    self.beta0[:] = 1.0
+                    self.beta1[:] = 0.0
+
+                # use Newton to compute the solution
+                iterations = self.find_solution(self.load_tran, max_tran_iters)
+
+                # if NR succeeds and stepsize is at min, accept and newstep=maxgrowth*minstep.
+                # else if Newton fails, shrink step by a factor and try again
+                # else LTE picks new step, if bigger accept current step and go on.
+                if iterations is not None and (step_index <= 0 or self.time - self.oldt < (1 + self.reltol) * self.min_step):
+                    if step_index > 0: self.new_step = time_step_increase_factor * self.min_step
+                    break
+                elif iterations is None:
+                    # NR nonconvergence, shrink by factor
+                    self.time = self.oldt + (self.time - self.oldt) / nr_step_decrease_factor
+                else:
+                    # check the LTE and shrink step if needed
+                    self.new_step = self.pick_step()
+                    if self.new_step < (1.0 - self.reltol) * (self.time - self.oldt):
+                        self.time = self.oldt + self.new_step   # try again
+                    else:
+                        break   # LTE okay, new_step for next step
+
+            step_index += 1
+
+            if progress is not None and time.time() >= tupdate:
+                if progress(int(round(100 * (self.time - tstart) / (tstop - tstart)))): break
+                tupdate = time.time() + update_interval
+
+        # analysis complete -- create solution dictionary
+        response = np.array(response).reshape(len(response), N)
+        self.result = {}
+        for name, index in self.node_map.items():
+            self.result[name] = 0 if index == -1 else response[:, index]
+        for v in self.voltage_sources:
+            self.result['I(%s)' % v.name] = response[:, v.branch]
+        self.result['_xvalues_'] = np.array(times[:len(response)])
+        self.result['_network_'] = self
+        return self.result
+
+    def pick_step(self):
+        min_shrink_factor = 1.0 / lte_step_decrease_factor
+        max_growth_factor = time_step_increase_factor
+
+        # poly coefficients
+        dtt0 = self.time - self.oldt
+        dtt1 = self.time - self.old2t
+        dtt2 = self.time - self.old3t
+        dt0dt1 = self.oldt - self.old2t
+        dt0dt2 = self.oldt - self.old3t
+        dt1dt2 = self.old2t - self.old3t
+        p0 = (dtt1 * dtt2) / (dt0dt1 * dt0dt2)
+        p1 = (dtt0 * dtt2) / (-dt0dt1 * dt1dt2)
+        p2 = (dtt0 * dtt1) / (dt0dt2 * dt1dt2)
+
+        trapcoeff = 0.5 * (self.time - self.oldt) / (self.time - self.old3t)
+        check = self.ltecheck
+        maxlteratio = 0.0
+        if check.any():
+            pred = p0 * self.oldsol[check] + p1 * self.old2sol[check] + p2 * self.old3sol[check]
+            lte = np.abs(self.solution[:self.N][check] - pred) * trapcoeff
+            lteratio = lte / (lterel * (self.abstol[check] + self.reltol * self.soln_max[check]))
+            maxlteratio = float(lteratio.max())
+
+        # cube root because trap
+        lte_step_ratio = 1.0 / maxlteratio**(1.0/3) if maxlteratio > 0 else float('inf')
+        if lte_step_ratio < 1.0:
+            # shrink the timestep to make lte
+            lte_step_ratio = max(lte_step_ratio, min_shrink_factor)
+            new_step = (self.time - self.oldt) * 0.75 * lte_step_ratio
+            new_step = max(new_step, self.min_step)
+        else:
+            lte_step_ratio = min(lte_step_ratio, max_growth_factor)
+            if lte_step_ratio > 1.2:   # increase timestep due to lte
+                new_step = (self.time - self.oldt) * lte_step_ratio / 1.2
+            else:
+                new_step = self.time - self.oldt
+            new_step = min(new_step, self.max_step)
+        return new_step
+
+    # define -f and df/dx for Newton solver
+    def load_tran(self, soln, rhs):
+        N = self.N
+        c = self.c
+        # crnt is initialized to -Gl * soln
+        c[:N] = -self.Gl_matrix.dot(soln[:N])
+        c[N] = 0
+        # G matrix is initialized with linear Gl
+        self.G[:] = self.Gl
+        # now load up the nonlinear parts of crnt and G
+        for d in self.loads: d.load_tran(self, soln, c, self.time)
+        # exploit the fact that storage elements are linear
+        self.q[:] = self.C_matrix.dot(soln[:N])
+        # -rhs = c - dqdt
+        dqdt = self.alpha0 * self.q + self.alpha1 * self.oldq + self.alpha2 * self.old2q
+        rhs[:N] = self.beta0[:N] * c[:N] + self.beta1[:N] * self.oldc[:N] - dqdt
+        rhs[N] = 0
+        # matrix = beta0*G + alpha0*C
+        self.matrix = self.beta0[self.slot_rows] * self.G + self.alpha0 * self.C
+        self.matrix_key = self.alpha0
+
+    # Returns an array of ones and zeros, ones denote algebraic variables:
+    # rows of C that can be removed without changing its rank.  cktsim.js
+    # finds them by Gaussian elimination, zeroing each row in turn.  C is
+    # the Laplacian of the capacitor network plus capacitance to ground
+    # and inductances on the diagonal, so the same rows are found from its
+    # connected groups of rows: empty rows are algebraic, and so is the
+    # first row of each group with no capacitance to ground.
+    def algebraic(self):
+        N = self.N
+        data = self.C[:self.nnz]
+        tol = eps * np.abs(data).max() if self.nnz else 0
+        nonzero = np.abs(data) > tol
+        rowsum = np.bincount(self.rows, weights=data, minlength=N)
+        rowabs = np.bincount(self.rows[nonzero], weights=np.abs(data[nonzero]), minlength=N)
+
+        parent = list(range(N))
+        for i, j in zip(self.rows[nonzero & (self.rows != self.cols)], self.cols[nonzero & (self.rows != self.cols)]):
+            a, b = _find(parent, i), _find(parent, j)
+            if a != b: parent[max(a, b)] = min(a, b)   # root is the group's first row
+
+        one_if_alg = np.zeros(N)
+        grounded = set()
+        for row in range(N):
+            if rowabs[row] == 0: one_if_alg[row] = 1
+            elif abs(rowsum[row]) > tol: grounded.add(_find(parent, row))
+        for row in range(N):
+            if rowabs[row] != 0 and _find(parent, row) == row and row not in grounded:
+                one_if_alg[row] = 1
+        return one_if_alg
+
+    # AC analysis: npts/decade for freqs in range [fstart,fstop]
+    # result['_frequencies_'] = array of sample freqs
+    # result['xxx'] = {'magnitude': array, 'phase': array} for node xxx
+    def ac(self, npts, fstart, fstop, source_name):
+        self.dc(True)   # make sure we can find operating point
+        N = self.N
+
+        # get the source used for ac: rhs is just its small signal
+        source_name = source_name.lower()
+        if source_name not in self.device_map:
+            raise CktsimError('AC analysis refers to unknown source ' + source_name)
+        rhs = np.zeros(N + 1)
+        self.device_map[source_name].load_ac(self, rhs)
+
+        # multiplicative frequency increase between freq points
+        delta_f = math.exp(math.log(10) / npts)
+        frequencies = []
+        f = fstart
+        fstop *= 1.0001   # capture that last freq point!
+        while f <= fstop:
+            frequencies.append(f)
+            f *= delta_f   # increment frequency
+
+        # compute the small signal response at all frequencies
+        x = self.ac_solve(2 * math.pi * np.array(frequencies), rhs[:N])
+        magnitude = np.abs(x)
+
+        # avoid wrapping phase, add or sub 360 for each one-step jump
+        # greater than 90 degrees (after the second point, as cktsim.js)
+        phase = np.degrees(np.arctan2(x.imag, x.real))
+        jump = np.diff(phase, axis=0)
+        offset = np.where(jump > 90, -360.0, 0.0) + np.where(jump < -90, 360.0, 0.0)
+        offset[:1] = 0
+        phase[1:] += np.cumsum(offset, axis=0)
+
+        self.result = {}
+        for name, index in self.node_map.items():
+            self.result[name] = {'magnitude': 0 if index == -1 else magnitude[:, index],
+                                 'phase': 0 if index == -1 else phase[:, index]}
+        self.result['_frequencies_'] = np.array(frequencies)
+        self.result['_network_'] = self
+        return self.result
+
+    # solutions x of (G + j omega C) x = rhs for each of an array of
+    # omegas, as an array with a row per omega.  G and C are fixed, so
+    # small circuits are solved as dense matrices a batch of frequencies
+    # at a time, larger ones with a sparse factorization per frequency
+    # that shares its column ordering with the others (see SparseLU).
+    def ac_solve(self, omegas, rhs):
+        N = self.N
+        x = np.zeros((len(omegas), N), dtype=complex)
+        dense = sparse is None or N <= ac_dense_max
+        if dense:
+            G = self.make_dense(self.G)
+            C = self.make_dense(self.C)
+            # batches of at most ~64MB of matrices
+            batch = max(1, (1 << 22) // max(1, N * N))
+            for i in range(0, len(omegas), batch):
+                w = omegas[i:i + batch]
+                try:
+                    x[i:i + batch] = np.linalg.solve(G + 1j * w[:, None, None] * C,
+                                                      np.tile(rhs, (len(w), 1))[:, :, None])[:, :, 0]
+                except np.linalg.LinAlgError:
+                    x[i:i + batch] = np.nan
+        # the rest one at a time, as are singular ones, through solve
+        b = rhs.astype(complex)
+        for i in np.nonzero(~np.isfinite(x).all(axis=1))[0] if dense else range(len(omegas)):
+            x[i] = self.solve(self.G + 1j * omegas[i] * self.C, b)
+        return x
+
+    # helper for adding devices to a circuit
+    def add_device(self, d, name):
+        self.devices.append(d)
+        d.name = name
+        if name: self.device_map[name] = d
+        return d
+
+    def r(self, n1, n2, v, name):
+        if v != 0: return self.add_device(Resistor(n1, n2, v), name)
+        return self.v(n1, n2, '0', name)   # zero resistance == 0V voltage source
+
+    def d(self, n1, n2, area, type, name):
+        if area != 0: return self.add_device(Diode(n1, n2, area, type), name)
+        return None   # zero area diodes discarded
+
+    def c(self, n1, n2, v, name):
+        return self.add_device(Capacitor(n1, n2, v), name)
+
+    def l(self, n1, n2, v, name):
+        branch = self.node(None, T_CURRENT)
+        return self.add_device(Inductor(n1, n2, branch, v), name)
+
+    def v(self, n1, n2, v, name):
+        branch = self.node(None, T_CURRENT)
+        d = VSource(n1, n2, branch, v)
+        self.voltage_sources.append(d)
+        return self.add_device(d, name)
+
+    def i(self, n1, n2, v, name):
+        d = ISource(n1, n2, v)
+        self.current_sources.append(d)
+        return self.add_device(d, name)
+
+    def opamp(self, nplus, nminus, no, ng, A, name):
+        branch = self.node(None, T_CURRENT)
+        return self.add_device(Opamp(nplus, nminus, no, ng, branch, A), name)
+
+    def n(self, d, g, s, W, L, name):
+        return self.add_device(Fet(d, g, s, W, L, name, 'n'), name)
+
+    def p(self, d, g, s, W, L, name):
+        return self.add_device(Fet(d, g, s, W, L, name, 'p'), name)
+
+##################################################
+##  Devices
+##################################################
+
+# Devices index rhs and the solution with node numbers, -1 being
+# ground, and G with the slots of their entries (see Circuit.slots).
+class Device(object):
+    # (row, column) of the entries the device loads into G
+    def entries(self):
+        return ()
+
+    # load the linear elements in to Gl and C
+    def load_linear(self, ckt):
+        pass
+
+    # load linear system equations for dc analysis
+    # (inductors shorted and capacitors opened)
+    def load_dc(self, ckt, soln, rhs):
+        pass
+
+    # load linear system equations for tran analysis
+    def load_tran(self, ckt, soln, rhs, time):
+        pass
+
+    # load linear system equations for ac analysis:
+    # current sources open, voltage sources shorted
+    # linear models at operating point for everyone else
+    def load_ac(self, ckt, rhs):
+        pass
+
+##################################################
+##  Sources
+##################################################
+
+class VSource(Device):
+    def __init__(self, npos, nneg, branch, v):
+        self.src = parse_source(v)
+        self.npos = npos
+        self.nneg = nneg
+        self.branch = branch
+
+    # MNA stamp for independent voltage source
+    def load_linear(self, ckt):
+        ckt.add_to_Gl(self.branch, self.npos, 1.0)
+        ckt.add_to_Gl(self.branch, self.nneg, -1.0)
+        ckt.add_to_Gl(self.npos, self.branch, 1.0)
+        ckt.add_to_Gl(self.nneg, self.branch, -1.0)
+
+    def load_dc(self, ckt, soln, rhs):
+        rhs[self.branch] += self.src.dc
+
+    def load_tran(self, ckt, soln, rhs, time):
+        rhs[self.branch] += self.src.value(time)
+
+    # small signal model ac value
+    def load_ac(self, ckt, rhs):
+        rhs[self.branch] += 1.0
+
+class ISource(Device):
+    def __init__(self, npos, nneg, v):
+        self.src = parse_source(v)
+        self.npos = npos
+        self.nneg = nneg
+
+    # MNA stamp for independent current source
+    def load_dc(self, ckt, soln, rhs):
+        i = self.src.dc
+        rhs[self.npos] -= i   # current flow into npos
+        rhs[self.nneg] += i   # and out of nneg
+
+    def load_tran(self, ckt, soln, rhs, time):
+        i = self.src.value(time)
+        rhs[self.npos] -= i
+        rhs[self.nneg] += i
+
+    def load_ac(self, ckt, rhs):
+        rhs[self.npos] -= 1.0
+        rhs[self.nneg] += 1.0
+
+##################################################
+##  Linear devices
+##################################################
+
+class Resistor(Device):
+    def __init__(self, n1, n2, v):
+        self.n1 = n1
+        self.n2 = n2
+        self.g = 1.0 / v
+
+    def load_linear(self, ckt):
+        ckt.add_conductance_l(self.n1, self.n2, self.g)
+
+class Capacitor(Device):
+    def __init__(self, n1, n2, v):
+        self.n1 = n1
+        self.n2 = n2
+        self.value = v
+
+    def load_linear(self, ckt):
+        ckt.add_capacitance(self.n1, self.n2, self.value)
+
+class Inductor(Device):
+    def __init__(self, n1, n2, branch, v):
+        self.n1 = n1
+        self.n2 = n2
+        self.branch = branch
+        self.value = v
+
+    # L on diag of C because L di/dt = v(n1) - v(n2)
+    def load_linear(self, ckt):
+        ckt.add_to_Gl(self.n1, self.branch, 1)
+        ckt.add_to_Gl(self.n2, self.branch, -1)
+        ckt.add_to_Gl(self.branch, self.n1, -1)
+        ckt.add_to_Gl(self.branch, self.n2, 1)
+        ckt.add_to_C(self.branch, self.branch, self.value)
+
+# simple voltage-controlled voltage source op amp model
+class Opamp(Device):
+    def __init__(self, nplus, nminus, no, ng, branch, A):
+        self.np = nplus
+        self.nn = nminus
+        self.no = no
+        self.ng = ng
+        self.branch = branch
+        self.gain = A
+
+    # MNA stamp for VCVS: 1/A(v(no) - v(ng)) - (v(np)-v(nn))) = 0
+    def load_linear(self, ckt):
+        invA = 1.0 / self.gain
+        ckt.add_to_Gl(self.no, self.branch, 1)
+        ckt.add_to_Gl(self.ng, self.branch, -1)
+        ckt.add_to_Gl(self.branch, self.no, invA)
+        ckt.add_to_Gl(self.branch, self.ng, -invA)
+        ckt.add_to_Gl(self.branch, self.np, -1)
+        ckt.add_to_Gl(self.branch, self.nn, 1)
+
+##################################################
+##  Nonlinear devices
+##################################################
+
+class Diode(Device):
+    def __init__(self, n1, n2, v, type):
+        self.anode = n1
+        self.cathode = n2
+        self.area = v
+        self.type = type   # 'normal' or 'ideal'
+        self.is_ = 1.0e-14
+        self.ais = self.area * self.is_
+        self.vt = 25.8e-3 if type == 'normal' else 0.1e-3   # 26mv or .1mv
+
+    def entries(self):
+        a, c = self.anode, self.cathode
+        return ((a, a), (a, c), (c, a), (c, c))
+
+# Simplified MOS FET with no bulk connection and no body effect.
+#
+# approx. SPICE params for MOSIS 0.25u TSMC process
+#  scale factor = 0.25u
+#  nfet: vth = 0.5V, K' = 120 uA/V**2
+#  pfet: vth = -0.5V, K' = -25 uA/V**2
+#  diffusions: area cap = 2000 aF/um**2, perimeter cap = 500 aF/um
+#  gate cap = 6000 aF/um**2
+class Fet(Device):
+    def __init__(self, d, g, s, W, L, name, type):
+        if type != 'n' and type != 'p': raise CktsimError('%s fet type is not n or p' % name)
+        self.d = d
+        self.g = g
+        self.s = s
+        self.name = name
+        self.W = W
+        self.L = L
+        self.ratio = float(W) / L
+        self.type_sign = 1 if type == 'n' else -1
+        self.vt = 0.5
+        self.kp = 120e-6 if type == 'n' else 25e-6
+        self.beta = self.kp * self.ratio
+        self.lambda_ = 0.05
+        self.g_leak = 1.0e-8 * self.beta
+
+    # the entries for either assignment of drain and source
+    def entries(self):
+        d, g, s = self.d, self.g, self.s
+        return ((d, d), (d, s), (s, d), (s, s), (d, g), (s, g))
+
+    def load_linear(self, ckt):
+        # a small leakage current -- helps with correct DC analysis
+        ckt.add_conductance_l(self.d, self.s, self.g_leak)
+
+        # in the absence of a bulk terminal, use the ground node
+
+        # diffusion capacitances.  No sidewall cap on channel-side.
+        W = self.W * 0.25
+        L = 4 * 0.25   # assume diffusions are 4 lambda wide
+        ckt.add_capacitance(self.d, ckt.gnd_node(), 2000e-18 * W * L + 500e-18 * (W + 2 * L))
+        ckt.add_capacitance(self.s, ckt.gnd_node(), 2000e-18 * W * L + 500e-18 * (W + 2 * L))
+
+        # gate capacitance
+        L = self.L * 0.25
+        ckt.add_capacitance(self.g, ckt.gnd_node(), 6000e-18 * W * L)
+
+# Nonlinear devices of one kind, evaluated together.  cktsim.js loads
+# each diode and fet by itself on every Newton step, which is most of
+# the work for CMOS circuits.  Here their parameters and terminals are
+# kept as arrays, one element per device, so a step computes the current
+# and conductances of all of them in one numpy pass, then adds those into
+# rhs and G with a bincount over the devices' rows and slots.  Ground
+# terminals are node N, the extra element at the end of rhs and the
+# solution, and their entries go to the extra slot at the end of G.
+class Devices(Device):
+    def __init__(self, ckt):
+        self.N = ckt.N
+        self.nnz = ckt.nnz
+
+    def nodes(self, nodes):
+        return np.where(nodes < 0, self.N, nodes)
+
+    # add currents i[k] flowing out of nodes n1[k] and into n2[k], and
+    # the G entries values[e][k] at slots[e][k]
+    def stamp(self, rhs, G, n1, n2, i, slots, values):
+        rhs += np.bincount(np.concatenate((n1, n2)), weights=np.concatenate((-i, i)), minlength=self.N + 1)
+        G += np.bincount(slots.ravel(), weights=values.ravel(), minlength=self.nnz + 1)
+
+    def load_tran(self, ckt, soln, rhs, time):
+        self.load_dc(ckt, soln, rhs)
+
+class Diodes(Devices):
+    def __init__(self, ckt, diodes):
+        Devices.__init__(self, ckt)
+        self.count = len(diodes)
+        self.ais = np.array([d.ais for d in diodes])
+        self.vt = np.array([d.vt for d in diodes])
+        self.exp_arg_max = 50   # less than single precision max
+        self.exp_max = math.exp(self.exp_arg_max)
+        a = np.array([d.anode for d in diodes], dtype=np.int64)
+        c = np.array([d.cathode for d in diodes], dtype=np.int64)
+        self.anode, self.cathode = self.nodes(a), self.nodes(c)
+        self.slots = np.array([ckt.slots(r, c) for r, c in ((a, a), (a, c), (c, a), (c, c))])
+
+    def load_dc(self, ckt, soln, rhs):
+        if not self.count: return
+        exp_arg = (soln[self.anode] - soln[self.cathode]) / self.vt
+        # estimate exponential with a quadratic if arg too big
+        abs_exp_arg = np.abs(exp_arg)
+        d_arg = abs_exp_arg - self.exp_arg_max
+        big = d_arg > 0
+        temp1 = np.exp(np.minimum(abs_exp_arg, self.exp_arg_max))
+        temp2 = np.where(big, self.exp_max * (1 + d_arg), temp1)
+        temp1 = np.where(big, self.exp_max * (1 + d_arg + 0.5 * d_arg * d_arg), temp1)
+        # use exp(-x) = 1.0/exp(x)
+        negative = exp_arg < 0
+        temp1 = np.where(negative, 1.0 / temp1, temp1)
+        temp2 = np.where(negative, (temp1 * temp2) * temp1, temp2)
+        id = self.ais * (temp1 - 1)
+        gd = self.ais * (temp2 / self.vt)
+        # current flows into anode and out of cathode
+        self.stamp(rhs, ckt.G, self.anode, self.cathode, id, self.slots, np.array((gd, -gd, -gd, gd)))
+
+class Fets(Devices):
+    def __init__(self, ckt, fets):
+        Devices.__init__(self, ckt)
+        self.count = len(fets)
+        self.W = np.array([f.W for f in fets], dtype=float)
+        self.L = np.array([f.L for f in fets], dtype=float)
+        self.sign = np.array([f.type_sign for f in fets], dtype=float)
+        self.vt = np.array([f.vt for f in fets])
+        self.beta = np.array([f.beta for f in fets])
+        self.lambda_ = np.array([f.lambda_ for f in fets])
+        d = np.array([f.d for f in fets], dtype=np.int64)
+        g = np.array([f.g for f in fets], dtype=np.int64)
+        s = np.array([f.s for f in fets], dtype=np.int64)
+        self.d, self.g, self.s = self.nodes(d), self.nodes(g), self.nodes(s)
+        # slots of dd, ds, sd, ss, dg, sg and of the same entries with
+        # drain and source swapped
+        self.slots = np.array([ckt.slots(r, c) for r, c in ((d, d), (d, s), (s, d), (s, s), (d, g), (s, g))])
+        self.swapped_slots = self.slots[[3, 2, 1, 0, 5, 4]]
+
+    def load_dc(self, ckt, soln, rhs):
+        if not self.count: return
+        sign = self.sign
+        vd = soln[self.d]
+        vs = soln[self.s]
+        # drain and source have swapped roles where vds < 0
+        swapped = sign * (vd - vs) < 0
+        d = np.where(swapped, self.s, self.d)
+        s = np.where(swapped, self.d, self.s)
+        vds = np.abs(vd - vs)
+        vgst = sign * (soln[self.g] - np.where(swapped, vd, vs)) - self.vt
+        on = vgst > 0.0   # vgst < 0, transistor off, no subthreshold here
+        sat = vgst < vds
+        beta = self.beta
+        lambda_ = self.lambda_
+        g0 = beta * (1 + lambda_ * vds)
+        # saturation, else linear region
+        gmgs = np.where(sat, g0 * vgst, g0 * vds)
+        ids = np.where(sat, 0.5 * g0 * vgst * vgst, g0 * vds * (vgst - 0.50 * vds))
+        gds = np.where(sat, 0.5 * beta * vgst * vgst * lambda_,
+                       g0 * (vgst - vds) + beta * lambda_ * vds * (vgst - 0.5 * vds))
+        ids = np.where(on, sign * ids, 0.0)
+        gds = np.where(on, gds, 0.0)
+        gmgs = np.where(on, gmgs, 0.0)
+        # current flows into the drain and out the source
+        self.stamp(rhs, ckt.G, d, s, ids, np.where(swapped, self.swapped_slots, self.slots),
+                   np.array((gds, -gds - gmgs, -gds, gds + gmgs, gmgs, -gmgs)))
+
+# simulate a module that includes its own sources, eg
+#   python cktsim.py files/analog mylib /user/test --tran 10n --node out
+# prints as json {node: value, ...} for the dc operating point, or for
+# each node [[source values...], [values...]] for --sweep, [[times...],
+# [values...]] for --tran, [[frequencies...], [magnitudes...],
+# [phases...]] for --ac
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    import netlist
+    from utils import parse_number_alert
+
+    parser = argparse.ArgumentParser(description='Device-level simulation of a Jade module')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/), including files/analog')
+    parser.add_argument('module', help='name of module to simulate, eg /user/test')
+    parser.add_argument('--tran', metavar='TSTOP', help='transient analysis out to TSTOP, eg 10n')
+    parser.add_argument('--ac', nargs=3, metavar=('SOURCE', 'FSTART', 'FSTOP'), help='ac analysis, eg --ac vin 10 1G')
+    parser.add_argument('--sweep', nargs=4, metavar=('SOURCE', 'START', 'STOP', 'STEP'), help='dc sweep of a source, eg --sweep vin 0 2.5 0.1')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes for --sweep (default: one per cpu)')
+    parser.add_argument('--node', action='append', default=[], help='report node (default: all top-level nodes)')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    try:
+        nl = netlist.device_netlist(modules, args.module)
+        if args.tran:
+            result = transient_analysis(nl, parse_number_alert(args.tran))
+            axis = result and result['_xvalues_']
+        elif args.ac:
+            source, fstart, fstop = args.ac
+            result = ac_analysis(nl, parse_number_alert(fstart), parse_number_alert(fstop), source)
+            axis = result and result['_frequencies_']
+        elif args.sweep:
+            source, start, stop, step = args.sweep
+            result = dc_analysis(nl, {'source': source, 'start': parse_number_alert(start),
+                                      'stop': parse_number_alert(stop), 'step': parse_number_alert(step)},
+                                 jobs=args.jobs)
+            axis = result and result['_sweep1_']
+        else:
+            result = dc_analysis(nl)
+            axis = None
+    except (netlist.NetlistError, CktsimError, ValueError) as e:
+        sys.exit(str(e))
+    if result is None: sys.exit('Nothing to simulate')
+
+    # ground's values are just 0
+    def series(v):
+        return (np.zeros(len(axis)) + v).tolist()
+
+    names = args.node or sorted(n for n in result if '.' not in n and '$' not in n and not n.startswith('_'))
+    output = {}
+    for name in names:
+        if name not in result: sys.exit('No such node: ' + name)
+        v = result[name]
+        if axis is None: output[name] = v[0]
+        elif args.ac: output[name] = [series(axis), series(v['magnitude']), series(v['phase'])]
+        else: output[name] = [series(axis), series(v)]
+    json.dump(output, sys.stdout)
+    sys.stdout.write('\n')
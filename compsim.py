@@ -0,0 +1,788 @@
+# Cycle-based simulation of synchronous gate netlists by compiled code.
+#
+# gatesim.py interprets a netlist an event at a time, with every delay.
+# To check what a synchronous design computes, eg running the lab 5 Beta
+# checkoff, the delays don't matter.  Here the combinational gates are
+# levelized once and each gate becomes a lookup in a flat table of its
+# output for every combination of input values, built from gatesim's
+# (lenient) tables, so X's come out the same way.  Registers and memory
+# write ports are updated on the rising edges of their clocks with the
+# values from before the edge.
+#
+# A compiled circuit is kept as arrays rather than objects: node values
+# are bytes, the gates are arrays of output and input node indicies
+# grouped by level and type, and the node names are a separate table
+# that's only loaded when a node is looked up by name, so a netlist
+# with a million gates takes tens of megabytes once it's compiled, and
+# run a group of gates at a time with numpy.  Small circuits (or any
+# circuit, without numpy) are run by generating straight-line Python
+# functions that evaluate every gate in order, which is faster for them
+# but takes much more memory to compile.
+#
+# Compiling takes longer than most runs, so compiled circuits are kept
+# in a cache directory under a hash of the netlist.  Delays are ignored:
+# a design that passes here can still fail in gatesim if it's too slow
+# for the test's clock.
+#
+#   import netlist, grader, compsim
+#   modules = netlist.merge_libraries(netlist.load_library('files/gates'),
+#                                     netlist.load_library('files/ward'))
+#   spec = grader.parse_test(grader.test_source(modules['/notes/acc32']))
+#   nl, errors = grader.test_netlist(modules, '/notes/acc32', spec, ('gate',))
+#   circuit = compsim.test_circuit(nl, spec)
+#   print(compsim.run_test(circuit, spec)['status'])
+
+import hashlib
+import marshal
+import os
+import sys
+from array import array
+
+import gatesim
+import resultcache
+from gatesim import V0, V1, VX, VZ
+from utils import parse_source, engineering_notation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class CompsimError(Exception):
+    pass
+
+VERSION = 3   # of the compiled circuits, part of the cache key
+
+# where compiled netlists are kept unless Circuit is told otherwise
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'jade', 'compsim')
+
+# evaluating a group of gates with numpy costs about as much as this
+# many gates of generated code
+numpy_group_cost = 32
+
+# generated code takes a few KB per gate to compile, so bigger circuits
+# always use numpy if it's available
+code_max_gates = 20000
+
+# gates per generated function: each is compiled on its own, so the
+# source and syntax tree of only one is in memory at a time
+code_chunk = 5000
+
+# contents of an array as a string of bytes, and back
+def _bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+def _array(typecode, data):
+    a = array(typecode)
+    if hasattr(a, 'frombytes'): a.frombytes(data)
+    else: a.fromstring(data)
+    return a
+
+class _Node(object):
+    __slots__ = ('v',)
+
+class _Gate(object):
+    def __init__(self, table, inputs):
+        self.table = table
+        self.inputs = inputs
+
+_tables = {}   # (type, arity) -> flat table
+
+# gatesim's output for every combination of input values of a gate,
+# indexed by the input values packed 2 bits each, first input first
+def flat_table(type, arity):
+    result = _tables.get((type, arity))
+    if result is not None: return result
+    inputs = [_Node() for i in range(arity)]
+    gate = _Gate(gatesim.BusTable if type == 'BUS' else gatesim.logic_gates[type][2], inputs)
+    evaluate = gatesim.LogicGate.__dict__['mux4_eval' if type == 'mux4' else 'logic_eval']
+    result = []
+    for index in range(4 ** arity):
+        for i, n in enumerate(inputs): n.v = (index >> 2*(arity - 1 - i)) & 3
+        result.append(evaluate(gate))
+    result = _tables[(type, arity)] = tuple(result)
+    return result
+
+def _index(slots):
+    n = len(slots)
+    return '|'.join('v[%d]<<%d' % (s, 2*(n - 1 - i)) if i < n - 1 else 'v[%d]' % s
+                    for i, s in enumerate(slots))
+
+def _function(n, lines):
+    return 'def settle%d(v):\n%s\n    return v\n' % (n, '\n'.join(lines))
+
+def _single(name):
+    return name[0] if isinstance(name, list) else name
+
+_z_to_x = bytes(bytearray(VX if i == VZ else i for i in range(256)))
+
+##################################################
+##  Compiling a netlist
+##################################################
+
+# Levelize a netlist into arrays.  Every value is kept in a slot: first
+# one per node, then one per driver of nodes with several (tristate)
+# drivers, which are resolved into the node by a chain of BUS gates.
+# description() is what Circuit needs, all plain values so it can be
+# marshalled into the cache.
+class _Compiler(object):
+    def __init__(self, netlist, inputs):
+        self.aliases = {}
+        for component in netlist:
+            if component['type'] == 'ground':
+                self.make_alias('gnd', component['connections']['gnd'])
+        for component in netlist:
+            if component['type'] == 'connect':
+                c = list(component['connections'].values())
+                for name in c[1:]: self.make_alias(c[0], name)
+
+        self.node_map = {}           # name -> node index
+        self.names = []              # node names
+        self.ndrivers = array('i')   # number of drivers of each node
+        gnd = self.node('gnd')
+        self.ndrivers[gnd] = 1
+
+        # first count the drivers of each node, so nodes with just one
+        # can be driven directly
+        skip = set()   # constants and sources on nodes that are already driven
+        for i, component in enumerate(netlist):
+            type = component['type']
+            if type in ('ground', 'connect', 'voltage probe'): continue
+            c = component['connections']
+            for name in c.values(): self.node(name)
+            if type in gatesim.logic_gates: driven = [c[gatesim.logic_gates[type][1]]]
+            elif type == 'constant0' or type == 'constant1': driven = [c['z']]
+            elif type == 'voltage source': driven = [c['nplus']]
+            elif type == 'dreg': driven = [c['q']]
+            elif type == 'memory':
+                driven = []
+                for p in component['properties'].get('ports', []):
+                    oe = self.node(_single(p['oe']))
+                    for name in [_single(p['clk']), _single(p['wen'])] + p['addr'] + p['data']: self.node(name)
+                    if oe != gnd: driven.extend(p['data'])
+            else:
+                continue
+            if type in ('constant0', 'constant1', 'voltage source') and self.ndrivers[self.node(driven[0])]:
+                skip.add(i)
+                continue
+            for name in driven: self.ndrivers[self.node(name)] += 1
+        input_nodes = {}
+        for name in inputs: input_nodes.setdefault(self.node(name), []).append(name)
+        for n in input_nodes: self.ndrivers[n] += 1
+
+        self.nslots = len(self.names)
+        self.buses = {}              # node -> slots of its drivers
+        self.tables = []             # (type, arity) of each table
+        self.table_ids = {}
+        self.op_table = array('B')   # gates: table,
+        self.op_out = array('i')     # output slot,
+        self.op_start = array('i', [0])
+        self.op_in = array('i')      # and input slots, from op_start[i] to op_start[i+1]
+        self.reads = []              # read ports: (mem, port, input slots, output slots)
+        self.fixed = [(gnd, V0)]     # (slot, value)
+        self.inputs = {}             # name -> slot
+        self.regs = []               # (clk, d, q)
+        self.mems = []               # (name, width, nlocations, contents, ports)
+        for i, component in enumerate(netlist):
+            type = component['type']
+            if type in ('ground', 'connect', 'voltage probe') or i in skip: continue
+            properties = component['properties']
+            name = properties.get('name')
+            c = component['connections']
+
+            if type in gatesim.logic_gates:
+                inputs_t, output, table = gatesim.logic_gates[type]
+                self.gate(type, [self.node(c[t]) for t in inputs_t], self.driver_slot(c[output], type == 'tristate'))
+            elif type == 'constant0' or type == 'constant1':
+                self.fixed.append((self.driver_slot(c['z'], False), V0 if type == 'constant0' else V1))
+            elif type == 'voltage source':
+                source = parse_source(properties['value'])
+                if source.fun != 'dc':
+                    raise CompsimError('%s is a %s() source, only dc sources can be used' % (name, source.fun))
+                v = source.args[0]
+                self.fixed.append((self.driver_slot(c['nplus'], False), V0 if v <= 0.1 else (V1 if v >= 0.9 else VX)))
+            elif type == 'dreg':
+                self.regs.append((self.node(c['clk']), self.node(c['d']), self.driver_slot(c['q'], False)))
+            elif type == 'memory':
+                self.memory(name, properties)
+            elif type in ('dlatch', 'dlatchn'):
+                raise CompsimError('%s (%s) is not edge-triggered, use gatesim instead' % (name, type))
+            else:
+                raise CompsimError('Unrecognized gate: ' + type)
+
+        # inputs driven by the test, possibly alongside the circuit
+        for n, names in sorted(input_nodes.items()):
+            slot = self.driver_slot(names[0], True)
+            for name in names: self.inputs[name] = slot
+
+        # BUS resolution is associative, so resolve a pair at a time
+        for n, slots in sorted(self.buses.items()):
+            z = slots[0]
+            for i, slot in enumerate(slots[1:]):
+                out = n if i == len(slots) - 2 else self.new_slot()
+                self.gate('BUS', [z, slot], out)
+                z = out
+
+        # nodes that are read but nothing drives
+        used = [self.op_in]
+        used.extend(read[2] for read in self.reads)
+        used.extend((clk, d) for clk, d, q in self.regs)
+        for name, width, nlocations, contents, ports in self.mems:
+            used.extend([clk, wen] + addr + data for clk, wen, oe, addr, data, read, write in ports if write)
+        nnodes = len(self.names)
+        floating = [s for slots in used for s in slots if s < nnodes and not self.ndrivers[s]]
+        if floating:
+            raise CompsimError('Node %s is not connected to any output' % self.names[min(floating)])
+
+        self.levelize()
+
+    def make_alias(self, name1, name2):
+        name1 = self.unalias(name1)
+        name2 = self.unalias(name2)
+        if name1 == name2: return
+        if name2 == 'gnd': name1, name2 = name2, name1
+        self.aliases[name2] = name1
+
+    def unalias(self, name):
+        while name in self.aliases: name = self.aliases[name]
+        return name
+
+    def node(self, name):
+        name = self.unalias(name)
+        n = self.node_map.get(name)
+        if n is None:
+            n = len(self.names)
+            self.node_map[name] = n
+            self.names.append(name)
+            self.ndrivers.append(0)
+        return n
+
+    def new_slot(self):
+        self.nslots += 1
+        return self.nslots - 1
+
+    # slot for a driver of node name: the node's own if it's the only one
+    def driver_slot(self, name, tristate):
+        n = self.node(name)
+        if self.ndrivers[n] == 1: return n
+        if not tristate: raise CompsimError('Node %s is driven by multiple gates' % self.names[n])
+        slot = self.new_slot()
+        self.buses.setdefault(n, []).append(slot)
+        return slot
+
+    def slot_name(self, slot):
+        return self.names[slot] if slot < len(self.names) else 'bus driver %d' % slot
+
+    def gate(self, type, inputs, out):
+        tid = self.table_ids.get((type, len(inputs)))
+        if tid is None:
+            tid = self.table_ids[(type, len(inputs))] = len(self.tables)
+            self.tables.append((type, len(inputs)))
+        self.op_table.append(tid)
+        self.op_out.append(out)
+        self.op_in.extend(inputs)
+        self.op_start.append(len(self.op_in))
+
+    def memory(self, name, properties):
+        width = properties.get('width')
+        if not width or width <= 0:
+            raise CompsimError('Memory %s must have width > 0.' % name)
+        nlocations = properties.get('nlocations')
+        if not nlocations or nlocations <= 0:
+            raise CompsimError('Memory %s must have > 0 locations.' % name)
+        gnd = self.node('gnd')
+        ports = []
+        for p in properties.get('ports', []):
+            clk, wen, oe = [self.node(_single(p[t])) for t in ('clk', 'wen', 'oe')]
+            addr = [self.node(n) for n in p['addr']]
+            data = [self.node(n) for n in p['data']]
+            read = oe != gnd
+            write = clk != gnd or wen != gnd
+            if read:
+                self.reads.append((len(self.mems), len(ports), [oe] + addr,
+                                   [self.driver_slot(n, True) for n in p['data']]))
+            ports.append((clk, wen, oe, addr, data, read, write))
+        self.mems.append((name, width, nlocations, properties.get('contents'), ports))
+
+    # order the gates by level, the length of the longest path to them
+    # from a register, input or constant, and by type within a level, so
+    # each group of gates only depends on earlier groups
+    def levelize(self):
+        nops = len(self.op_out)
+        op_start, op_in, reads = self.op_start, self.op_in, self.reads
+        n = nops + len(reads)   # the read ports come after the gates
+
+        def inputs(i):
+            return op_in[op_start[i]:op_start[i+1]] if i < nops else reads[i - nops][2]
+
+        def outputs(i):
+            return (self.op_out[i],) if i < nops else reads[i - nops][3]
+
+        producer = array('i', [-1]) * self.nslots
+        for i in range(n):
+            for s in outputs(i): producer[s] = i
+
+        # fanouts of each slot, compressed: the ops reading slot s are
+        # fanout[start[s]:start[s+1]]
+        start = array('i', [0]) * (self.nslots + 1)
+        indegree = array('i', [0]) * n
+        for i in range(n):
+            for s in inputs(i):
+                if producer[s] >= 0:
+                    start[s + 1] += 1
+                    indegree[i] += 1
+        for s in range(self.nslots): start[s + 1] += start[s]
+        fanout = array('i', [0]) * start[-1]
+        fill = array('i', start)
+        for i in range(n):
+            for s in inputs(i):
+                if producer[s] >= 0:
+                    fanout[fill[s]] = i
+                    fill[s] += 1
+
+        level = array('i', [0]) * n
+        queue = array('i', [i for i in range(n) if indegree[i] == 0])
+        head = 0
+        while head < len(queue):
+            i = queue[head]
+            head += 1
+            next = level[i] + 1
+            for s in outputs(i):
+                for j in fanout[start[s]:start[s+1]]:
+                    if level[j] < next: level[j] = next
+                    indegree[j] -= 1
+                    if indegree[j] == 0: queue.append(j)
+
+        if len(queue) < n:
+            # every op left over has an input from another, follow them
+            # back until one repeats
+            i = [i for i in range(n) if indegree[i]][0]
+            seen = set()
+            while i not in seen:
+                seen.add(i)
+                s = [s for s in inputs(i) if producer[s] >= 0 and indegree[producer[s]]][0]
+                i = producer[s]
+            raise CompsimError('Combinational cycle through node ' + self.slot_name(s))
+
+        # a group is (table, first gate, number of gates, first input),
+        # with the gates' inputs stored an input at a time, so input k of
+        # gate j is ins[first input + k*number of gates + j].  A read
+        # port is (-1, read port, 0, 0).
+        order = sorted(range(n), key=lambda i: level[i] << 8 | (self.op_table[i] if i < nops else 255))
+        self.out = array('i')
+        self.ins = array('i')
+        self.schedule = []
+        first = 0
+        while first < len(order):
+            i = order[first]
+            if i >= nops:
+                self.schedule.append((-1, i - nops, 0, 0))
+                first += 1
+                continue
+            key = level[i] << 8 | self.op_table[i]
+            last = first
+            while last < len(order) and order[last] < nops and level[order[last]] << 8 | self.op_table[order[last]] == key:
+                last += 1
+            group = order[first:last]
+            arity = self.tables[self.op_table[i]][1]
+            self.schedule.append((self.op_table[i], len(self.out), len(group), len(self.ins)))
+            self.out.extend(self.op_out[j] for j in group)
+            for k in range(arity): self.ins.extend(op_in[op_start[j] + k] for j in group)
+            first = last
+
+    def description(self):
+        return {
+            'nslots': self.nslots,
+            'tables': self.tables,
+            'out': _bytes(self.out),
+            'ins': _bytes(self.ins),
+            'schedule': self.schedule,
+            'reads': self.reads,
+            'fixed': self.fixed,
+            'inputs': self.inputs,
+            'regs': self.regs,
+            'mems': self.mems,
+        }
+
+    # the names table: all the node names, one per line, and the aliases
+    def names_table(self):
+        return ('\n'.join(self.names), [(name, self.node(name)) for name in self.aliases])
+
+##################################################
+##  Circuit
+##################################################
+
+# marshal's encoding is lossless, so equal hashes mean equal netlists.
+# (The same netlist can encode differently if it was built differently,
+# which just costs a compile.)
+def netlist_hash(netlist, inputs=()):
+    h = hashlib.sha1(('%d %s %s' % (VERSION, sys.version, sys.byteorder)).encode('utf-8'))
+    h.update(marshal.dumps((sorted(inputs), netlist)))
+    return h.hexdigest()
+
+class Circuit(object):
+    # netlist is a list of devices as produced by netlist.gate_netlist,
+    # inputs the names of nodes the test drives.  cache_dir is where
+    # compiled netlists are kept, None to compile every time.  engine is
+    # 'code', 'levels' (needs numpy) or 'auto' to pick the faster one.
+    def __init__(self, netlist, inputs=(), cache_dir=default_cache_dir, engine='auto'):
+        self.key = netlist_hash(netlist, inputs)
+        self.path = os.path.join(cache_dir, self.key) if cache_dir else None
+        entry = _load(self.path)
+        self.cached = entry is not None
+        self._names = None
+        self._node_map = None
+        if entry is None:
+            compiler = _Compiler(netlist, inputs)
+            entry = (compiler.description(), None)
+            self._names = compiler.names_table()
+            if self.path: _store(self.path + '.names', self._names)
+
+        description, code = entry
+        self.__dict__.update(description)
+        self.out = _array('i', self.out)
+        self.ins = _array('i', self.ins)
+        if engine == 'auto':
+            groups = len(self.schedule) - len(self.reads)
+            engine = 'levels' if numpy is not None and (len(self.out) > code_max_gates or
+                                                        len(self.out) >= numpy_group_cost * groups) else 'code'
+        elif engine == 'levels' and numpy is None:
+            raise CompsimError('The levels engine needs numpy')
+        elif engine not in ('code', 'levels'):
+            raise CompsimError('Unknown engine: %s' % engine)
+        self.engine = engine
+
+        readers = [self._reader(read[0]) for read in self.reads]
+        if engine == 'code':
+            if code is None:
+                code = [compile(source, '<compsim %s>' % self.key[:12], 'exec') for source in self.sources()]
+                entry = (description, code)
+                self.cached = False
+            namespace = dict(('T%d' % tid, flat_table(*t)) for tid, t in enumerate(self.tables))
+            namespace.update(('R%d' % r, read) for r, read in enumerate(readers))
+            for c in code: exec(c, namespace)
+            parts = [namespace['settle%d' % i] for i in range(len(code))]
+
+            def settle(v):
+                for part in parts: part(v)
+                return v
+            self._settle = settle
+        else:
+            self._settle = self._levels(readers)
+        if self.path and not self.cached: _store(self.path, entry)
+
+        # registers and memory write ports by clock
+        self.clocked = {}   # clk slot -> ([(d, q)], [(mem, port)])
+        for clk, d, q in self.regs: self.clocked.setdefault(clk, ([], []))[0].append((d, q))
+        for m, (name, width, nlocations, contents, ports) in enumerate(self.mems):
+            for p, port in enumerate(ports):
+                if port[6]: self.clocked.setdefault(port[0], ([], []))[1].append((m, p))
+        self.reset()
+
+    # name -> slot for every node, loaded when first needed
+    @property
+    def node_map(self):
+        if self._node_map is None:
+            if self._names is None: self._names = _load(self.path + '.names')
+            if self._names is None: raise CompsimError('Node names for %s are missing from the cache' % self.key)
+            names, aliases = self._names
+            self._node_map = dict((name, n) for n, name in enumerate(names.split('\n')))
+            self._node_map.update(aliases)
+        return self._node_map
+
+    # sources of settle0(v), settle1(v), ..., which between them evaluate
+    # every gate in order, code_chunk gates each
+    def sources(self):
+        n = 0
+        lines = []
+        for line in self._lines():
+            lines.append(line)
+            if len(lines) == code_chunk:
+                yield _function(n, lines)
+                n += 1
+                lines = []
+        if lines or n == 0: yield _function(n, lines)
+
+    # a line of code for each gate and memory read, in order
+    def _lines(self):
+        out, ins = self.out, self.ins
+        for tid, first, count, first_in in self.schedule:
+            if tid < 0:
+                m, p, inputs, outputs = self.reads[first]
+                yield '    %s, = R%d(%s)' % (', '.join('v[%d]' % s for s in outputs), first,
+                                             ', '.join('v[%d]' % s for s in inputs))
+                continue
+            arity = self.tables[tid][1]
+            for j in range(count):
+                inputs = [ins[first_in + k*count + j] for k in range(arity)]
+                yield '    v[%d] = T%d[%s]' % (out[first + j], tid, _index(inputs))
+
+    # settle(v) that evaluates a group of gates at a time with numpy
+    def _levels(self, readers):
+        out = numpy.frombuffer(self.out, numpy.int32).astype(numpy.intp)
+        ins = numpy.frombuffer(self.ins, numpy.int32).astype(numpy.intp)
+        steps = []
+        for tid, first, count, first_in in self.schedule:
+            if tid < 0:
+                m, p, inputs, outputs = self.reads[first]
+                steps.append((None, readers[first], inputs, outputs))
+                continue
+            arity = self.tables[tid][1]
+            columns = [ins[first_in + k*count:first_in + (k + 1)*count] for k in range(arity)]
+            # indicies past 255 need more than a byte
+            steps.append((numpy.array(flat_table(*self.tables[tid]), numpy.uint8),
+                          arity > 4, columns, out[first:first + count]))
+
+        def settle(v):
+            values = numpy.frombuffer(v, numpy.uint8)
+            for table, wide, columns, outputs in steps:
+                if table is None:
+                    for s, x in zip(outputs, wide(*[v[s] for s in columns])): v[s] = x
+                    continue
+                index = values[columns[0]]
+                if wide: index = index.astype(numpy.uint16)
+                for c in columns[1:]: index = index << 2 | values[c]
+                values[outputs] = table[index]
+            return v
+        return settle
+
+    # read function for memory m: oe and address values in, data values
+    # (most significant bit first) out
+    def _reader(self, m):
+        name, width, nlocations, contents, ports = self.mems[m]
+        zs = bytearray([VZ]) * width
+        xs = bytearray([VX]) * width
+
+        def read(oe, *addr):
+            if oe == V0: return zs
+            if oe != V1: return xs
+            a = 0
+            for v in addr:
+                if v > V1: return xs
+                a = 2*a + v
+            if a >= nlocations: return xs
+            word = self.bits[m][a*width:(a + 1)*width]
+            # a stored Z reads as X, as through gatesim's tristate driver
+            if VZ in word: word = word.translate(_z_to_x)
+            return word
+        return read
+
+    # start over: every node X, registers X, memories with their initial contents
+    def reset(self):
+        v = self.v = bytearray([VX]) * self.nslots
+        for slot, x in self.fixed: v[slot] = x
+        # each memory's bits, a word at a time, most significant bit first
+        self.bits = []
+        for name, width, nlocations, contents, ports in self.mems:
+            bits = bytearray([VX]) * (nlocations * width)
+            for i, word in enumerate((contents or [])[:nlocations]):
+                if word is not None:
+                    bits[i*width:(i + 1)*width] = bytearray((word >> j) & 1 for j in reversed(range(width)))
+            self.bits.append(bits)
+        self.armed = set()   # clocks that have been 0 since their last rising edge
+        self.pending = []
+        self._settle(v)
+
+    # drive an input node to V0, V1 or VZ, takes effect at the next update
+    def set(self, name, value):
+        slot = self.inputs.get(name)
+        if slot is None: raise CompsimError('%s is not an input' % name)
+        self.pending.append((slot, value))
+
+    # apply the pending input changes and let the circuit settle, clocking
+    # registers and write ports on rising edges along the way
+    def update(self, max_passes=100):
+        v = self.v
+        rewrite = False
+        for i in range(max_passes):
+            if not self.pending and not rewrite: return
+            old = v[:]
+            for slot, x in self.pending: v[slot] = x
+            self.pending = []
+            self._settle(v)
+
+            rewrite = False
+            for clk, (regs, ports) in self.clocked.items():
+                was, now = old[clk], v[clk]
+                if now == V0: self.armed.add(clk)
+                if was == now: continue
+                if now == V1 and clk in self.armed:
+                    self.armed.discard(clk)
+                    for d, q in regs: self.pending.append((q, old[d]))
+                    for m, p in ports: rewrite |= self._write(m, p, old)
+                elif now > V1:
+                    # lenient registers keep their value if D agrees
+                    for d, q in regs:
+                        if old[q] != old[d]: self.pending.append((q, VX))
+        raise CompsimError('Circuit did not settle after %d passes, is a clock oscillating?' % max_passes)
+
+    # write port p of memory m with the values from before a clock edge
+    def _write(self, m, p, old):
+        name, width, nlocations, contents, ports = self.mems[m]
+        clk, wen, oe, addr, data, read, write = ports[p]
+        if old[wen] == V0: return False
+        a = 0
+        for n in addr:
+            if old[n] > V1:
+                a = None
+                break
+            a = 2*a + old[n]
+        bits = self.bits[m]
+        if a is None:
+            bits[:] = bytearray([VX]) * len(bits)
+        elif a < nlocations:
+            bits[a*width:(a + 1)*width] = bytearray(old[n] for n in data) if old[wen] == V1 else bytearray([VX]) * width
+        return True
+
+    # current value of a node, None if there's no such node
+    def value(self, name):
+        slot = self.node_map.get(name)
+        return None if slot is None else self.v[slot]
+
+    # contents of named memory as a list of values, an element is None if
+    # any bits in corresponding word are X
+    def get_memory(self, name):
+        for m, (mname, width, nlocations, contents, ports) in enumerate(self.mems):
+            if mname == name:
+                bits = self.bits[m]
+                result = []
+                for i in range(nlocations):
+                    word = bits[i*width:(i + 1)*width]
+                    result.append(None if VX in word else sum((b == V1) << j for j, b in enumerate(reversed(word))))
+                return result
+        return None
+
+def _load(path):
+    if not path or not os.path.exists(path): return None
+    try:
+        with open(path, 'rb') as f: return marshal.loads(f.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+def _store(path, value):
+    try:
+        resultcache.write_file(path, marshal.dumps(value))
+    except (IOError, OSError):
+        pass   # compiled again next time
+
+##  Running tests
+##################################################
+
+# compiled circuit for running spec's tests on netlist nl from
+# grader.test_netlist: the driven signals and power supplies are inputs
+def test_circuit(nl, spec, cache_dir=default_cache_dir, engine='auto'):
+    return Circuit(nl, list(spec.driven_signals) + list(spec.power), cache_dir, engine)
+
+# run spec's tests cycle by cycle on a circuit from test_circuit.
+# Returns a dictionary like grader.run_test's, without the result Jade
+# records, which depends on timing.  As in gatesim, inputs set at some
+# time haven't reached the circuit when it's sampled at the same time,
+# so changes only take effect at the next tran.
+def run_test(circuit, spec):
+    result = {'status': 'error', 'errors': [], 'tests': len(spec.tests),
+              'failed_test': None, 'md5sum': spec.md5sum}
+    vil = spec.thresholds['Vil']
+    vih = spec.thresholds['Vih']
+    levels = {'0': V0, '1': V1, 'Z': VZ}
+    signals = spec.signals
+    errors = []
+    log = []
+    t_error = None
+    time = 0
+
+    circuit.reset()
+    try:
+        for node, v in spec.power.items():
+            circuit.set(node, V0 if v <= vil else (V1 if v >= vih else VX))
+        for node in spec.driven_signals: circuit.set(node, VZ)
+        circuit.update()
+
+        for tindex, test in enumerate(spec.tests):
+            for action in spec.cycle:
+                kind = action[0]
+                if kind == 'assert' or kind == 'deassert':
+                    for sindex in spec.groups[action[1]]:
+                        if kind == 'deassert': circuit.set(signals[sindex], VZ)
+                        elif test[sindex] in '01Z': circuit.set(signals[sindex], levels[test[sindex]])
+                elif kind == 'set':
+                    circuit.set(action[1], levels[action[2]])
+                elif kind == 'tran':
+                    circuit.update()
+                    time += action[1]
+                elif kind == 'log':
+                    log.append(''.join('?' if v is None else '01XZ'[v]
+                                       for v in (circuit.value(n) for n in spec.log_signals)))
+                elif kind == 'sample' and (t_error is None or t_error == tindex + 1):
+                    # report all the errors for the first failing test
+                    for node in sorted(signals[i] for i in spec.groups[action[1]] if test[i] in 'HL'):
+                        expected = test[signals.index(node)]
+                        v = circuit.value(node)
+                        if v is None or (expected == 'L' and v != V0) or (expected == 'H' and v != V1):
+                            errors.append('Test %d: Expected %s=%s at %ss.' %
+                                          (tindex + 1, node, expected, engineering_notation(time, 2)))
+                            t_error = tindex + 1
+        circuit.update()
+    except CompsimError as e:
+        result['errors'].append('Error running simulation: %s' % e)
+        return result
+    result['failed_test'] = t_error
+
+    # perform requested memory verifications
+    for mem_name, a in spec.mverify.items():
+        contents = circuit.get_memory(mem_name)
+        if contents is None:
+            errors.append('Cannot find memory named "%s", verification aborted.' % mem_name)
+            continue
+        for locn in sorted(a):
+            v = a[locn]
+            got = contents[locn] if 0 <= locn < len(contents) else None
+            if got is None and not 0 <= locn < len(contents):
+                errors.append('Location %d out of range for memory %s' % (locn, mem_name))
+            if got != v:
+                errors.append('%s[0x%x]: Expected 0x%x, got %s' % (mem_name, locn, v, 'undefined' if got is None else '0x%x' % got))
+
+    result['time'] = time
+    result['log'] = log
+    result['errors'] = errors
+    result['status'] = 'failed' if errors else 'passed'
+    return result
+
+if __name__ == '__main__':
+    import argparse
+    import time
+    import grader
+    import netlist
+
+    parser = argparse.ArgumentParser(description='Run the test of a synchronous Jade module by compiled cycle-based simulation')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/)')
+    parser.add_argument('module', help='name of module to test, eg /notes/acc32')
+    parser.add_argument('--cache', default=default_cache_dir, help='directory of compiled netlists (default %s)' % default_cache_dir)
+    parser.add_argument('--no-cache', action='store_true', help='compile the netlist even if it is cached')
+    parser.add_argument('--engine', choices=('auto', 'code', 'levels'), default='auto', help='how to evaluate the gates (default: auto)')
+    parser.add_argument('--compare', action='store_true', help='also run the test in gatesim and compare the results')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    try:
+        spec = grader.parse_test(grader.test_source(modules.get(args.module, {})) or '')
+        nl, errors = grader.test_netlist(modules, args.module, spec, ('gate',))
+        if errors: sys.exit('\n'.join(errors))
+        start = time.time()
+        circuit = test_circuit(nl, spec, None if args.no_cache else args.cache, args.engine)
+        loaded = time.time()
+        result = run_test(circuit, spec)
+        done = time.time()
+    except (grader.TestError, CompsimError) as e:
+        sys.exit(str(e))
+
+    print('%s: %s, %s in %.3fs, ran (%s) in %.3fs' % (args.module, result['status'],
+                                                      'loaded from cache' if circuit.cached else 'compiled',
+                                                      loaded - start, circuit.engine, done - loaded))
+    for e in result['errors'][:5]: print('    ' + e)
+    if args.compare:
+        start = time.time()
+        expected = grader.run_test(modules, args.module, spec)
+        print('gatesim: %s in %.3fs' % (expected['status'], time.time() - start))
+        same = expected['status'] == result['status'] and expected.get('log') == result['log']
+        print('results %s' % ('agree' if same else 'differ'))
+    sys.exit(0 if result['status'] == 'passed' else 1)
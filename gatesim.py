@@ -0,0 +1,1495 @@
+# Gate-level simulation without a browser.
+#
+# A port of the event-driven simulator in gatesim.js: same node values,
+# same contamination/propagation event scheduling, same lenient gates,
+# same event ordering, so a netlist produces the same waveforms here as
+# it does in Jade.  Netlists come from netlist.gate_netlist.
+#
+#   import netlist, gatesim
+#   modules = netlist.merge_libraries(netlist.load_library('files/gates'),
+#                                     netlist.load_library('files/ward'))
+#   network = gatesim.transient_analysis(netlist.gate_netlist(modules, '/user/test'), 100e-9)
+#   print(network.history('z'))
+#
+# A simulation can be checkpointed and resumed later, in a new Network
+# for the same circuit, whose sources needn't be the same after the
+# checkpoint, eg to run several tests that start with the same reset:
+#
+#   network.advance(100e-9)
+#   data = network.checkpoint()
+#   ...
+#   network = gatesim.Network(netlist, options)
+#   network.initialize(tstop)
+#   network.restore(data)
+#   network.simulate()
+
+import hashlib
+import heapq
+import marshal
+import math
+import re
+from array import array
+
+from utils import parse_source
+
+class SimulationError(Exception):
+    pass
+
+V0 = 0   # node values
+V1 = 1
+VX = 2
+VZ = 3
+
+CONTAMINATE = 0   # values chosen so that C events sort before P events
+PROPAGATE = 1
+
+c_slope = 0       # F/terminal of interconnect capacitance
+c_intercept = 0   # F of interconnect capacitance
+
+CHECKPOINT_VERSION = 1
+
+def fmod(numerator, denominator):
+    return numerator - math.floor(numerator / denominator) * denominator
+
+# contents of an array as a string of bytes, and back
+def _bytes(a):
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+def _array(typecode, data):
+    a = array(typecode)
+    if hasattr(a, 'frombytes'): a.frombytes(data)
+    else: a.fromstring(data)
+    return a
+
+_array_index = re.compile(r'^(0|[1-9][0-9]*)$')
+
+# JavaScript enumerates an object's integer-like keys first, in numeric
+# order, then the rest in insertion order.  Nodes are finalized in that
+# order so BUS devices, and hence events, are created in the same order
+# as in gatesim.js.
+def js_order(names):
+    index = sorted((n for n in names if _array_index.match(n)), key=int)
+    return index + [n for n in names if not _array_index.match(n)]
+
+# Transient analysis of netlist out to time tstop (seconds).  If given,
+# progress(percent_complete) is called periodically and can return True to
+# halt the simulation.  Returns the Network, whose history() method
+# reports what happened on each node.
+def transient_analysis(netlist, tstop, options=None, progress=None):
+    network = Network(netlist, options)
+    network.initialize(tstop)
+    network.simulate(progress)
+    return network
+
+##################################################
+##  Network
+##################################################
+
+class Network(object):
+    def __init__(self, netlist=None, options=None):
+        self.options = options or {}
+        self.debug_level = self.options.get('debug', 0)
+        self.event_queue = Heap()
+        self.time = 0
+        if netlist is not None: self.load_netlist(netlist)
+
+    # find anchor of alias chain
+    def unalias(self, name):
+        while name in self.aliases: name = self.aliases[name]
+        return name
+
+    # make name1 and name2 refer to the same node
+    def make_alias(self, name1, name2):
+        name1 = self.unalias(name1)
+        name2 = self.unalias(name2)
+        if name1 == name2: return   # already aliased!
+
+        # gnd is always the anchor, top level names are preferred to
+        # hierarchical names, otherwise choose the shorter of the two names
+        levels_1 = name1.count('.')
+        levels_2 = name2.count('.')
+        if name1 == 'gnd': winner, loser = name1, name2
+        elif name2 == 'gnd': winner, loser = name2, name1
+        elif levels_1 < levels_2: winner, loser = name1, name2
+        elif levels_2 < levels_1: winner, loser = name2, name1
+        elif len(name1) <= len(name2): winner, loser = name1, name2
+        else: winner, loser = name2, name1
+
+        self.aliases[loser] = winner
+
+    # return Node for specified name, create if necessary
+    def node(self, name):
+        name = self.unalias(name)
+        n = self.node_map.get(name)
+        if n is None:
+            n = Node(name, self)
+            self.node_map[name] = n
+            self.nodes.append(n)
+        return n
+
+    # load circuit from netlist: [{type:, connections:, properties:}, ...]
+    def load_netlist(self, netlist):
+        self.node_map = {}
+        self.aliases = {}
+        self.nodes = []
+        self.devices = []
+        self.device_map = {}   # name -> device
+        self.size = 0          # total size
+        self.counts = {}       # counts by device type
+        self.sizes = {}        # sizes by device type
+
+        # handle all the ground connections
+        self.gnd = self.node('gnd')
+        gnd = Source(self, 'gnd', self.gnd, {'name': 'gnd', 'value': {'type': 'dc', 'args': []}})
+        # gatesim.js lists the gnd source twice, keep it that way so the
+        # initial events are queued in the same order
+        self.devices.append(gnd)
+        for component in netlist:
+            if component['type'] == 'ground':
+                self.node_map[component['connections']['gnd']] = self.gnd
+
+        # "connect a b ..." makes a, b, ... aliases for the same node
+        for component in netlist:
+            if component['type'] == 'connect':
+                c = list(component['connections'].values())
+                for name in c[1:]: self.make_alias(c[0], name)
+
+        for component in netlist:
+            type = component['type']
+            if type in ('ground', 'connect', 'voltage probe'): continue
+
+            properties = component['properties']
+            name = properties.get('name')
+            connections = dict((t, self.node(n)) for t, n in component['connections'].items())
+
+            if type in logic_gates:
+                inputs, output, table = logic_gates[type]
+                LogicGate(self, type, name, table, [connections[t] for t in inputs], connections[output], properties)
+            elif type in ('dreg', 'dlatch', 'dlatchn'):
+                Storage(self, name, type, connections, properties)
+            elif type == 'memory':
+                Memory(self, name, properties, self.options)
+            elif type == 'constant0' or type == 'constant1':
+                n = connections['z']
+                if n.drivers: continue   # already handled this one
+                n.v = V0 if type == 'constant0' else V1
+                LogicGate(self, type, name, LTable if type == 'constant0' else HTable, [], n, properties)
+            elif type == 'voltage source':
+                n = connections['nplus']
+                if n.drivers: continue   # already handled this one
+                Source(self, name, n, properties)
+            else:
+                raise SimulationError('Unrecognized gate: ' + type)
+
+        # give each Node a chance to finalize itself
+        for name in js_order(list(self.node_map.keys())): self.node_map[name].finalize()
+
+    @property
+    def N(self):
+        return len(self.nodes)
+
+    def add_component(self, device):
+        type = device.type
+        self.devices.append(device)
+        self.counts[type] = self.counts.get(type, 0) + 1
+        if device.name: self.device_map[device.name] = device
+        if device.size:
+            self.size += device.size
+            self.sizes[type] = self.sizes.get(type, 0) + device.size
+
+    # initialize for simulation, queue initial events
+    def initialize(self, tstop):
+        self.tstop = tstop
+        scheduler = self.options.get('scheduler', 'heap')
+        if scheduler == 'calendar':
+            if not isinstance(self.event_queue, CalendarQueue): self.event_queue = CalendarQueue(self.day_width())
+        elif scheduler != 'heap':
+            raise SimulationError('Unknown scheduler: %s' % scheduler)
+        self.event_queue.clear()
+        self.time = 0
+        for node in self.nodes: node.initialize()
+        for device in self.devices: device.initialize()
+
+    # day width for a CalendarQueue: the shortest gate delay, so events
+    # caused by the same event mostly land on different days
+    def day_width(self):
+        delays = [d for device in self.devices if not isinstance(device, Source)
+                  for d in (device.tcd, device.tpdf, device.tpdr) if d > 0]
+        return min(delays) if delays else 1e-11
+
+    # process events until tstop
+    def simulate(self, progress=None, update_interval=10000):
+        queue = self.event_queue
+        ecount = 0
+        while self.time < self.tstop and not queue.empty():
+            event = queue.pop()
+            self.time = event.time
+            event.node.process_event(event)
+
+            ecount += 1
+            if progress is not None and ecount >= update_interval:
+                ecount = 0
+                if progress(round(100 * self.time / self.tstop)): return
+        self.time = self.tstop
+
+    # process events through time t, leaving later ones queued, eg to take
+    # a checkpoint at t
+    def advance(self, t):
+        queue = self.event_queue
+        while not queue.empty() and queue.peek().time <= t:
+            event = queue.pop()
+            self.time = event.time
+            event.node.process_event(event)
+        self.time = t
+
+    # the state of the simulation as a string of bytes: node values,
+    # histories and pending events, the contents of registers and
+    # memories, and the waveforms of the sources so far
+    def checkpoint(self):
+        nodes = self.nodes
+        index = dict((id(n), i) for i, n in enumerate(nodes))
+        lengths = array('i')
+        times = array('d')
+        values = bytearray()
+        for n in nodes:
+            lengths.append(len(n.times))
+            times.extend(n.times)
+            values.extend(n.values)
+        return marshal.dumps({
+            'version': CHECKPOINT_VERSION,
+            'time': self.time,
+            'nodes': '\n'.join(n.name for n in nodes),
+            'v': bytes(bytearray(n.v for n in nodes)),
+            'lengths': _bytes(lengths),
+            'times': _bytes(times),
+            'values': bytes(values),
+            # in an order that puts them back in the queue the same way
+            'events': [(index[id(e.node)], e.type, e.time, e.v) for e in self.event_queue.events()],
+            'devices': [(d.name, d.checkpoint()) for d in self.stateful_devices()],
+        })
+
+    # pick up the simulation from a checkpoint of this circuit, after
+    # initialize().  Sources whose waveforms have changed since the
+    # checkpoint was taken continue with their new waveforms, which
+    # must be the same as the old ones up to the checkpoint.
+    def restore(self, data):
+        try:
+            state = marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            state = None
+        if not isinstance(state, dict) or state.get('version') != CHECKPOINT_VERSION:
+            raise SimulationError('Not a checkpoint from this version of gatesim')
+        names = state['nodes'].split('\n')
+        nodes = dict((n.name, n) for n in self.nodes)
+        devices = self.stateful_devices()
+        if (sorted(names) != sorted(nodes) or
+            [d.name for d in devices] != [name for name, device_state in state['devices']]):
+            raise SimulationError('Checkpoint is for a different circuit')
+
+        self.event_queue.clear()
+        self.time = state['time']
+        lengths = _array('i', state['lengths'])
+        times = _array('d', state['times'])
+        values = bytearray(state['values'])
+        v = bytearray(state['v'])
+        nodes = [nodes[name] for name in names]
+        start = 0
+        for i, n in enumerate(nodes):
+            end = start + lengths[i]
+            n.v = v[i]
+            n.times = list(times[start:end])
+            n.values = list(values[start:end])
+            n.cd_event = None
+            n.pd_event = None
+            start = end
+        for i, type, t, v in state['events']:
+            event = self.add_event(t, type, nodes[i], v)
+            if type == CONTAMINATE: nodes[i].cd_event = event
+            else: nodes[i].pd_event = event
+        for d, (name, device_state) in zip(devices, state['devices']): d.restore(device_state)
+
+    # devices with state to checkpoint, each once
+    def stateful_devices(self):
+        seen = set()
+        result = []
+        for d in self.devices:
+            if isinstance(d, (Storage, Memory, Source)) and id(d) not in seen:
+                seen.add(id(d))
+                result.append(d)
+        return result
+
+    def add_event(self, t, type, node, v):
+        event = Event(t, type, node, v)
+        self.event_queue.push(event)
+        if self.debug_level > 2: print('add %s event: %s->%s @ %g' % ('cp'[type], node.name, '01XZ'[v], t))
+        return event
+
+    def remove_event(self, event):
+        self.event_queue.remove(event)
+        if self.debug_level > 2: print('remove %s event: %s->%s @ %g' % ('cp'[event.type], event.node.name, '01XZ'[event.v], event.time))
+
+    # return {'xvalues': times, 'yvalues': values}, None if there's no such
+    # node.  values are 0, 1, 2=X, 3=Z
+    def history(self, name):
+        n = self.node_map.get(self.unalias(name))
+        if n is None: return None
+
+        # record node's final value if not already there
+        if n.times[-1] != self.time:
+            n.times.append(self.time)
+            n.values.append(n.v)
+        return {'xvalues': n.times, 'yvalues': n.values}
+
+    # return contents of named memory as a list of values
+    def get_memory(self, mem_name):
+        mem = self.device_map.get(mem_name)
+        if mem is not None and mem.type == 'memory': return mem.get_contents()
+        return None
+
+    def result_type(self):
+        return 'digital'
+
+    def node_list(self):
+        return list(self.node_map.keys())
+
+##################################################
+##  Events & the event heap
+##################################################
+
+class Event(object):
+    __slots__ = ('time', 'type', 'node', 'v', 'pos')
+
+    def __init__(self, t, type, node, v):
+        self.time = t       # time of event
+        self.type = type    # CONTAMINATE, PROPAGATE
+        self.node = node
+        self.v = v
+        self.pos = -1       # index in heap
+
+# The same binary heap as gatesim.js (which borrowed it from heapq.py), so
+# events with equal times come off the heap in the same order they do in
+# the browser.  Each event remembers its index so it can be removed
+# without searching.
+class Heap(object):
+    def __init__(self):
+        self.nodes = []
+
+    def _siftdown(self, startpos, pos):
+        nodes = self.nodes
+        newitem = nodes[pos]
+        while pos > startpos:
+            parentpos = (pos - 1) >> 1
+            parent = nodes[parentpos]
+            if newitem.time < parent.time:
+                nodes[pos] = parent
+                parent.pos = pos
+                pos = parentpos
+                continue
+            break
+        nodes[pos] = newitem
+        newitem.pos = pos
+
+    def _siftup(self, pos):
+        nodes = self.nodes
+        endpos = len(nodes)
+        startpos = pos
+        newitem = nodes[pos]
+        # bubble up the smaller child until hitting a leaf
+        childpos = 2*pos + 1
+        while childpos < endpos:
+            rightpos = childpos + 1
+            if rightpos < endpos and not nodes[childpos].time < nodes[rightpos].time:
+                childpos = rightpos
+            nodes[pos] = nodes[childpos]
+            nodes[pos].pos = pos
+            pos = childpos
+            childpos = 2*pos + 1
+        nodes[pos] = newitem
+        newitem.pos = pos
+        self._siftdown(startpos, pos)
+
+    def push(self, item):
+        self.nodes.append(item)
+        self._siftdown(0, len(self.nodes) - 1)
+
+    # remove smallest item from the heap
+    def pop(self):
+        lastelt = self.nodes.pop()
+        if self.nodes:
+            returnitem = self.nodes[0]
+            self.nodes[0] = lastelt
+            self._siftup(0)
+        else:
+            returnitem = lastelt
+        returnitem.pos = -1
+        return returnitem
+
+    def peek(self):
+        return self.nodes[0]
+
+    def remove(self, item):
+        pos = item.pos
+        if pos < 0: return
+        lastelt = self.nodes.pop()
+        if item is not lastelt:
+            self.nodes[pos] = lastelt
+            lastelt.pos = pos
+            self._siftdown(0, pos)
+            self._siftup(pos)
+        item.pos = -1
+
+    def clear(self):
+        self.nodes = []
+
+    # pushing these in order onto an empty heap rebuilds this one
+    def events(self):
+        return list(self.nodes)
+
+    def empty(self):
+        return not self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+# A calendar queue (R. Brown, CACM 1988) with the same interface as Heap.
+# Time is divided into days of width seconds, and an event goes into the
+# bucket for its day, modulo the number of buckets; each bucket is a
+# small heap of (time, sequence number, event).  Popping looks only at
+# the bucket for the current day, moving to the next when it has nothing
+# left for today, so with days about as long as the shortest gate delay
+# most pushes and pops touch one short bucket instead of a heap of every
+# pending event.  The number of buckets doubles or halves to stay close
+# to the number of events.  Removed events are marked (pos = -1) and
+# dropped when they reach the front of their bucket.
+#
+# Events with the same time come off in the order they were pushed,
+# which isn't always the order of gatesim.js's heap, so simultaneous
+# events can be processed in a different order than in the browser.
+class CalendarQueue(object):
+    def __init__(self, width, nbuckets=64):
+        self.width = width
+        self.min_buckets = nbuckets
+        self.clear()
+
+    def clear(self):
+        self.nbuckets = self.min_buckets
+        self.buckets = [[] for i in range(self.nbuckets)]
+        self.count = 0    # events in the queue, not counting removed ones
+        self.seq = 0      # orders events with the same time
+        self.day = 0      # day of the last event popped
+
+    def push(self, item):
+        day = int(item.time / self.width)
+        self.seq += 1
+        heapq.heappush(self.buckets[day % self.nbuckets], (item.time, self.seq, item))
+        item.pos = day
+        if day < self.day: self.day = day
+        self.count += 1
+        if self.count > 2*self.nbuckets: self._resize(2*self.nbuckets)
+
+    # bucket holding the earliest event
+    def _first(self):
+        buckets = self.buckets
+        n = self.nbuckets
+        day = self.day
+        while True:
+            for i in range(n):
+                bucket = buckets[day % n]
+                # drop removed events
+                while bucket and bucket[0][2].pos < 0: heapq.heappop(bucket)
+                if bucket and bucket[0][2].pos == day:
+                    self.day = day
+                    return bucket
+                day += 1
+            # nothing in the next n days, skip ahead to the earliest event
+            day = min(b[0][2].pos for b in buckets if b)
+
+    def pop(self):
+        if self.count == 0: raise IndexError('pop from empty queue')
+        bucket = self.buckets[self.day % self.nbuckets]
+        if not bucket or bucket[0][2].pos != self.day: bucket = self._first()
+        item = heapq.heappop(bucket)[2]
+        item.pos = -1
+        self.count -= 1
+        if self.count < self.nbuckets // 2 and self.nbuckets > self.min_buckets:
+            self._resize(self.nbuckets // 2)
+        return item
+
+    def peek(self):
+        return self._first()[0][2]
+
+    def remove(self, item):
+        if item.pos < 0: return
+        item.pos = -1
+        self.count -= 1
+
+    def _resize(self, nbuckets):
+        entries = [e for b in self.buckets for e in b if e[2].pos >= 0]
+        self.nbuckets = nbuckets
+        self.buckets = [[] for i in range(nbuckets)]
+        for e in entries: self.buckets[e[2].pos % nbuckets].append(e)
+        for b in self.buckets: heapq.heapify(b)
+
+    # the queued events in the order they'll come off the queue
+    def events(self):
+        return [e[2] for e in sorted(e for b in self.buckets for e in b if e[2].pos >= 0)]
+
+    def empty(self):
+        return self.count == 0
+
+    def __len__(self):
+        return self.count
+
+##################################################
+##  Node
+##################################################
+
+class Node(object):
+    def __init__(self, name, network):
+        self.name = name
+        self.network = network
+        self.drivers = []       # devices which want to control value of this node
+        self.driver = None      # device which controls value of this node
+        self.fanouts = []       # devices with this node as an input
+        self.capacitance = 0
+        self.constant_value = False
+        self.v = VX
+
+    def initialize(self):
+        self.v = VX
+        self.times = [0.0]      # history of events
+        self.values = [VX]
+        self.cd_event = None    # contamination delay event for this node
+        self.pd_event = None    # propagation delay event for this node
+
+    def add_fanout(self, device):
+        if device not in self.fanouts: self.fanouts.append(device)
+
+    def add_driver(self, device):
+        self.drivers.append(device)
+
+    def process_event(self, event):
+        # update event pointers
+        if event is self.cd_event: self.cd_event = None
+        elif event is self.pd_event: self.pd_event = None
+
+        if self.v != event.v:
+            # record changes in node's value
+            self.times.append(event.time)
+            self.values.append(event.v)
+
+        if self.network.debug_level > 0:
+            print('%s: %s->%s @ %g %s' % (self.name, '01XZ'[self.v], '01XZ'[event.v], event.time, ('contamination', 'propagation')[event.type]))
+
+        self.v = event.v
+
+        # let fanouts know about event
+        for device in reversed(self.fanouts):
+            device.process_event(event, self)
+
+    def last_event_time(self):
+        return self.times[-1]
+
+    def finalize(self):
+        if self.drivers is None or self.driver is not None: return   # already finalized
+
+        ndrivers = len(self.drivers)
+        nfanouts = len(self.fanouts)
+        if ndrivers == 0:
+            if nfanouts > 0:
+                if not self.network.options.get('timing_analysis'):
+                    raise SimulationError('Node %s is not connected to any output but is an input to the following devices: %s' %
+                                          (self.name, ', '.join(str(d.name) for d in self.fanouts)))
+            else:
+                return   # no drivers, no fanouts... not interesting :)
+
+        # if no explicit capacitance has been supplied, estimate
+        # interconnect capacitance
+        if self.capacitance == 0: self.capacitance = c_intercept + c_slope*(ndrivers + nfanouts)
+
+        # add capacitances from drivers and fanout connections
+        for d in self.drivers: self.capacitance += d.capacitance(self)
+        for d in self.fanouts: self.capacitance += d.capacitance(self)
+
+        # if there is only 1 driver then that device is the driver for this node
+        if ndrivers <= 1:
+            self.driver = self.drivers[0] if self.drivers else None
+            self.drivers = None
+            return
+
+        # handle tristates and multiple drivers by adding a special BUS
+        # device that computes value from all the drivers
+        inputs = []
+        for i, d in enumerate(self.drivers):
+            if not d.tristate(self):
+                # shorting together non-tristate outputs, so complain
+                raise SimulationError('Node %s is driven by multiple gates. See devices: %s' %
+                                      (self.name, ', '.join(str(d.name) for d in self.drivers)))
+            # cons up a new node and have this device drive it
+            n = self.network.node('%s$%d' % (self.name, i))
+            n.capacitance = self.capacitance   # each driver has to drive all the capacitance
+            inputs.append(n)
+            d.change_output_node(self, n)
+            n.driver = d
+
+        # now add the BUS device to drive the current node
+        self.capacitance = 0   # already accounted for on BUS inputs
+        self.driver = LogicGate(self.network, 'BUS', self.name + '%bus', BusTable, inputs, self, {})
+        self.drivers = None    # finalization complete
+
+    # schedule contamination event for this node
+    def c_event(self, tcd):
+        network = self.network
+        t = network.time + tcd
+
+        # remove any pending propagation event that happens after tcd
+        if self.pd_event is not None and self.pd_event.time >= t:
+            network.remove_event(self.pd_event)
+            self.pd_event = None
+
+        # keep the earlier of two contamination events
+        if self.cd_event is not None:
+            if self.cd_event.time <= t: return
+            network.remove_event(self.cd_event)
+
+        self.cd_event = network.add_event(t, CONTAMINATE, self, VX)
+
+    # schedule propagation event for this node
+    def p_event(self, tpd, v, drive, lenient):
+        network = self.network
+        t = network.time + tpd + drive*self.capacitance
+
+        if self.pd_event is not None:
+            # an earlier arriving input may have already determined the
+            # value of this node, so leave that event in place if we're
+            # a lenient gate
+            if lenient and self.pd_event.v == v and t >= self.pd_event.time: return
+            network.remove_event(self.pd_event)
+
+        self.pd_event = network.add_event(t, PROPAGATE, self, v)
+
+##################################################
+##  Sources
+##################################################
+
+# voltage at time t of a piecewise linear waveform given as t,v pairs
+def _voltage(pairs, t):
+    n = 0
+    while n < len(pairs) and pairs[n] <= t: n += 2
+    if n == 0: return pairs[1]
+    if n == len(pairs): return pairs[-1]
+    return pairs[n-1] + (pairs[n+1] - pairs[n-1])*(t - pairs[n-2])/(pairs[n] - pairs[n-2])
+
+class Source(object):
+    type = 'voltage source'
+    size = 0
+
+    def __init__(self, network, name, output, properties):
+        self.network = network
+        self.name = name
+        self.output = output
+        self.vil = network.options.get('vil') or 0.1
+        self.vih = network.options.get('vih') or 0.9
+
+        v = parse_source(properties['value'])
+        if v.fun == 'sin': raise SimulationError("Can't use sin() sources in gate-level simulation")
+
+        if v.fun == 'dc':
+            output.constant_value = True
+            self.tvpairs = [0, v.args[0]]   # single t,v pair
+            self.period = 0
+        else:
+            self.tvpairs = v.tvpairs
+            self.period = v.period
+            # for periodic source, construct two periods of tvpairs so
+            # it's easy to find the next transition in the next period
+            if self.period != 0:
+                self.tvpairs = list(v.tvpairs)
+                for i in range(0, len(v.tvpairs), 2):
+                    self.tvpairs.append(v.tvpairs[i] + self.period)
+                    self.tvpairs.append(v.tvpairs[i+1])
+
+        # figure out initial value from first t,v pair
+        v0 = self.tvpairs[1]
+        self.initial_value = V0 if v0 <= self.vil else (V1 if v0 >= self.vih else VX)
+
+        output.add_fanout(self)   # listen for our own events!
+        output.add_driver(self)
+        network.add_component(self)
+
+    def change_output_node(self, old_node, new_node):
+        if self.output is old_node: self.output = new_node
+
+    def initialize(self):
+        if self.initial_value != VX:
+            self.output.p_event(0, self.initial_value, 0, False)
+
+    def capacitance(self, node):
+        return 0
+
+    def tristate(self, node):
+        return False
+
+    # propagate events on source's output cause new events to be
+    # scheduled for *next* source transition
+    def process_event(self, event, cause):
+        if event.type == PROPAGATE: self.schedule_next()
+
+    def schedule_next(self):
+        time = self.network.time
+        t = self.next_contamination_time(time)
+        if t >= 0: self.output.c_event(t - time)
+        t, v = self.next_propagation_time(time)
+        if t > 0: self.output.p_event(t - time, v, 0, False)
+
+    # the whole waveform's hash, and the part of it up to time t: the
+    # t,v pairs through t and the voltage at t
+    def waveform(self, t):
+        digest = hashlib.sha1(marshal.dumps((self.period, self.tvpairs))).hexdigest()
+        if self.period != 0: return digest, self.tvpairs, None
+        pairs = self.tvpairs
+        n = 0
+        while n < len(pairs) and pairs[n] <= t: n += 2
+        return digest, pairs[:n], _voltage(pairs, t)
+
+    def checkpoint(self):
+        return self.waveform(self.network.time)
+
+    def restore(self, state):
+        time = self.network.time
+        digest, pairs, v = state
+        now = self.waveform(time)
+        if now[0] == digest: return   # same waveform, its pending events stand
+        # the same voltages up to now, although eg the new waveform can
+        # have a breakpoint where it starts to change at this time
+        old = list(pairs) + [time, v]
+        times = set([0, time] + [x for x in old[0::2] + list(now[1][0::2]) if x <= time])
+        if self.period != 0 or v is None or any(abs(_voltage(old, x) - _voltage(self.tvpairs, x)) > 1e-9 for x in times):
+            raise SimulationError('Source %s is different before the checkpoint at %gs' % (self.name, time))
+
+        # replace the old waveform's pending events with the new one's
+        output = self.output
+        for event in (output.cd_event, output.pd_event):
+            if event is not None: self.network.remove_event(event)
+        output.cd_event = None
+        output.pd_event = None
+        self.schedule_next()
+
+    # search tvpairs for next time the source crosses one of the
+    # thresholds.  Returns (time, crossing) where crossing is the index
+    # into crossings of the threshold crossed.
+    def _next_crossing(self, xtime, crossings):
+        xtime += 1e-13   # get past current time by epsilon
+
+        # handle periodic sources
+        time = xtime      # time we'll be searching for in tvpairs
+        tbase = 0         # time at beginning of period
+        if self.period != 0:
+            time = fmod(time, self.period)
+            tbase = xtime - time
+
+        tvpairs = self.tvpairs
+        tlast = 0
+        vlast = 0
+        for i in range(0, len(tvpairs), 2):
+            t = tvpairs[i]
+            v = tvpairs[i+1]
+            if i > 0 and time <= t:
+                for which, (crossed, threshold) in enumerate(crossings):
+                    if crossed(vlast, v):
+                        et = tlast + (t - tlast)*(threshold - vlast)/(v - vlast)
+                        if et > time: return tbase + et, which
+                        break
+            tlast = t
+            vlast = v
+        return -1, None
+
+    # return time of next contamination event
+    def next_contamination_time(self, xtime):
+        vil, vih = self.vil, self.vih
+        t, which = self._next_crossing(xtime, ((lambda vlast, v: vlast >= vih and v < vih, vih),
+                                               (lambda vlast, v: vlast <= vil and v > vil, vil)))
+        return t
+
+    # return (time, value) of next propagation event
+    def next_propagation_time(self, xtime):
+        vil, vih = self.vil, self.vih
+        t, which = self._next_crossing(xtime, ((lambda vlast, v: vlast < vih and v >= vih, vih),
+                                               (lambda vlast, v: vlast > vil and v <= vil, vil)))
+        return t, (V1, V0)[which] if which is not None else None
+
+##################################################
+##  Logic gates
+##################################################
+
+# it's tables all the way down: use current input as index into current
+# table to get new table, repeat until all inputs have been consumed.
+# final value is given by current_table[4]
+
+def _loop(value):
+    t = []
+    t.extend([t, t, t, t, value])
+    return t
+
+LTable = _loop(V0)   # always "0"
+HTable = _loop(V1)   # always "1"
+XTable = _loop(VX)   # always "X"
+ZTable = _loop(VZ)   # always "Z"
+SelectTable = [LTable, HTable, XTable, XTable, VX]   # select this input
+Select2ndTable = [SelectTable, SelectTable, SelectTable, SelectTable, VX]   # select second input
+Select3rdTable = [Select2ndTable, Select2ndTable, Select2ndTable, Select2ndTable, VX]   # select third input
+Select4thTable = [Select3rdTable, Select3rdTable, Select3rdTable, Select3rdTable, VX]   # select fourth input
+Ensure0Table = [LTable, XTable, XTable, XTable, VX]   # must be 0
+Ensure1Table = [XTable, HTable, XTable, XTable, VX]   # must be 1
+EqualTable = [Ensure0Table, Ensure1Table, XTable, XTable, VX]   # this == next
+
+# tristate bus resolution
+# produces "Z" if all inputs are "Z"
+# produces "1" if one input is "1" and other inputs are "1" or "Z"
+# produces "0" if one input is "0" and other inputs are "0" or "Z"
+# produces "X" otherwise
+BusTable = []
+Bus0Table = []
+Bus1Table = []
+BusTable.extend([Bus0Table, Bus1Table, XTable, BusTable, VZ])
+Bus0Table.extend([Bus0Table, XTable, XTable, Bus0Table, V0])
+Bus1Table.extend([XTable, Bus1Table, XTable, Bus1Table, V1])
+
+# tristate buffer (node order: enable,in)
+TristateBufferTable = [ZTable, SelectTable, XTable, XTable, VX]
+
+AndXTable = []
+AndXTable.extend([LTable, AndXTable, AndXTable, AndXTable, VX])
+AndTable = []
+AndTable.extend([LTable, AndTable, AndXTable, AndXTable, V1])
+
+NandXTable = []
+NandXTable.extend([HTable, NandXTable, NandXTable, NandXTable, VX])
+NandTable = []
+NandTable.extend([HTable, NandTable, NandXTable, NandXTable, V0])
+
+OrXTable = []
+OrXTable.extend([OrXTable, HTable, OrXTable, OrXTable, VX])
+OrTable = []
+OrTable.extend([OrTable, HTable, OrXTable, OrXTable, V0])
+
+NorXTable = []
+NorXTable.extend([NorXTable, LTable, NorXTable, NorXTable, VX])
+NorTable = []
+NorTable.extend([NorTable, LTable, NorXTable, NorXTable, V1])
+
+XorTable = []
+Xor1Table = []
+XorTable.extend([XorTable, Xor1Table, XTable, XTable, V0])
+Xor1Table.extend([Xor1Table, XorTable, XTable, XTable, V1])
+XnorTable = []
+Xnor1Table = []
+XnorTable.extend([XnorTable, Xnor1Table, XTable, XTable, V1])
+Xnor1Table.extend([Xnor1Table, XnorTable, XTable, XTable, V0])
+
+# 2-input mux table (node order: sel,d0,d1)
+Mux2Table = [SelectTable, Select2ndTable, EqualTable, EqualTable, VX]
+
+# 4-input mux table (node order: s0,s1,d0,d1,d2,d3)
+Mux4aTable = [SelectTable, Select3rdTable, EqualTable, EqualTable, VX]   # s0 == 0
+Mux4bTable = [Select2ndTable, Select4thTable, EqualTable, EqualTable, VX]   # s0 == 1
+Mux4Table = [Mux4aTable, Mux4bTable, EqualTable, EqualTable, VX]
+
+# for each logic gate provide [input-terminal-list,output-terminal,table]
+logic_gates = {
+    'and2': (['a', 'b'], 'z', AndTable),
+    'and3': (['a', 'b', 'c'], 'z', AndTable),
+    'and4': (['a', 'b', 'c', 'd'], 'z', AndTable),
+    'buffer': (['a'], 'z', AndTable),
+    'buffer_h': (['a'], 'z', AndTable),
+    'inverter': (['a'], 'z', NandTable),
+    'mux2': (['s', 'd0', 'd1'], 'y', Mux2Table),
+    'mux4': (['s[0]', 's[1]', 'd0', 'd1', 'd2', 'd3'], 'y', Mux4Table),
+    'nand2': (['a', 'b'], 'z', NandTable),
+    'nand3': (['a', 'b', 'c'], 'z', NandTable),
+    'nand4': (['a', 'b', 'c', 'd'], 'z', NandTable),
+    'nor2': (['a', 'b'], 'z', NorTable),
+    'nor3': (['a', 'b', 'c'], 'z', NorTable),
+    'nor4': (['a', 'b', 'c', 'd'], 'z', NorTable),
+    'or2': (['a', 'b'], 'z', OrTable),
+    'or3': (['a', 'b', 'c'], 'z', OrTable),
+    'or4': (['a', 'b', 'c', 'd'], 'z', OrTable),
+    'tristate': (['e', 'a'], 'z', TristateBufferTable),
+    'xor2': (['a', 'b'], 'z', XorTable),
+    'xnor2': (['a', 'b'], 'z', XnorTable),
+}
+
+# properties shared by gates and storage elements
+def _timing_properties(device, properties):
+    # by default devices are lenient
+    lenient = properties.get('lenient')
+    device.lenient = True if lenient is None else lenient != 0
+    device.size = properties.get('size') or 0
+    device.cout = properties.get('cout') or 0
+    device.cin = properties.get('cin') or 0
+    device.tcd = properties.get('tcd') or 0
+    device.tpdf = properties.get('tpdf') or properties.get('tpd') or 0
+    device.tpdr = properties.get('tpdr') or properties.get('tpd') or 0
+    device.tr = properties.get('tr') or 0
+    device.tf = properties.get('tf') or 0
+
+class LogicGate(object):
+    def __init__(self, network, type, name, table, inputs, output, properties):
+        self.network = network
+        self.type = type
+        self.name = name
+        self.table = table
+        self.inputs = inputs
+        self.output = output
+        self.properties = properties
+        _timing_properties(self, properties)
+
+        # devices with 0 or 1 inputs are lenient by definition!
+        if len(inputs) < 2: self.lenient = True
+
+        # gates with no input generate constant value outputs
+        if not inputs: output.constant_value = True
+
+        for i in inputs: i.add_fanout(self)
+        output.add_driver(self)
+
+        if type == 'mux4': self.logic_eval = self.mux4_eval
+
+        network.add_component(self)
+
+    def logic_eval(self):
+        t = self.table
+        for i in self.inputs: t = t[i.v]
+        return t[4]
+
+    # special case eval function for mux4 with X's on select lines
+    def mux4_eval(self):
+        s0, s1, d0, d1, d2, d3 = [i.v for i in self.inputs]
+        if s0 >= VX:
+            if s1 >= VX:
+                # both selects are X, see if they matter
+                return d0 if d0 == d1 == d2 == d3 else VX
+            # just s0 is X: if s1 is 0, check d0 == d1, otherwise d2 == d3
+            if s1 == V0: return d0 if d0 == d1 else VX
+            return d2 if d2 == d3 else VX
+        if s1 >= VX:
+            # just s1 is X: if s0 is 0, check d0 == d2, otherwise d1 == d3
+            if s0 == V0: return d0 if d0 == d2 else VX
+            return d1 if d1 == d3 else VX
+        return self.table[s0][s1][d0][d1][d2][d3][4]
+
+    def change_output_node(self, old_node, new_node):
+        if self.output is old_node: self.output = new_node
+
+    def initialize(self):
+        # gates with no inputs produce a constant output
+        if not self.inputs:
+            self.output.p_event(0, self.logic_eval(), 0, False)
+
+    # capacitance contribution from this device for node
+    def capacitance(self, node):
+        c = 0
+        for i in self.inputs:
+            if i is node: c += self.cin
+        if self.output is node: c += self.cout
+        return c
+
+    # is node a tristate output of this device?
+    def tristate(self, node):
+        return self.output is node and self.table is TristateBufferTable
+
+    # evaluation of output values triggered by an event on the input
+    def process_event(self, event, cause):
+        onode = self.output
+        if event.type == CONTAMINATE:
+            # a lenient gate won't contaminate the output under the right circumstances
+            if self.lenient:
+                v = self.logic_eval()
+                if onode.pd_event is None:
+                    # no events pending and current value is same as new value
+                    if onode.cd_event is None and v == onode.v: return
+                elif v == onode.pd_event.v:
+                    # node is destined to have the same value as new value
+                    return
+            onode.c_event(self.tcd)
+        else:
+            # always forward propagate events to the output so downstream
+            # gates will get a chance to recover from an earlier
+            # contamination event.
+            v = self.logic_eval()
+            if v == V1: tpd, drive = self.tpdr, self.tr
+            elif v == V0: tpd, drive = self.tpdf, self.tf
+            else: tpd, drive = min(self.tpdr, self.tpdf), 0
+            onode.p_event(tpd, v, drive, self.lenient)
+
+##################################################
+##  Storage elements: dreg, dlatch, dlatchn
+##################################################
+
+class Storage(object):
+    def __init__(self, network, name, type, connections, properties):
+        self.network = network
+        self.name = name
+        self.type = type
+        self.properties = properties
+        _timing_properties(self, properties)
+        self.ts = properties.get('ts') or 0
+        self.th = properties.get('th') or 0
+
+        self.d = connections['d']
+        self.clk = connections['clk' if type == 'dreg' else ('g' if type == 'dlatch' else 'gn')]
+        self.q = connections['q']
+
+        self.d.add_fanout(self)
+        self.clk.add_fanout(self)
+        self.q.add_driver(self)
+
+        # clk node gets special treatment during timing analysis
+        if type == 'dreg': self.clk.clock = True
+
+        self.gate_open = V1 if type == 'dlatch' else V0     # when is latch open?
+        self.gate_closed = V0 if type == 'dlatch' else V1   # when is latch closed?
+        self.edge_possible = False
+
+        network.add_component(self)
+
+    def change_output_node(self, old_node, new_node):
+        if self.q is old_node: self.q = new_node
+
+    def initialize(self):
+        self.min_setup = None
+        self.min_setup_time = None
+        self.state = VX
+
+    # capacitance contribution from this device for node
+    def capacitance(self, node):
+        c = 0
+        if self.q is node: c += self.cout
+        if self.d is node: c += self.cin
+        if self.clk is node: c += self.cin
+        return c
+
+    def tristate(self, node):
+        return False
+
+    def process_event(self, event, cause):
+        if self.type == 'dreg': self.dreg_event(event, cause)
+        else: self.latch_event(event, cause)
+
+    def checkpoint(self):
+        return (self.state, self.edge_possible, self.min_setup, self.min_setup_time)
+
+    def restore(self, state):
+        self.state, self.edge_possible, self.min_setup, self.min_setup_time = state
+
+    def dreg_event(self, event, cause):
+        if event.type != PROPAGATE: return   # no contamination events allowed!
+
+        q = self.q
+        if self.clk.v == V0:
+            # if CLK is 0, master latch (ie, state) follows D input
+            self.state = self.d.v
+            self.edge_possible = True   # remember clk value so we can detect rising edges
+        elif self.clk is cause:
+            # otherwise we only care about event if CLK is changing
+            if self.clk.v == V1:
+                # rising clock edge!  track minimum setup time we see
+                now = self.network.time
+                if self.edge_possible and now > 0:
+                    tsetup = now - self.d.last_event_time()
+                    if self.min_setup is None or tsetup < self.min_setup:
+                        self.min_setup = tsetup
+                        self.min_setup_time = now
+                self.edge_possible = False
+
+                # for lenient dreg's, q output is contaminated only when
+                # new output value differs from current one
+                if not self.lenient or self.state != q.v:
+                    q.c_event(self.tcd)
+
+                # always forward propagate events to the output
+                if self.state == V0: q.p_event(self.tpdf, self.state, self.tf, self.lenient)
+                else: q.p_event(self.tpdr, self.state, self.tr, self.lenient)
+            else:
+                # X on clock won't contaminate value in master if we're
+                # a lenient register and master == D
+                if not self.lenient or self.state != self.d.v: self.state = VX
+
+                # send along to Q if we're not lenient or if master != Q
+                if not self.lenient or self.state != q.v:
+                    q.p_event(min(self.tpdf, self.tpdr), VX, 0, self.lenient)
+
+    def latch_event(self, event, cause):
+        q = self.q
+        clk = self.clk.v
+        # compute output of latch
+        if clk == self.gate_closed: v = self.state
+        elif clk == self.gate_open: v = self.d.v
+        elif self.lenient and self.d.v == self.state: v = self.state
+        else: v = VX
+
+        # state follows D when gate is open
+        if clk == self.gate_open: self.state = v
+
+        if event.type == CONTAMINATE:
+            # a lenient latch sometimes won't contaminate output
+            if self.lenient:
+                if q.pd_event is None:
+                    if q.cd_event is None and v == q.v: return
+                elif v == q.pd_event.v:
+                    return
+            q.c_event(self.tcd)
+        else:
+            # avoid scheduling PROPAGATE events if we can...
+            if not self.lenient or v != q.v or q.cd_event is not None or q.pd_event is not None:
+                if v == V1: tpd, drive = self.tpdr, self.tr
+                elif v == V0: tpd, drive = self.tpdf, self.tf
+                else: tpd, drive = min(self.tpdr, self.tpdf), 0
+                q.p_event(tpd, v, drive, self.lenient)
+
+##################################################
+##  Memories
+##################################################
+
+# clk, wen and oe connections are one-element lists of node names
+def _single(name):
+    return name[0] if isinstance(name, list) else name
+
+class Memory(object):
+    type = 'memory'
+
+    def __init__(self, network, name, properties, options):
+        self.network = network
+        self.name = name
+
+        self.width = properties.get('width')
+        if not self.width or self.width <= 0:
+            raise SimulationError('Memory %s must have width > 0.' % name)
+        self.nlocations = properties.get('nlocations')
+        if not self.nlocations or self.nlocations <= 0:
+            raise SimulationError('Memory %s must have > 0 locations.' % name)
+        self.contents = properties.get('contents')
+
+        # by default memories are lenient
+        lenient = properties.get('lenient')
+        self.lenient = True if lenient is None else lenient != 0
+        self.cout = properties.get('cout') or options.get('mem_cout') or 0
+        self.cin = properties.get('cin') or options.get('mem_cin') or .005e-12
+        self.tcd = properties.get('tcd') or options.get('mem_tcd') or 20e-12
+        self.tr = properties.get('tr') or options.get('mem_tr') or 1000
+        self.tf = properties.get('tf') or options.get('mem_tf') or 500
+        self.ts = properties.get('ts') or options.get('mem_ts') or 2*self.tcd
+        self.th = properties.get('th') or options.get('mem_th') or self.tcd
+
+        # tPD depends on number of memory locations, local properties take
+        # precedence over global options
+        if self.nlocations > 1024: kind, tpd = 'dram', 40e-9
+        elif self.nlocations > 128: kind, tpd = 'sram', 4e-9
+        else: kind, tpd = 'regfile', 2e-9
+        self.tpdf = (properties.get('tpdf') or properties.get('tpd') or
+                     options.get('mem_tpdf_' + kind) or options.get('mem_tpd_' + kind) or tpd)
+        self.tpdr = (properties.get('tpdr') or properties.get('tpd') or
+                     options.get('mem_tpdr_' + kind) or options.get('mem_tpd_' + kind) or tpd)
+
+        # convert node names to Nodes.  Make a separate list of output
+        # nodes so that tristate buses can insert BUS devices on the
+        # outputs without affecting the input nodes
+        self.ports = []
+        for p in properties.get('ports', []):
+            port = {
+                'addr': [network.node(n) for n in p['addr']],
+                'data': [network.node(n) for n in p['data']],
+                'clk': network.node(_single(p['clk'])),
+                'wen': network.node(_single(p['wen'])),
+                'oe': network.node(_single(p['oe'])),
+                'read_port': False,
+                'write_port': False,
+                'edge_possible': False,
+            }
+            port['data_out'] = list(port['data'])
+            self.ports.append(port)
+
+        # set up fanouts and drivers
+        gnd = network.gnd
+        self.tristate_outputs = []   # nodes memory can drive
+        self.n_read_ports = 0
+        self.n_write_ports = 0
+        self.naddr = 0
+        for port in self.ports:
+            # we listen to clk, wen, oe and addr signals
+            port['clk'].add_fanout(self)
+            port['wen'].add_fanout(self)
+            port['oe'].add_fanout(self)
+            for node in port['addr']: node.add_fanout(self)
+            self.naddr = len(port['addr'])
+
+            # if there's a possibility of a write, we listen to data nodes
+            if port['clk'] is not gnd or port['wen'] is not gnd:
+                self.n_write_ports += 1
+                port['write_port'] = True
+                for node in port['data']: node.add_fanout(self)
+
+            # if there's a possibility of a read, add data nodes as drivers
+            if port['oe'] is not gnd:
+                self.n_read_ports += 1
+                port['read_port'] = True
+                for node in port['data']:
+                    node.add_driver(self)
+                    if node not in self.tristate_outputs: self.tristate_outputs.append(node)
+
+        # one byte per bit of memory
+        self.bits = bytearray(self.nlocations * self.width)
+
+        # compute size
+        if self.n_read_ports == 1 and self.n_write_ports == 0: cell = 0   # ROM
+        elif self.nlocations <= 1024: cell = options.get('mem_size_sram') or 5   # SRAM
+        else: cell = 0   # DRAM
+        # add 1 access fet per port
+        cell += len(self.ports) * (options.get('mem_size_access') or 1)
+
+        nports = len(self.ports)
+        self.size = (self.nlocations * self.width) * cell
+        self.size += nports * self.naddr * (options.get('mem_size_address_buffer') or 20)
+        self.size += nports * self.naddr * (options.get('mem_size_address_decoder') or 4)
+        self.size += self.n_read_ports * self.width * (options.get('mem_size_output_buffer') or 30)
+        self.size += self.n_write_ports * self.width * (options.get('mem_size_write_buffer') or 20)
+
+        network.add_component(self)
+
+    def change_output_node(self, old_node, new_node):
+        for port in self.ports:
+            out = port['data_out']
+            for j, dnode in enumerate(out):
+                if dnode is old_node: out[j] = new_node
+
+    # return contents of memory as a list, an element is None if any
+    # bits in corresponding word are X
+    def get_contents(self):
+        result = []
+        width = self.width
+        for i in range(self.nlocations):
+            word = 0
+            for j in range(width):
+                v = self.bits[i*width + (width - 1 - j)]
+                if v == VX:
+                    word = None
+                    break
+                word = 2*word + (1 if v == V1 else 0)
+            result.append(word)
+        return result
+
+    # set all memory locations to X
+    def clear_memory(self):
+        self.bits[:] = bytearray([VX]) * len(self.bits)
+
+    def initialize(self):
+        self.min_setup = None       # min observed setup time on inputs
+        self.min_setup_time = None  # when min observed setup was observed
+
+        self.clear_memory()   # start with all X's
+
+        # did user specify initial contents?
+        if self.contents:
+            width = self.width
+            for i in range(min(self.nlocations, len(self.contents))):
+                word = self.contents[i]
+                if word is None: continue
+                for j in range(width):
+                    self.bits[i*width + j] = (word >> j) & 1
+
+    def checkpoint(self):
+        return (bytes(self.bits), [port['edge_possible'] for port in self.ports],
+                self.min_setup, self.min_setup_time)
+
+    def restore(self, state):
+        bits, edges, self.min_setup, self.min_setup_time = state
+        self.bits[:] = bytearray(bits)
+        for port, edge in zip(self.ports, edges): port['edge_possible'] = edge
+
+    def update_from_node(self, node):
+        now = self.network.time
+        if now > 0:
+            tsetup = now - node.last_event_time()
+            if self.min_setup is None or tsetup < self.min_setup:
+                self.min_setup = tsetup
+                self.min_setup_time = now
+
+    def update_min_setup(self, port):
+        self.update_from_node(port['wen'])
+        for node in port['addr']: self.update_from_node(node)
+        for node in port['data']: self.update_from_node(node)
+
+    # compute value from list of nodes, MSB first.  Returns None if invalid
+    def value(self, nodes):
+        value = 0
+        for node in nodes:
+            v = node.v
+            if v == VX or v == VZ: return None
+            value = 2*value + (1 if v == V1 else 0)
+        return value
+
+    # return True if this a read port that is affecting its outputs
+    def active_read_port(self, port, cause):
+        if not port['read_port']: return False
+        # port is active if OE just changed or OE != 0 and some address
+        # input just changed
+        if cause is port['oe']: return True
+        return port['oe'].v != V0 and cause in port['addr']
+
+    # schedule propagation events for data terminals of a read port
+    def update_read_port(self, port):
+        addr = self.value(port['addr'])
+        table = TristateBufferTable[port['oe'].v]   # model of tristate driver
+        width = self.width
+        for i in range(width):
+            # MSB of data comes first in the list of data nodes
+            bit = (width - 1) - i
+            if addr is None or addr >= self.nlocations: v = VX
+            else: v = self.bits[addr*width + bit]
+            v = table[v][4]   # run it through the tristate driver
+            if v == V1: tpd, drive = self.tpdr, self.tr
+            elif v == V0: tpd, drive = self.tpdf, self.tf
+            elif v == VZ: tpd, drive = 0, 0   # going HI-Z is fast :)
+            else: tpd, drive = min(self.tpdr, self.tpdf), 0
+            port['data_out'][i].p_event(tpd, v, drive, self.lenient)
+
+    # memory location has changed, update read ports looking at that location
+    def location_changed(self, addr):
+        for port in self.ports:
+            if port['read_port'] and port['oe'].v != V0:
+                paddr = self.value(port['addr'])
+                # check for address match (X's always match)
+                if addr is None or paddr == addr:
+                    self.update_read_port(port)
+
+    # return True if this a write port that should capture a new data value
+    def active_write_port(self, port, cause):
+        if not port['write_port']: return False
+        if cause is port['clk']:
+            clk = port['clk'].v
+            if clk == V0: port['edge_possible'] = True
+            elif clk == V1 and port['edge_possible']:
+                port['edge_possible'] = False
+                if port['wen'].v != V0: return True
+        return False
+
+    def capacitance(self, node):
+        gnd = self.network.gnd
+        c = 0
+        for port in self.ports:
+            if port['clk'] is node: c += self.cin
+            if port['wen'] is node: c += self.cin
+            if port['oe'] is node: c += self.cin
+            for dnode in port['addr']:
+                if dnode is node: c += self.cin
+            for dnode in port['data']:
+                if dnode is node:
+                    # if there's a possibility of a write, data node is an input
+                    if port['clk'] is not gnd or port['wen'] is not gnd: c += self.cin
+                    # if there's a possibility of a read, data node is an output
+                    if port['oe'] is not gnd: c += self.cout
+        return c
+
+    def tristate(self, node):
+        return node in self.tristate_outputs
+
+    def process_event(self, event, cause):
+        if event.type == CONTAMINATE:
+            # only read ports have outputs to contaminate
+            for port in self.ports:
+                if self.active_read_port(port, cause):
+                    for node in port['data']: node.c_event(self.tcd)
+        else:
+            for port in self.ports:
+                if self.active_read_port(port, cause):
+                    self.update_read_port(port)
+
+                if self.active_write_port(port, cause):
+                    addr = self.value(port['addr'])
+                    # write appropriate location(s)
+                    if addr is None:
+                        self.clear_memory()
+                    elif addr < self.nlocations:
+                        width = self.width
+                        for bit in range(width):
+                            v = port['data'][bit].v if port['wen'].v == V1 else VX
+                            # MSB of data comes first in the list of data nodes
+                            self.bits[addr*width + (width - 1) - bit] = v
+
+                    self.location_changed(addr)
+                    self.update_min_setup(port)
+
+# simulate a module that includes its own sources, eg
+#   python gatesim.py files/gates files/mine /user/test 100n a b z
+# prints {node: [[times...], [values...]], ...} as json
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    import time
+    import grader
+    import netlist
+    from utils import parse_number_alert
+
+    parser = argparse.ArgumentParser(description='Gate-level simulation of a Jade module')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/)')
+    parser.add_argument('module', help='name of module to simulate, eg /user/test')
+    parser.add_argument('tstop', nargs='?', help='stop time, eg 100n (default with --test: the whole test)')
+    parser.add_argument('--node', action='append', default=[], help='report history of node (default: all top-level nodes)')
+    parser.add_argument('--test', action='store_true', help='drive the inputs from the module\'s test')
+    parser.add_argument('--scheduler', choices=['heap', 'calendar'], default='heap',
+                        help='event queue: a heap, which orders simultaneous events as Jade does, or a calendar queue')
+    parser.add_argument('--benchmark', action='store_true', help='time the simulation with each scheduler and compare the results')
+    parser.add_argument('--checkpoint', nargs=2, metavar=('TIME', 'FILE'), help='write a checkpoint of the simulation at TIME to FILE')
+    parser.add_argument('--resume', metavar='FILE', help='start from a checkpoint written by --checkpoint')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    options = {}
+    try:
+        if args.test:
+            spec = grader.parse_test(grader.test_source(modules.get(args.module, {})) or '')
+            nl, errors = grader.test_netlist(modules, args.module, spec, ('gate',))
+            if errors: sys.exit('\n'.join(errors))
+            nl, tstop, log_times = grader.test_circuit(nl, spec)
+            options.update(spec.options)
+        else:
+            nl = netlist.gate_netlist(modules, args.module)
+            tstop = None
+        if args.tstop: tstop = parse_number_alert(args.tstop)
+        if tstop is None: sys.exit('Need a stop time')
+
+        if args.benchmark:
+            histories = {}
+            for scheduler in ('heap', 'calendar'):
+                start = time.time()
+                network = transient_analysis(nl, tstop, dict(options, scheduler=scheduler))
+                elapsed = time.time() - start
+                histories[scheduler] = dict((n, network.history(n)) for n in network.node_list())
+                print('%-8s %8.3fs  %d devices, %d node transitions' %
+                      (scheduler, elapsed, len(network.devices), sum(len(h['xvalues']) for h in histories[scheduler].values())))
+            differ = [n for n in histories['heap'] if histories['heap'][n] != histories['calendar'][n]]
+            print('%d of %d node histories differ%s' % (len(differ), len(histories['heap']),
+                                                        ': ' + ', '.join(sorted(differ)[:10]) if differ else ''))
+            sys.exit(0)
+
+        options['scheduler'] = args.scheduler
+        network = Network(nl, options)
+        network.initialize(tstop)
+        if args.resume:
+            with open(args.resume, 'rb') as f: network.restore(f.read())
+        if args.checkpoint:
+            network.advance(parse_number_alert(args.checkpoint[0]))
+            with open(args.checkpoint[1], 'wb') as f: f.write(network.checkpoint())
+        network.simulate()
+    except (netlist.NetlistError, grader.TestError, SimulationError, IOError) as e:
+        sys.exit(str(e))
+
+    names = args.node or sorted(n for n in network.node_list() if '.' not in n and '$' not in n)
+    result = {}
+    for name in names:
+        h = network.history(name)
+        if h is None: sys.exit('No such node: ' + name)
+        result[name] = [h['xvalues'], h['yvalues']]
+    json.dump(result, sys.stdout)
+    print()
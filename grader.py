@@ -0,0 +1,694 @@
+# Run the tests in the "test" aspect of Jade modules without a browser.
+#
+# Test scripts are parsed and run the way test_view.js does: the same
+# .power/.thresholds/.group/.mode/.cycle/.repeat/.log/.mverify
+# statements, the same input drivers and sample times, the same error
+# messages.  A passing module gets the same "passed <md5> <md5> <benmark>"
+# result Jade records in a lab's state, so results can be checked
+# against what students submitted.  Gate-level tests are simulated with
+# gatesim.py, device-level ones with cktsim.py (which needs numpy).
+#
+# Used from the command line to grade every module with a test in one
+# or more libraries, in parallel:
+#
+#   python grader.py --base lab5.html labs.json
+#   python grader.py --jobs 8 --json files/ward
+#
+# With --cache, results are kept in a resultcache.ResultCache, so a module
+# whose netlist and test haven't changed isn't simulated again.  Results
+# can include the waveforms of signals (--trace) and a timing summary
+# (--timing), which are cached too.
+#
+# Libraries are files saved by server_local.py (see files/), Jade pages
+# with an initial_state (eg, lab5.html), a store saved by server.py
+# (labs.json or labs.log, every key, read without changing it so a
+# running server can keep using it) or a single key in a store
+# (labs.json:/lab5.html).  --base libraries go underneath each library
+# being graded, users' states are loaded on top of them the way Jade
+# does, so read-only tests come from the base.
+
+import os
+import re
+
+import netlist
+import gatesim
+import cktsim
+import resultcache
+from utils import parse_number, parse_signal, engineering_notation, js_string, md5
+
+class TestError(Exception):
+    pass
+
+_token = re.compile(r'([A-Za-z0-9_.:\[\]]+|=|-|,|\(|\))')
+
+# JavaScript's parseInt: leading integer (or 0x hex), None if there isn't one
+def _parse_int(s):
+    m = re.match(r'^\s*([\-+]?)(0[xX][0-9a-fA-F]+|\d+)', s or '')
+    if m is None: return None
+    return int(m.group(1) + m.group(2), 0 if m.group(2)[:2].lower() == '0x' else 10)
+
+##################################################
+##  Test specifications
+##################################################
+
+# the parsed contents of a module's test aspect
+class TestSpec(object):
+    def __init__(self, source):
+        self.md5sum = md5(source)    # for server-side verification
+        self.mode = 'device'         # which simulation to run
+        self.options = {}            # simulator options
+        self.power = {}              # node name -> voltage
+        self.thresholds = {}         # spec name -> voltage
+        self.groups = {}             # group name -> list of indicies
+        self.signals = []            # signals in the order they appear on a test line
+        self.cycle = []              # list of test actions: [action args...]
+        self.tests = []              # list of test lines
+        self.driven_signals = {}     # name -> [[t, '0'/'1'/'Z'], ...]
+        self.sampled_signals = {}    # name -> [(t, 'L'/'H', test number), ...]
+        self.log_signals = []        # signals to report in each log entry
+        self.mverify = {}            # mem name -> {locn: value}
+        self.mverify_src = []        # .mverify source lines (used for checksum)
+        self.errors = []
+        self.parse(source)
+
+    def parse(self, source):
+        errors = self.errors
+        # remove multiline comments, in-line comments
+        source = re.sub(r'/\*(.|\n)*?\*/', '', source)
+        source = re.sub(r'//.*', '', source)
+
+        repeat = 1
+        for text in source.split('\n'):
+            line = _token.findall(text)
+            if not line: continue
+            if line[0] == '.mode':
+                if len(line) != 2: errors.append('Malformed .mode statement: ' + text)
+                elif line[1] in ('device', 'gate'): self.mode = line[1]
+                else: errors.append('Unrecognized simulation mode: ' + line[1])
+            elif line[0] == '.options':
+                # .options name=value name=value ...
+                for i in range(1, len(line), 3):
+                    if i + 2 >= len(line) or line[i+1] != '=':
+                        errors.append('Malformed %s statement: %s' % (line[0], text))
+                        break
+                    v = parse_number(line[i+2])
+                    if v != v:
+                        errors.append('Unrecognized option value "%s": %s' % (line[i+2], text))
+                        break
+                    self.options[line[i].lower()] = v
+            elif line[0] == '.power' or line[0] == '.thresholds':
+                # .power/.thresholds name=float name=float ...
+                for i in range(1, len(line), 3):
+                    if i + 2 >= len(line) or line[i+1] != '=':
+                        errors.append('Malformed %s statement: %s' % (line[0], text))
+                        break
+                    v = parse_number(line[i+2])
+                    if v != v:
+                        errors.append('Unrecognized voltage specification "%s": %s' % (line[i+2], text))
+                        break
+                    if line[0] == '.power': self.power[line[i].lower()] = v
+                    else: self.thresholds[line[i]] = v
+            elif line[0] == '.group':
+                # .group group_name name...
+                if len(line) < 3:
+                    errors.append('Malformed .group statement: ' + text)
+                else:
+                    # each group has an associated list of signal indicies
+                    self.groups[line[1]] = []
+                    for sig in line[2:]:
+                        for s in parse_signal(sig):
+                            self.groups[line[1]].append(len(self.signals))
+                            self.signals.append(s)
+            elif line[0] in ('.plot', '.plotdef'):
+                pass   # no plots here
+            elif line[0] == '.cycle':
+                if self.cycle:
+                    errors.append('More than one .cycle statement: ' + text)
+                    break
+                if not self.parse_cycle(line, text): break
+            elif line[0] == '.repeat':
+                repeat = _parse_int(line[1] if len(line) > 1 else None)
+                if repeat is None or repeat < 1:
+                    errors.append('Expected positive integer for .repeat: %s' % (line[1] if len(line) > 1 else ''))
+                    repeat = 1
+            elif line[0] == '.log':
+                # capture signal names for later printout
+                for sig in line[1:]: self.log_signals.extend(parse_signal(sig))
+            elif line[0] == '.mverify':
+                # .mverify mem_name locn value...
+                if len(line) < 4:
+                    errors.append('Malformed .mverify statement: ' + text)
+                    continue
+                locn = _parse_int(line[2])
+                if locn is None:
+                    errors.append('Bad location "%s" in .mverify statement: %s' % (line[2], text))
+                    continue
+                a = self.mverify.setdefault(line[1].lower(), {})
+                for item in line[3:]:
+                    v = _parse_int(item)
+                    if v is None:
+                        errors.append('Bad value "%s" in .mverify statement: %s' % (item, text))
+                    else:
+                        a[locn] = v
+                        locn += 1
+                self.mverify_src.append(text)   # remember source line for checksum
+            elif line[0][0] == '.':
+                errors.append('Unrecognized control statment: ' + text)
+            else:
+                test = ''.join(line)
+                # each test should specify values for each signal in each group
+                if len(test) != len(self.signals):
+                    errors.append('Test line does not specify %d signals: %s' % (len(self.signals), text))
+                    break
+                # check for legal test values
+                for ch in test:
+                    if ch not in '01ZLH-':
+                        errors.append('Illegal test value %s: %s (must be one of 01ZLH-)' % (ch, text))
+                        break
+                # repeat the test the request number of times, leave repeat at 1
+                self.tests.extend([test] * repeat)
+                repeat = 1
+
+        # check for necessary threshold specs
+        for t in ('Vol', 'Vil', 'Vih', 'Voh'):
+            if t not in self.thresholds: errors.append('Missing %s threshold specification' % t)
+        if not self.cycle: errors.append('Missing .cycle specification')
+        if not self.tests: errors.append('No tests specified!')
+
+    # .cycle actions...
+    #   assert <group_name>
+    #   deassert <group_name>
+    #   sample <group_name>
+    #   tran <duration>
+    #   log
+    #   <name> = <voltage>
+    # returns False if there was an error
+    def parse_cycle(self, line, text):
+        errors = self.errors
+        i = 1
+        while i < len(line):
+            if line[i] in ('assert', 'deassert', 'sample') and i + 1 < len(line):
+                glist = self.groups.get(line[i+1])
+                if glist is None:
+                    errors.append('Use of undeclared group name "%s" in .cycle: %s' % (line[i+1], text))
+                    return False
+                # keep track of which signals are driven and sampled
+                for j in glist:
+                    if line[i] == 'sample': self.sampled_signals[self.signals[j]] = []
+                    else: self.driven_signals[self.signals[j]] = [[0, 'Z']]   # driven node is 0 at t=0
+                self.cycle.append([line[i], line[i+1]])
+                i += 2
+            elif line[i] == 'tran' and i + 1 < len(line):
+                v = parse_number(line[i+1])
+                if v != v:
+                    errors.append('Unrecognized tran duration "%s": %s' % (line[i+1], text))
+                    return False
+                self.cycle.append(['tran', v])
+                i += 2
+            elif line[i] == 'log':
+                self.cycle.append(['log'])
+                i += 1
+            elif i + 2 < len(line) and line[i+1] == '=':
+                v = line[i+2]   # expect 0,1,Z
+                if v not in ('0', '1', 'Z'):
+                    errors.append('Unrecognized value specification "%s": %s' % (v, text))
+                    return False
+                self.cycle.append(['set', line[i].lower(), v])
+                self.driven_signals[line[i].lower()] = [[0, 'Z']]   # driven node is 0 at t=0
+                i += 3
+            else:
+                errors.append('Malformed .cycle action "%s": %s' % (line[i], text))
+                return False
+        return True
+
+    # go through each test determining transition times for each driven
+    # node and sample times for each sampled node.  Returns the total
+    # simulation time and the times at which to make log entries.
+    def schedule(self):
+        time = 0
+        log_times = []
+        signals = self.signals
+
+        def set_voltage(tvlist, v):
+            if v != tvlist[-1][1]: tvlist.append([time, v])
+
+        for tindex, test in enumerate(self.tests):
+            for action in self.cycle:
+                if action[0] == 'assert' or action[0] == 'deassert':
+                    for sindex in self.groups[action[1]]:
+                        if action[0] == 'deassert' or test[sindex] in '01Z':
+                            set_voltage(self.driven_signals[signals[sindex]],
+                                        'Z' if action[0] == 'deassert' else test[sindex])
+                elif action[0] == 'sample':
+                    for sindex in self.groups[action[1]]:
+                        if test[sindex] in 'HL':
+                            self.sampled_signals[signals[sindex]].append((time, test[sindex], tindex + 1))
+                elif action[0] == 'set':
+                    set_voltage(self.driven_signals[action[1]], action[2])
+                elif action[0] == 'log':
+                    log_times.append(time)
+                elif action[0] == 'tran':
+                    time += action[1]
+        return time, log_times
+
+def parse_test(source):
+    spec = TestSpec(source)
+    if spec.errors: raise TestError('Errors in test specification:\n' + '\n'.join(spec.errors))
+    return spec
+
+# source of the module's test aspect, None if it doesn't have one
+def test_source(module):
+    for c in module.get('test') or []:
+        if c[0] == 'test' and len(c) > 1 and c[1]: return c[1]
+    return None
+
+##################################################
+##  Simulating tests
+##################################################
+
+# each input node is connected to a tristate driver with the input and
+# enable waveforms chosen to produce 0, 1 or Z
+def build_inputs_gate(netlist, driven_signals, thresholds):
+    for node in driven_signals:
+        netlist.append({'type': 'tristate',
+                        'connections': {'e': node + '_enable', 'a': node + '_data', 'z': node},
+                        'properties': {'name': node + '_input_driver', 'tcd': 0, 'tpd': 100e-12, 'tr': 0, 'tf': 0, 'cin': 0, 'size': 0}})
+
+    vol = thresholds['Vol']
+    voh = thresholds['Voh']
+    for node, tvlist in driven_signals.items():
+        e_pwl = [0, vol]   # initial <t,v> for enable (off)
+        a_pwl = [0, vol]   # initial <t,v> for data (0)
+        for t, v in tvlist:
+            if v == '0': E, A = voh, vol      # enable on, data 0
+            elif v == '1': E, A = voh, voh    # enable on, data 1
+            else: E, A = vol, vol             # enable off, data is don't care
+            # ramp to next control voltage over 0.1ns
+            for pwl, x in ((e_pwl, E), (a_pwl, A)):
+                last = pwl[-1]
+                if last != x:
+                    if t != pwl[-2]: pwl.extend([t, last])
+                    pwl.extend([t + 0.1e-9, x])
+        netlist.append({'type': 'voltage source',
+                        'connections': {'nplus': node + '_enable', 'nminus': 'gnd'},
+                        'properties': {'name': node + '_enable_source', 'value': {'type': 'pwl', 'args': e_pwl}}})
+        netlist.append({'type': 'voltage source',
+                        'connections': {'nplus': node + '_data', 'nminus': 'gnd'},
+                        'properties': {'name': node + '_data_source', 'value': {'type': 'pwl', 'args': a_pwl}}})
+
+# for device-level tests, each input node has a pullup and pulldown FET
+# with the gate waveforms chosen to produce 0, 1 or Z
+def build_inputs_device(netlist, driven_signals, thresholds):
+    vol = thresholds['Vol']
+    voh = thresholds['Voh']
+    netlist.append({'type': 'voltage source', 'connections': {'nplus': '_voh_', 'nminus': 'gnd'},
+                    'properties': {'name': '_voh_source', 'value': {'type': 'dc', 'args': [voh]}}})
+    netlist.append({'type': 'voltage source', 'connections': {'nplus': '_vol_', 'nminus': 'gnd'},
+                    'properties': {'name': '_vol_source', 'value': {'type': 'dc', 'args': [vol]}}})
+    for node in driven_signals:
+        netlist.append({'type': 'pfet', 'connections': {'d': '_voh_', 'g': node + '_pullup', 's': node},
+                        'properties': {'W': 100, 'L': 1, 'name': node + '_pullup'}})
+        netlist.append({'type': 'nfet', 'connections': {'d': node, 'g': node + '_pulldown', 's': '_vol_'},
+                        'properties': {'W': 100, 'L': 1, 'name': node + '_pulldown'}})
+
+    for node, tvlist in driven_signals.items():
+        pu_pwl = [0, voh]   # initial <t,v> for pullup gate (off)
+        pd_pwl = [0, vol]   # initial <t,v> for pulldown gate (off)
+        for t, v in tvlist:
+            if v == '0': PU, PD = voh, voh    # pulldown on, pullup off
+            elif v == '1': PU, PD = vol, vol  # pulldown off, pullup on
+            else: PU, PD = voh, vol           # both off
+            # ramp to next control voltage over 0.1ns
+            for pwl, x in ((pu_pwl, PU), (pd_pwl, PD)):
+                last = pwl[-1]
+                if last != x:
+                    if t != pwl[-2]: pwl.extend([t, last])
+                    pwl.extend([t + 0.1e-9, x])
+        netlist.append({'type': 'voltage source',
+                        'connections': {'nplus': node + '_pullup', 'nminus': 'gnd'},
+                        'properties': {'name': node + '_pullup_source', 'value': {'type': 'pwl', 'args': pu_pwl}}})
+        netlist.append({'type': 'voltage source',
+                        'connections': {'nplus': node + '_pulldown', 'nminus': 'gnd'},
+                        'properties': {'name': node + '_pulldown_source', 'value': {'type': 'pwl', 'args': pd_pwl}}})
+
+# value after the most recent history point before t
+def interpolate(t, times, values):
+    for i, x in enumerate(times):
+        if t < x: return values[i-1] if i > 0 else None
+    return None
+
+# voltage at t, interpolated between history points
+def interpolate_device(t, times, values):
+    for i, x in enumerate(times):
+        if t < x:
+            if i == 0: return values[0]
+            t1, v1, v2 = times[i-1], values[i-1], values[i]
+            return v1 if t == t1 else v1 + (t - t1) * (v2 - v1) / (x - t1)
+    return None
+
+# spec's value of a node with the given history at time t: the logic
+# value for gate-level tests, the voltage for device-level ones
+def sample(spec, t, history):
+    if history is None: return None
+    if spec.mode == 'device': return interpolate_device(t, history['xvalues'], history['yvalues'])
+    return interpolate(t, history['xvalues'], history['yvalues'])
+
+# run spec's tests on module name, return dict with results:
+#   status -- 'passed', 'failed' or 'error'
+#   errors -- list of error messages
+#   tests -- number of test cycles, failed_test -- number of first failing test
+#   time -- simulated time, size -- circuit size, log -- list of log lines
+#   result -- the string Jade records for a passing test
+#   traces -- {signal: {'xvalues': times, 'yvalues': values}} for each of
+#             the signals in traces
+#   timing -- with timing=True, timing.Analysis(...).summary() of the module
+#   cached -- True if the result came from cache, a resultcache.ResultCache
+def run_test(modules, name, spec, cache=None, traces=(), timing=False):
+    result = {'module': name, 'status': 'error', 'errors': [], 'tests': len(spec.tests),
+              'failed_test': None, 'md5sum': spec.md5sum}
+    nl, result['errors'] = test_netlist(modules, name, spec)
+    if nl is None: return result
+    if cache is not None:
+        options = spec.options
+        if traces or timing: options = dict(options, traces=sorted(traces), timing=timing)
+        key = resultcache.result_key(nl, spec.md5sum, options)
+        cached = cache.get(key)
+        if cached is not None:
+            cached.update(module=name, cached=True)
+            return cached
+    network = simulate_test(nl, spec, result)
+    if traces:
+        result['traces'] = dict((node, None if network is None else _trace(network, node)) for node in traces)
+    if timing: result['timing'] = timing_summary(nl, spec)
+    if cache is not None: cache.put(key, dict((k, v) for k, v in result.items() if k != 'module'))
+    return result
+
+# network.history(node) as lists (cktsim's are numpy arrays), so it can
+# be kept as JSON
+def _trace(network, node):
+    history = network.history(node)
+    if history is None: return None
+    return dict((k, v.tolist() if hasattr(v, 'tolist') else v) for k, v in history.items())
+
+# worst-case timing of netlist nl from test_netlist, see timing.Analysis
+def timing_summary(nl, spec):
+    if spec.mode != 'gate': return {'error': 'Timing analysis needs a gate-level test'}
+    import timing
+    try:
+        return timing.Analysis(nl, spec.options).summary()
+    except (gatesim.SimulationError, timing.TimingError, ValueError) as e:
+        return {'error': str(e)}
+
+# the gate- or device-level netlist (as spec.mode says) of module name
+# for spec's tests, extracted with spec's power supplies as globals.
+# modes are the kinds of test the caller can run.  Returns (netlist, [])
+# or, if the tests can't be run, (None, list of errors).
+def test_netlist(modules, name, spec, modes=('gate', 'device')):
+    module = modules.get(name)
+    if module is None or not module.get('schematic'):
+        return None, ['This module has no schematic!']
+    if spec.mode not in modes:
+        return None, ['%s-level tests are not supported' % spec.mode]
+
+    # all the power supplies are global
+    globals = list(spec.power.keys()) + ['gnd']
+    try:
+        if spec.mode == 'device': nl = netlist.device_netlist(modules, name, globals)
+        else: nl = netlist.gate_netlist(modules, name, globals)
+    except netlist.NetlistError as e:
+        return None, ['Error extracting netlist: %s' % e]
+
+    nodes = set(n for d in nl for n in d['connections'].values())
+    errors = []
+    for node in list(spec.driven_signals) + list(spec.sampled_signals) + spec.log_signals:
+        if node not in spec.driven_signals and node not in nodes:
+            errors.append('There are no devices connected to node "%s".' % node)
+    if errors: return None, errors
+    return nl, []
+
+# netlist nl from test_netlist with spec's power supplies and input
+# drivers added (nl itself is left alone, so it can be used again).
+# Returns (netlist, simulation time, log times).
+def test_circuit(nl, spec):
+    # ensure simulator knows what gnd is
+    nl = nl + [{'type': 'ground', 'connections': {'gnd': 'gnd'}, 'properties': {}}]
+
+    # add voltage sources for power supplies
+    for node, v in spec.power.items():
+        nl.append({'type': 'voltage source', 'connections': {'nplus': node, 'nminus': 'gnd'},
+                   'properties': {'value': {'type': 'dc', 'args': [v]}, 'name': node}})
+
+    time, log_times = spec.schedule()
+    if spec.mode == 'device': build_inputs_device(nl, spec.driven_signals, spec.thresholds)
+    else: build_inputs_gate(nl, spec.driven_signals, spec.thresholds)
+    return nl, time, log_times
+
+# simulate netlist nl from test_netlist, check the results and fill them
+# into result (see run_test).  If given, the simulation picks up from
+# checkpoint (see test_checkpoint, gate-level tests only).  Returns the
+# gatesim.Network or cktsim.Circuit, None if the simulation failed.
+def simulate_test(nl, spec, result, checkpoint=None):
+    nl, time, log_times = test_circuit(nl, spec)
+    try:
+        if spec.mode == 'device':
+            if checkpoint is not None: raise ValueError('device-level tests have no checkpoints')
+            network = cktsim.Circuit(nl, spec.options)
+            network.tran(100, 0, time, list(spec.sampled_signals))
+        else:
+            network = gatesim.Network(nl, spec.options)
+            network.initialize(time)
+            if checkpoint is not None: network.restore(checkpoint)
+            network.simulate()
+    except (gatesim.SimulationError, cktsim.CktsimError, ValueError) as e:
+        result['errors'].append('Error running simulation: %s' % e)
+        return None
+
+    errors = verify_results(network, spec, result)
+    result['time'] = network.time
+    result['size'] = network.size
+    result['log'] = [''.join('?' if v is None else '01XZ'[v] for v in entry)
+                     for entry in _log_values(network, spec, log_times)]
+    if errors:
+        result['status'] = 'failed'
+        result['errors'] = errors
+    else:
+        result['status'] = 'passed'
+        mverify_md5sum = md5('\n'.join(spec.mverify_src))
+        try:
+            benmark = 1e-10 / ((network.size * 1e-12) * network.time)
+        except ZeroDivisionError:
+            benmark = float('inf')
+        result['result'] = 'passed %s %s %s' % (spec.md5sum, mverify_md5sum, js_string(benmark))
+    return network
+
+# checkpoint of spec's tests on netlist nl from test_netlist after the
+# first ntests test cycles, eg the reset.  Any test of the same circuit
+# whose first ntests cycles drive the inputs the same way can start
+# from it instead of simulating them again.  Gate-level tests only.
+def test_checkpoint(nl, spec, ntests=1):
+    if spec.mode != 'gate': raise TestError('Only gate-level tests have checkpoints')
+    nl, time, log_times = test_circuit(nl, spec)
+    network = gatesim.Network(nl, spec.options)
+    network.initialize(time)
+    network.advance(ntests * sum(action[1] for action in spec.cycle if action[0] == 'tran'))
+    return network.checkpoint()
+
+# check the sampled node values for each test cycle, return list of errors
+def verify_results(network, spec, result):
+    # order tests by time, then by name
+    tests = [(t, node, v, i) for node, tvlist in spec.sampled_signals.items() for t, v, i in tvlist]
+    tests.sort(key=lambda test: (test[0], test[1]))
+
+    if spec.mode == 'device':
+        vil = spec.thresholds['Vil']
+        vih = spec.thresholds['Vih']
+        low = lambda v: v <= vil
+        high = lambda v: v >= vih
+    else:
+        low = lambda v: v == 0
+        high = lambda v: v == 1
+
+    errors = []
+    t_error = None
+    histories = {}
+    for t, node, expected, i in tests:
+        # report all the errors for the first failing test
+        if t_error is not None and t_error < i: break
+
+        if node not in histories: histories[node] = network.history(node)
+        v = sample(spec, t, histories[node])
+        if v is None or (expected == 'L' and not low(v)) or (expected == 'H' and not high(v)):
+            errors.append('Test %d: Expected %s=%s at %ss.' % (i, node, expected, engineering_notation(t, 2)))
+            t_error = i
+    result['failed_test'] = t_error
+
+    # perform requested memory verifications
+    for mem_name, a in spec.mverify.items():
+        mem = network.device_map.get(mem_name)
+        if mem is None or getattr(mem, 'type', None) != 'memory':
+            errors.append('Cannot find memory named "%s", verification aborted.' % mem_name)
+            continue
+        contents = mem.get_contents()
+        for locn in sorted(a):
+            v = a[locn]
+            got = contents[locn] if 0 <= locn < len(contents) else None
+            if got is None and not 0 <= locn < len(contents):
+                errors.append('Location %d out of range for memory %s' % (locn, mem_name))
+            if got != v:
+                errors.append('%s[0x%x]: Expected 0x%x, got %s' % (mem_name, locn, v, 'undefined' if got is None else '0x%x' % got))
+    return errors
+
+# values (0, 1, 2 for X or 3 for Z) of the .log signals at each log time.
+# Device-level voltages are 0 at or below Vil, 1 at or above Vih and X
+# in between.
+def _log_values(network, spec, log_times):
+    histories = [network.history(n) for n in spec.log_signals]
+    values = [[sample(spec, t, h) for h in histories] for t in log_times]
+    if spec.mode == 'device':
+        vil = spec.thresholds['Vil']
+        vih = spec.thresholds['Vih']
+        values = [[None if v is None else (0 if v <= vil else (1 if v >= vih else 2)) for v in entry]
+                  for entry in values]
+    return values
+
+##################################################
+##  Grading libraries
+##################################################
+
+_here = os.path.dirname(os.path.abspath(__file__))
+
+# Jade always has the parts libraries
+def parts_libraries():
+    return [netlist.load_library(os.path.join(_here, 'files', f)) for f in ('gates', 'analog')]
+
+# expand a library argument (see top of file) into a list of
+# (label, modules, recorded test results)
+def load_libraries(spec):
+    import json
+    import labstore
+
+    filename, _, key = spec.partition(':')
+    if filename.endswith('.json') or filename.endswith('.log'):
+        # read-only: a server may be using the store
+        try:
+            labs = labstore.read_store(filename)
+        except IOError as e:
+            raise TestError("Can't read %s: %s" % (filename, e.strerror or e))
+        result = []
+        for k in ([key] if key else sorted(labs)):
+            value = labs.get(k)
+            if value is None: raise TestError('No key %s in %s' % (k, filename))
+            value = json.loads(value)
+            result.append(('%s:%s' % (filename, k), value.get('state', {}), value.get('tests') or {}))
+        return result
+    if filename.endswith('.html'):
+        return [(spec, netlist.load_page(filename), {})]
+    return [(spec, netlist.load_library(filename), {})]
+
+_libraries = None   # (label, modules, recorded) for each library, set in each worker
+_cache = None       # ResultCache, if any
+
+_options = {}       # traces and timing arguments of run_test
+
+def _init_worker(libraries, cache=None, options=None):
+    global _libraries, _cache, _options
+    _libraries = libraries
+    _cache = cache
+    _options = options or {}
+
+# run the test for one module in a worker
+def _grade(job):
+    index, name = job
+    label, modules, recorded = _libraries[index]
+    try:
+        spec = TestSpec(test_source(modules[name]))
+        if spec.errors:
+            result = {'module': name, 'status': 'error', 'tests': len(spec.tests), 'failed_test': None,
+                      'errors': ['Errors in test specification:'] + spec.errors}
+        else:
+            result = run_test(modules, name, spec, _cache, **_options)
+    except Exception as e:
+        result = {'module': name, 'status': 'error', 'tests': None, 'failed_test': None,
+                  'errors': ['%s: %s' % (e.__class__.__name__, e)]}
+    result['library'] = label
+    if name in recorded: result['recorded'] = recorded[name]
+    return result
+
+# grade every module with a test in each library, using a pool of jobs
+# processes and, if given, a ResultCache.  traces and timing are passed
+# on to run_test.  Yields result dicts (see run_test) in order.
+def grade(libraries, base=(), only=None, jobs=None, cache=None, traces=(), timing=False):
+    import multiprocessing
+
+    below = netlist.merge_libraries(*(parts_libraries() + list(base)))
+    candidates = set(name for lib in base for name in lib)
+    merged = []
+    work = []
+    for label, state, recorded in libraries:
+        modules = netlist.overlay_libraries(below, state)
+        merged.append((label, modules, recorded))
+        # the parts libraries have tests too, but they aren't ours to grade
+        for name in sorted(candidates.union(state)):
+            if only and name not in only: continue
+            if name not in modules: continue
+            if test_source(modules[name]) is not None: work.append((len(merged) - 1, name))
+
+    options = {'traces': list(traces), 'timing': timing}
+    if jobs == 1 or len(work) <= 1:
+        _init_worker(merged, cache, options)
+        for job in work: yield _grade(job)
+        return
+
+    pool = multiprocessing.Pool(jobs, _init_worker, (merged, cache, options))
+    try:
+        for result in pool.imap(_grade, work): yield result
+    finally:
+        pool.terminate()
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Run the tests of every module in Jade libraries')
+    parser.add_argument('libraries', nargs='+', help='libraries to grade: files/user, lab5.html, labs.json, labs.json:/lab5.html')
+    parser.add_argument('--base', action='append', default=[], help='library loaded underneath each graded library, eg lab5.html')
+    parser.add_argument('--module', action='append', default=[], help='only grade this module')
+    parser.add_argument('--jobs', type=int, default=None, help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--json', action='store_true', help='print one JSON result per line')
+    parser.add_argument('--cache', metavar='DIR', help='reuse results kept in DIR, eg %s' % resultcache.default_cache_dir)
+    parser.add_argument('--cache-size', type=float, default=100, help='size limit of the cache in MB (default 100)')
+    parser.add_argument('--trace', default='', metavar='SIGNALS', help='include the waveforms of these signals in --json results, eg "S[3:0],C"')
+    parser.add_argument('--timing', action='store_true', help='include a summary of the worst-case timing in --json results')
+    args = parser.parse_args()
+    cache = resultcache.ResultCache(args.cache, int(args.cache_size * 1024 * 1024)) if args.cache else None
+
+    try:
+        base = []
+        for spec in args.base:
+            for label, modules, recorded in load_libraries(spec): base.append(modules)
+        libraries = []
+        for spec in args.libraries: libraries.extend(load_libraries(spec))
+    except (IOError, ValueError, TestError, netlist.NetlistError) as e:
+        sys.exit(str(e))
+
+    counts = {}
+    ncached = 0
+    start = time.time()
+    for r in grade(libraries, base, set(args.module), args.jobs, cache, parse_signal(args.trace), args.timing):
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+        if r.get('cached'): ncached += 1
+        if args.json:
+            print(json.dumps(r, sort_keys=True))
+        else:
+            detail = '%s tests' % r['tests'] if r['tests'] is not None else ''
+            if r['failed_test'] is not None: detail += ', failed test %d' % r['failed_test']
+            if r.get('cached'): detail += ' (cached)'
+            print('%-40s %-24s %-7s %s' % (r['library'], r['module'], r['status'], detail))
+            for e in r['errors'][:5]: print('    ' + e)
+        sys.stdout.flush()
+    summary = ', '.join('%d %s' % (counts[s], s) for s in ('passed', 'failed', 'error') if s in counts)
+    if ncached: summary += ' (%d cached)' % ncached
+    sys.stderr.write('%s in %.1fs\n' % (summary or 'nothing to grade', time.time() - start))
+    sys.exit(0 if counts.get('passed', 0) == sum(counts.values()) else 1)
@@ -0,0 +1,271 @@
+# key/value stores for the per-lab state saved by server.py
+#
+# JsonFileStore is the original scheme: one json dictionary that's read
+# and rewritten in its entirety on every request.
+#
+# LogStore keeps the same key/value pairs in an append-only log with an
+# in-memory index of where the latest value for each key lives, so a
+# read or write only touches the bytes for that one key.  Each record is
+#
+#    length (4 bytes, big-endian)  crc32 (4 bytes, big-endian)  payload
+#
+# where payload is the utf-8 json encoding of [key,value].  A crash in the
+# middle of an append leaves a short or corrupt record at the end of the
+# log, which is simply truncated away the next time the log is opened.
+# A damaged record anywhere else is skipped, with a warning, and the
+# records after it are kept.
+# When most of the log is superseded values it's compacted by writing the
+# live records to a new file and renaming it over the old one.
+
+import os
+import json
+import struct
+import threading
+import warnings
+import zlib
+
+_header = struct.Struct('>II')
+
+# os.replace is atomic on posix and windows, but is python3 only
+_replace = getattr(os, 'replace', os.rename)
+
+# one lock per key, so a read-modify-write of one lab's state doesn't
+# hold up requests for other labs.  (JsonFileStore still saves one lab
+# at a time, since each save rewrites the whole file.)
+class KeyLocks(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    def __call__(self, key):
+        with self.lock:
+            lock = self.locks.get(key)
+            if lock is None:
+                lock = self.locks[key] = threading.Lock()
+        return lock
+
+# (key, value) of the record at the start of data, None if there isn't
+# a complete, undamaged one there
+def _decode(data):
+    if len(data) < _header.size: return None
+    length, crc = _header.unpack_from(data)
+    payload = data[_header.size:_header.size + length]
+    if len(payload) < length or zlib.crc32(payload) & 0xFFFFFFFF != crc: return None
+    try:
+        key, value = json.loads(payload.decode('utf-8'))
+    except ValueError:
+        return None
+    return key, value
+
+# offset in data of the first good record after the one at its start,
+# None if there isn't one.  Payloads are json lists, so only look where
+# one could start and end.
+def _resync(data):
+    i = 0
+    while True:
+        i = data.find(b'[', i + 1)
+        if i < 0: return None
+        start = i - _header.size
+        if start <= 0: continue
+        length = _header.unpack_from(data, start)[0]
+        if data[i + length - 1:i + length] == b']' and _decode(data[start:]) is not None:
+            return start
+
+# read through log f calling visit(key, value, offset of payload, length
+# of payload) for each record.  A damaged record with good ones after it
+# (eg a disk error) is skipped with a warning; one that's the last thing
+# in the log is a write that was cut off.  Returns the offset just past
+# the last good record and the number of damaged bytes skipped.
+def _scan_log(f, visit):
+    f.seek(0)
+    offset = 0
+    skipped = 0
+    while True:
+        header = f.read(_header.size)
+        if len(header) == 0: break
+        payload = f.read(_header.unpack(header)[0]) if len(header) == _header.size else b''
+        record = _decode(header + payload)
+        if record is None:
+            f.seek(offset)
+            n = _resync(f.read())
+            if n is None: break
+            warnings.warn('%s: skipping %d damaged bytes at offset %d' % (f.name, n, offset))
+            skipped += n
+            offset += n
+            f.seek(offset)
+            continue
+        visit(record[0], record[1], offset + _header.size, len(payload))
+        offset += _header.size + len(payload)
+    return offset, skipped
+
+# the key/value pairs saved in a store's file (.json or .log), read
+# without changing the file, eg while a server is appending to it.  A
+# record still being written at the end of a log is ignored.  Raises
+# IOError if there's no such file.
+def read_store(filename):
+    if not filename.endswith('.log'):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    labs = {}
+    def visit(key, value, offset, length):
+        labs[key] = value
+    with open(filename, 'rb') as f:
+        _scan_log(f, visit)
+    return labs
+
+class JsonFileStore(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.key_lock = KeyLocks()
+        if not os.path.exists(filename):
+            with open(filename, 'w') as f:
+                json.dump({}, f)
+
+    def _load(self):
+        with open(self.filename, 'r') as f:
+            return json.load(f)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._load().get(key, default)
+
+    def put(self, key, value):
+        with self.lock:
+            labs = self._load()
+            labs[key] = value
+            with open(self.filename, 'w') as f:
+                json.dump(labs, f)
+
+    def keys(self):
+        with self.lock:
+            return list(self._load().keys())
+
+    def close(self):
+        pass
+
+class LogStore(object):
+    # compact when superseded records account for more than half the log
+    # and there's at least min_garbage bytes to reclaim
+    def __init__(self, filename, legacy=None, sync=True, min_garbage=1 << 20):
+        self.filename = filename
+        self.sync = sync
+        self.min_garbage = min_garbage
+        self.lock = threading.Lock()     # guards log file and index
+        self.key_lock = KeyLocks()
+        self.index = {}      # key => (offset of payload, length of payload)
+        self.garbage = 0     # bytes in log occupied by superseded records
+        self.pending = 0     # puts written to the log but not yet synced
+
+        if not os.path.exists(filename):
+            self._create(legacy)
+        self.log = open(filename, 'r+b')
+        self._scan()
+
+    # start a new log, seeded from an old-style json file if there is one
+    def _create(self, legacy):
+        labs = {}
+        if legacy is not None and os.path.exists(legacy):
+            with open(legacy, 'r') as f:
+                labs = json.load(f)
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'wb') as f:
+            for key, value in labs.items():
+                f.write(self._record(key, value))
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmpname, self.filename)
+
+    def _record(self, key, value):
+        payload = json.dumps([key, value]).encode('utf-8')
+        return _header.pack(len(payload), zlib.crc32(payload) & 0xFFFFFFFF) + payload
+
+    # build index by reading through the log, trimming off any torn record
+    # left at the end by a crash.  Damaged records elsewhere are left for
+    # compaction to remove.
+    def _scan(self):
+        log = self.log
+        offset, skipped = _scan_log(log, lambda key, value, offset, length: self._note(key, offset, length))
+        self.garbage += skipped
+        log.seek(0, 2)
+        if log.tell() > offset:
+            # partial record at end of log
+            log.truncate(offset)
+        log.seek(offset)
+        self.end = offset
+
+    # remember where the latest value for key lives.  Records can be
+    # noted out of order, the one later in the log wins.
+    def _note(self, key, offset, length):
+        old = self.index.get(key)
+        if old is not None and old[0] > offset:
+            self.garbage += _header.size + length
+            return
+        if old is not None: self.garbage += _header.size + old[1]
+        self.index[key] = (offset, length)
+
+    # only the file access is done holding the lock, decoding happens
+    # in parallel with other requests
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.index: return default
+            offset, length = self.index[key]
+            self.log.seek(offset)
+            payload = self.log.read(length)
+        return json.loads(payload.decode('utf-8'))[1]
+
+    # the record is appended holding the lock, but other puts can go
+    # ahead while this one waits for fsync.  The new value is indexed,
+    # and so visible to get, once it's on disk.
+    def put(self, key, value):
+        record = self._record(key, value)
+        with self.lock:
+            offset = self.end
+            self.log.seek(offset)
+            self.log.write(record)
+            self.log.flush()
+            self.end += len(record)
+            self.pending += 1
+        try:
+            if self.sync: os.fsync(self.log.fileno())
+            with self.lock:
+                self._note(key, offset + _header.size, len(record) - _header.size)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                # compacting moves records, so not while puts are unindexed
+                if self.pending == 0 and self.garbage >= self.min_garbage and 2*self.garbage > self.end:
+                    self._compact()
+
+    def keys(self):
+        with self.lock:
+            return list(self.index.keys())
+
+    # write live records to a new log and swap it in
+    def _compact(self):
+        tmpname = self.filename + '.tmp'
+        index = {}
+        with open(tmpname, 'wb') as f:
+            for key, (offset, length) in self.index.items():
+                self.log.seek(offset - _header.size)
+                record = self.log.read(_header.size + length)
+                index[key] = (f.tell() + _header.size, length)
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        self.log.close()
+        _replace(tmpname, self.filename)
+        self.log = open(self.filename, 'r+b')
+        self.index = index
+        self.garbage = 0
+        self.end = end
+
+    def compact(self):
+        with self.lock:
+            if self.pending == 0: self._compact()
+
+    def close(self):
+        with self.lock:
+            self.log.close()
+
@@ -0,0 +1,125 @@
+# incremental saves of module libraries for server.py and server_local.py
+#
+# Rather than sending the whole library on every save, a client can send
+# a patch that lists just the modules that changed:
+#
+#    {"version": "<version of library the patch is based on>",
+#     "modules": {"/user/alu": {...module json...}, "/user/old": null},
+#     "set": {"last_saved": 1547838471412}}
+#
+# A module value of null removes the module, "set" replaces other top-level
+# fields (eg, "tests" in a lab's state).  The version is the md5 of the
+# stored text and is handed back with each load or save; if the stored
+# library has changed since, the patch is refused and the client should
+# fall back to sending the whole library.
+#
+# Libraries are kept in memory as already-serialized fragments, one per
+# module, so applying a patch only parses and serializes the modules
+# that changed.
+
+import json
+import hashlib
+import threading
+import collections
+
+class PatchError(Exception):
+    pass
+
+class VersionMismatch(PatchError):
+    pass
+
+def version(text):
+    if not isinstance(text, bytes): text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+# a JSON object held as a serialized fragment per top-level item.  If
+# modules_key is given, that item is itself a Document of modules
+# (server.py saves {"tests": ..., "state": {modules...}}), otherwise the
+# modules are the top-level items (server_local.py saves just the library).
+class Document(object):
+    def __init__(self, text, modules_key=None):
+        text = text or '{}'
+        obj = json.loads(text)
+        if not isinstance(obj, dict):
+            raise PatchError('stored value is not a JSON object')
+        self.modules_key = modules_key
+        self.items = collections.OrderedDict()
+        for k,v in obj.items():
+            if k == modules_key:
+                self.items[k] = Document(json.dumps(v))
+            else:
+                self.items[k] = json.dumps(v)
+        if modules_key is not None and modules_key not in self.items:
+            self.items[modules_key] = Document('{}')
+        self.version = version(text)
+
+    def text(self):
+        parts = []
+        for k,v in self.items.items():
+            if isinstance(v, Document): v = v.text()
+            parts.append(json.dumps(k) + ':' + v)
+        return '{' + ','.join(parts) + '}'
+
+    def modules(self):
+        return self.items if self.modules_key is None else self.items[self.modules_key].items
+
+    # apply patch (a dict, see above), return new text
+    def apply(self, patch):
+        if patch.get('version') != self.version:
+            raise VersionMismatch('library has changed since version %s' % patch.get('version'))
+        modules = patch.get('modules', {})
+        fields = patch.get('set', {})
+        if not isinstance(modules, dict) or not isinstance(fields, dict):
+            raise PatchError('badly formed patch')
+        if self.modules_key in fields:
+            raise PatchError('use "modules" to change %s' % self.modules_key)
+
+        mdict = self.modules()
+        for name,m in modules.items():
+            if m is None: mdict.pop(name, None)
+            else: mdict[name] = json.dumps(m)
+        for k,v in fields.items():
+            if v is None: self.items.pop(k, None)
+            else: self.items[k] = json.dumps(v)
+
+        text = self.text()
+        self.version = version(text)
+        return text
+
+# LRU cache of Documents keyed by lab key or file name.  Callers should hold
+# their per-key lock while using the cached Document.
+class DocumentCache(object):
+    def __init__(self, max_docs=64, modules_key=None):
+        self.max_docs = max_docs
+        self.modules_key = modules_key
+        self.lock = threading.Lock()
+        self.docs = collections.OrderedDict()
+
+    # return cached Document for key, loading it with read() if necessary
+    def get(self, key, read):
+        with self.lock:
+            doc = self.docs.pop(key, None)
+        if doc is None:
+            doc = Document(read(), self.modules_key)
+        with self.lock:
+            self.docs[key] = doc
+            while len(self.docs) > self.max_docs:
+                self.docs.popitem(last=False)
+        return doc
+
+    # key's value was replaced wholesale
+    def discard(self, key):
+        with self.lock:
+            self.docs.pop(key, None)
+
+    # apply patch (JSON text) to key's library, return (new text, new version)
+    def patch(self, key, patch, read):
+        try:
+            patch = json.loads(patch)
+        except ValueError:
+            raise PatchError('patch is not valid JSON')
+        if not isinstance(patch, dict):
+            raise PatchError('badly formed patch')
+        doc = self.get(key, read)
+        text = doc.apply(patch)
+        return text, doc.version
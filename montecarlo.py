@@ -0,0 +1,301 @@
+# Monte Carlo timing yield of Jade designs without a browser.
+#
+# Gates in files/gates have fixed tcd, tpd, tr and tf, and fets in
+# files/analog a fixed W and L, so a simulation says whether a design
+# works with nominal parts but not how many of a batch of real ones
+# would.  Here each sample scales those properties by random factors
+# drawn from given distributions (see Variation) and simulates the
+# result:
+#
+#   gate level: the module's tests are run as grader.py runs them,
+#     giving pass/fail and the observed tpd, the longest time from an
+#     input change to a later change of a sampled output (observed_tpd)
+#   device level: a transient analysis (cktsim.py) measures tpd from the
+#     threshold crossings of an input node to those of an output node,
+#     and passes if it's at most max_tpd
+#
+# The netlist is extracted once, and a sample only copies the entries
+# of the devices whose properties it changes.  Samples run on a process
+# pool, and the random numbers of sample i come from a generator seeded
+# with (seed, i), so results don't depend on the number of processes or
+# on the order samples finish in.
+#
+#   import netlist, montecarlo
+#   modules = netlist.merge_libraries(netlist.load_library('files/gates'),
+#                                     netlist.load_library('files/ward'))
+#   mc = montecarlo.GateMonteCarlo(modules, '/beta/add16', [montecarlo.Variation('tpd', 'normal', 0.1)])
+#   print(montecarlo.report(montecarlo.summary(montecarlo.run(mc, 1000, seed=1))))
+
+import bisect
+import math
+import random
+
+import grader
+import netlist
+
+class MonteCarloError(Exception):
+    pass
+
+# random factors with mean (about) 1: normal has standard deviation
+# spread, uniform is between 1-spread and 1+spread, lognormal is
+# exp(normal with standard deviation spread)
+distributions = {
+    'normal': lambda rng, spread: rng.gauss(1, spread),
+    'uniform': lambda rng, spread: rng.uniform(1 - spread, 1 + spread),
+    'lognormal': lambda rng, spread: rng.lognormvariate(0, spread),
+}
+
+# Scale property prop of every device that has it by a random factor,
+# drawn for each device or, if per_sample, once for all the devices of a
+# sample (eg, die-to-die rather than within-die variation).  Factors are
+# redrawn until they're positive, so delays and sizes stay positive.
+class Variation(object):
+    def __init__(self, prop, distribution, spread, per_sample=False):
+        if distribution not in distributions:
+            raise MonteCarloError('Unknown distribution %s, expected one of %s' % (distribution, ', '.join(sorted(distributions))))
+        self.prop = prop
+        self.distribution = distribution
+        self.spread = spread
+        self.per_sample = per_sample
+
+    def factor(self, rng):
+        while True:
+            f = distributions[self.distribution](rng, self.spread)
+            if f > 0: return f
+
+# parse prop=distribution:spread, eg tpd=normal:0.1
+def parse_variation(text, per_sample=False):
+    prop, _, rest = text.partition('=')
+    distribution, _, spread = rest.partition(':')
+    try:
+        return Variation(prop.strip(), distribution.strip(), float(spread), per_sample)
+    except ValueError:
+        raise MonteCarloError('Expected property=distribution:spread, eg tpd=normal:0.1, got %s' % text)
+
+# copy of netlist nl (see netlist.gate_netlist and device_netlist) with
+# the properties named by variations scaled by factors drawn from rng
+def perturb(nl, variations, rng):
+    shared = [v.factor(rng) if v.per_sample else None for v in variations]
+    result = []
+    for device in nl:
+        props = device['properties']
+        changed = None
+        for v, f in zip(variations, shared):
+            x = props.get(v.prop)
+            if not x or not isinstance(x, (int, float)): continue
+            if changed is None: changed = dict(props)
+            changed[v.prop] *= f if f is not None else v.factor(rng)
+        if changed is None: result.append(device)
+        else: result.append({'type': device['type'], 'connections': device['connections'], 'properties': changed})
+    return result
+
+##################################################
+##  Gate level
+##################################################
+
+# The longest time from a change of a driven input to a later change of
+# a sampled output, before the output is sampled: for each sample, the
+# time from the most recent input change to the output's last change.
+def observed_tpd(network, spec):
+    changes = sorted(t for node in spec.driven_signals for t in network.history(node)['xvalues'][1:])
+    tpd = 0
+    for node, tvlist in spec.sampled_signals.items():
+        times = network.history(node)['xvalues']
+        for t, v, i in tvlist:
+            # times[0] is the initial X, not a change
+            k = bisect.bisect_left(times, t) - 1
+            if k <= 0: continue
+            j = bisect.bisect_left(changes, times[k]) - 1
+            if j >= 0: tpd = max(tpd, times[k] - changes[j])
+    return tpd
+
+# runs the tests of module name, which must be gate-level tests
+class GateMonteCarlo(object):
+    def __init__(self, modules, name, variations):
+        source = grader.test_source(modules.get(name) or {})
+        if source is None: raise MonteCarloError('%s has no test' % name)
+        try:
+            self.spec = grader.parse_test(source)
+        except grader.TestError as e:
+            raise MonteCarloError(str(e))
+        self.netlist, errors = grader.test_netlist(modules, name, self.spec, ('gate',))
+        if errors: raise MonteCarloError('\n'.join(errors))
+        self.variations = variations
+
+    # {'passed': ..., 'tpd': seconds, None if the simulation failed, 'errors': [...]}
+    def sample(self, rng):
+        result = {'errors': []}
+        network = grader.simulate_test(perturb(self.netlist, self.variations, rng), self.spec, result)
+        return {'passed': result.get('status') == 'passed',
+                'tpd': observed_tpd(network, self.spec) if network is not None else None,
+                'errors': result['errors'][:1]}
+
+##################################################
+##  Device level
+##################################################
+
+# times when the waveform crosses threshold, by linear interpolation
+def crossings(times, values, threshold):
+    import numpy as np
+    times = np.asarray(times)
+    values = np.asarray(values)
+    above = values >= threshold
+    k = np.nonzero(above[1:] != above[:-1])[0]
+    t0, t1, v0, v1 = times[k], times[k + 1], values[k], values[k + 1]
+    return t0 + (threshold - v0) * (t1 - t0) / (v1 - v0)
+
+# runs a transient analysis of module name (which includes its own
+# sources) out to tstop.  tpd is the longest time from a crossing of
+# threshold by node input to the next one by node output, None if the
+# output doesn't follow some input crossing.  threshold defaults to
+# halfway across the input's range.
+class DeviceMonteCarlo(object):
+    def __init__(self, modules, name, variations, tstop, input, output, threshold=None, max_tpd=None):
+        try:
+            self.netlist = netlist.device_netlist(modules, name)
+        except netlist.NetlistError as e:
+            raise MonteCarloError(str(e))
+        if not self.netlist: raise MonteCarloError('Nothing to simulate in %s' % name)
+        self.variations = variations
+        self.tstop = tstop
+        self.input = input
+        self.output = output
+        self.threshold = threshold
+        self.max_tpd = max_tpd
+
+    def sample(self, rng):
+        import cktsim
+        try:
+            result = cktsim.transient_analysis(perturb(self.netlist, self.variations, rng), self.tstop)
+        except cktsim.CktsimError as e:
+            return {'passed': False, 'tpd': None, 'errors': [str(e)]}
+        for node in (self.input, self.output):
+            if node not in result: raise MonteCarloError('No such node: ' + node)
+        times = result['_xvalues_']
+        vin = result[self.input] + times * 0   # ground is a plain 0
+        threshold = self.threshold
+        if threshold is None: threshold = (vin.min() + vin.max()) / 2.0
+        tin = crossings(times, vin, threshold)
+        tout = crossings(times, result[self.output] + times * 0, threshold)
+        tpd = 0
+        for k, t in enumerate(tin):
+            j = bisect.bisect_right(tout, t)
+            if j == len(tout) or (k + 1 < len(tin) and tout[j] > tin[k + 1]):
+                return {'passed': False, 'tpd': None, 'errors': ['%s does not follow %s at %gs' % (self.output, self.input, t)]}
+            tpd = max(tpd, tout[j] - t)
+        tpd = float(tpd)
+        return {'passed': self.max_tpd is None or tpd <= self.max_tpd, 'tpd': tpd, 'errors': []}
+
+##################################################
+##  Running samples
+##################################################
+
+_mc = None   # (Monte Carlo, seed), set in each worker
+
+def _init_worker(mc, seed):
+    global _mc
+    _mc = (mc, seed)
+
+def _sample(i):
+    mc, seed = _mc
+    result = mc.sample(random.Random('%s:%d' % (seed, i)))
+    result['sample'] = i
+    return result
+
+# run samples samples of mc (a GateMonteCarlo or DeviceMonteCarlo) on a
+# pool of jobs processes (None: one per cpu).  Yields the result dict of
+# each sample (see their sample methods, plus 'sample': i) in order.
+def run(mc, samples, seed=0, jobs=None):
+    import multiprocessing
+
+    if jobs == 1 or samples <= 1:
+        _init_worker(mc, seed)
+        for i in range(samples): yield _sample(i)
+        return
+
+    jobs = jobs or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(jobs, _init_worker, (mc, seed))
+    try:
+        for result in pool.imap(_sample, range(samples), max(1, samples // (8 * jobs))): yield result
+    finally:
+        pool.terminate()
+
+# bins equal-width bins from the smallest to the largest value, as a
+# list of (low, high, count)
+def histogram(values, bins=20):
+    if not values: return []
+    lo, hi = min(values), max(values)
+    width = (hi - lo) / float(bins) or 1.0
+    counts = [0] * bins
+    for v in values: counts[min(int((v - lo) / width), bins - 1)] += 1
+    return [(lo + k*width, lo + (k + 1)*width, n) for k, n in enumerate(counts)]
+
+# aggregate sample results: counts, pass rate and the distribution of tpd
+def summary(results, bins=20):
+    results = list(results)
+    tpds = [r['tpd'] for r in results if r['tpd'] is not None]
+    s = {'samples': len(results),
+         'passed': sum(1 for r in results if r['passed']),
+         'histogram': histogram(tpds, bins)}
+    s['pass_rate'] = s['passed'] / float(len(results)) if results else 0.0
+    if tpds:
+        mean = sum(tpds) / len(tpds)
+        s['tpd'] = {'min': min(tpds), 'max': max(tpds), 'mean': mean,
+                    'std': math.sqrt(sum((t - mean)**2 for t in tpds) / len(tpds))}
+    s['errors'] = sorted(set(e for r in results for e in r['errors']))[:10]
+    return s
+
+def report(s, width=50):
+    from utils import engineering_notation
+
+    def time(t):
+        return engineering_notation(t, 3) + 's'
+
+    lines = ['%d samples, %d passed (%.1f%%)' % (s['samples'], s['passed'], 100 * s['pass_rate'])]
+    if 'tpd' in s:
+        t = s['tpd']
+        lines.append('tpd: mean %s, std %s, min %s, max %s' % (time(t['mean']), time(t['std']), time(t['min']), time(t['max'])))
+        most = max(n for lo, hi, n in s['histogram'])
+        for lo, hi, n in s['histogram']:
+            lines.append('  %10s - %-10s %6d %s' % (time(lo), time(hi), n, '#' * int(round(width * n / float(most)))))
+    for e in s['errors']: lines.append('  ' + e)
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    from utils import parse_number_alert
+
+    parser = argparse.ArgumentParser(description='Monte Carlo timing yield of a Jade module')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/)')
+    parser.add_argument('module', help='name of module, eg /beta/add16')
+    parser.add_argument('--vary', action='append', default=[], metavar='PROP=DIST:SPREAD',
+                        help='vary property of each device, eg tpd=normal:0.1 or W=uniform:0.05 (distributions: %s)' % ', '.join(sorted(distributions)))
+    parser.add_argument('--die', action='append', default=[], metavar='PROP=DIST:SPREAD',
+                        help='vary property by one factor per sample, shared by all devices')
+    parser.add_argument('--samples', type=int, default=1000, help='number of samples (default 1000)')
+    parser.add_argument('--seed', default='0', help='random seed (default 0)')
+    parser.add_argument('--jobs', type=int, default=None, help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--tran', metavar='TSTOP', help='device level: transient analysis out to TSTOP, eg 5n')
+    parser.add_argument('--delay', nargs=2, metavar=('IN', 'OUT'), help='device level: measure tpd from node IN to node OUT')
+    parser.add_argument('--threshold', help='device level: threshold voltage (default: halfway across IN\'s range)')
+    parser.add_argument('--max-tpd', help='device level: samples with a larger tpd fail, eg 150p')
+    parser.add_argument('--bins', type=int, default=20, help='tpd histogram bins (default 20)')
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    try:
+        variations = [parse_variation(v) for v in args.vary] + [parse_variation(v, True) for v in args.die]
+        if not variations: raise MonteCarloError('Nothing to vary, use --vary or --die')
+        if args.tran:
+            if not args.delay: raise MonteCarloError('--tran needs --delay IN OUT')
+            mc = DeviceMonteCarlo(modules, args.module, variations, parse_number_alert(args.tran), args.delay[0], args.delay[1],
+                                  args.threshold and parse_number_alert(args.threshold), args.max_tpd and parse_number_alert(args.max_tpd))
+        else:
+            mc = GateMonteCarlo(modules, args.module, variations)
+        s = summary(run(mc, args.samples, args.seed, args.jobs), args.bins)
+    except (MonteCarloError, ValueError) as e:
+        sys.exit(str(e))
+    print(json.dumps(s, sort_keys=True) if args.json else report(s))
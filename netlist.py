@@ -0,0 +1,732 @@
+# Netlist extraction from Jade module JSON, without a browser.
+#
+# This follows the extraction done by netlist.js and schematic_view.js:
+# connection points that share a location in a schematic are connected,
+# labels from ports, named wires, gnd and vdd propagate across wires to
+# other connection points, unlabeled nodes get generated names, and
+# module instances are expanded hierarchically until we reach one of the
+# leaf modules.  Node and device names match the ones the browser
+# generates, so waveforms can be compared directly.  Unlike netlist.js,
+# each module is flattened once and copied into each of its instances,
+# and the result is held in arrays (see FlatNetlist) that downstream
+# tools can use directly.
+#
+# Module libraries are the dictionaries saved by server_local.py (one
+# file per library, see files/) or the "state" of a lab saved by
+# server.py.
+
+import json
+import re
+from array import array
+
+from utils import parse_number, parse_nlist, parse_signal
+
+class NetlistError(Exception):
+    pass
+
+##################################################
+##  Module libraries
+##################################################
+
+# read a library saved by server_local.py: {module name: module, ...}
+def load_library(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+# modules saved as part of a lab's state by server.py.  store is a
+# labstore.JsonFileStore or labstore.LogStore.
+def load_lab(store, key):
+    value = store.get(key)
+    if value is None: return {}
+    state = json.loads(value).get('state', {})
+    # the state also holds other editors' documents (eg, BSim programs)
+    return dict((name, m) for name, m in state.items() if isinstance(m, dict))
+
+# merge several libraries, later ones take precedence
+def merge_libraries(*libraries):
+    modules = {}
+    for lib in libraries: modules.update(lib)
+    return modules
+
+# the initial_state of a Jade page, eg, the modules for a lab and their
+# (read-only) tests, from the configuration in <div class="jade">
+def load_page(filename):
+    with open(filename, 'r') as f:
+        m = re.search(r'<div class="jade">(.*?)</div>', f.read(), re.S)
+    if m is None: raise NetlistError('No Jade configuration in ' + filename)
+    return json.loads(m.group(1)).get('initial_state', {})
+
+# load a user's state on top of a library, the way model.js does: the
+# state holds just the aspects the user changed, and read-only aspects
+# aren't replaced.
+def overlay_libraries(library, state):
+    modules = dict(library)
+    for name, m in state.items():
+        if not isinstance(m, dict): continue
+        if name[0] != '/': name = '/user/' + name
+        module = dict(modules.get(name, {}))
+        if 'properties' in m:
+            module['properties'] = dict(module.get('properties', {}), **m['properties'])
+        for aspect, v in m.items():
+            if aspect == 'properties': continue
+            if aspect in module and read_only(module, aspect): continue
+            module[aspect] = v
+        modules[name] = module
+    return modules
+
+def property_value(module, pname):
+    p = module.get('properties', {}).get(pname)
+    return p.get('value') if isinstance(p, dict) else p
+
+def read_only(module, aspect):
+    return (property_value(module, aspect + '-readonly') == 'true' or
+            property_value(module, 'confidential') == 'true' or
+            property_value(module, 'readonly') == 'true')
+
+##################################################
+##  Schematic geometry
+##################################################
+
+def transform_x(rot, x, y):
+    if rot == 0 or rot == 6: return x
+    elif rot == 1 or rot == 5: return -y
+    elif rot == 2 or rot == 4: return -x
+    else: return y
+
+def transform_y(rot, x, y):
+    if rot == 1 or rot == 7: return x
+    elif rot == 2 or rot == 6: return -y
+    elif rot == 3 or rot == 5: return -x
+    else: return y
+
+# properties of the built-in schematic components
+builtin_properties = {
+    'wire': {'signal': '', 'width': ''},
+    'ground': {'global_signal': 'gnd'},
+    'vdd': {'global_signal': 'Vdd'},
+    'jumper': {},
+    'port': {'signal': '???', 'direction': 'in'},
+    'text': {},
+    'memory': {'name': '', 'nports': '1', 'naddr': '1', 'ndata': '1', 'contents': ''},
+}
+
+class ConnectionPoint(object):
+    def __init__(self, parent, x, y, name=None):
+        self.parent = parent
+        self.name = name
+        self.nlist = parse_signal(name)
+        rot = parent.coords[2] if len(parent.coords) > 2 else 0
+        self.location = (transform_x(rot, x, y) + parent.coords[0],
+                         transform_y(rot, x, y) + parent.coords[1])
+        self.label = None
+        self.width = None
+
+class Component(object):
+    def __init__(self, json, modules):
+        self.type = json[0]
+        self.coords = json[1]
+        self.connections = []
+        self.module = None
+
+        if self.type in builtin_properties:
+            defaults = builtin_properties[self.type]
+            # ground ignores any saved properties
+            self.properties = {} if self.type == 'ground' else dict(json[2] if len(json) > 2 else {})
+            for p, v in defaults.items():
+                if p not in self.properties: self.properties[p] = v
+        else:
+            # instance of a module, by default in '/user'
+            if self.type[0] != '/': self.type = '/user/' + self.type
+            self.module = modules.get(self.type)
+            self.properties = dict(json[2] if len(json) > 2 else {})
+            for p, info in (self.module or {}).get('properties', {}).items():
+                if p not in self.properties:
+                    self.properties[p] = (info.get('value') if isinstance(info, dict) else None) or ''
+
+        self.name = self.properties.get('name') if self.named() else None
+        if self.name: self.name = self.name.lower()
+
+        if self.type == 'wire':
+            self.connections.append(ConnectionPoint(self, 0, 0))
+            self.connections.append(ConnectionPoint(self, self.coords[3], self.coords[4]))
+        elif self.type in ('ground', 'vdd', 'port'):
+            self.connections.append(ConnectionPoint(self, 0, 0))
+        elif self.type == 'jumper':
+            self.connections.append(ConnectionPoint(self, 0, 0, 'n1'))
+            self.connections.append(ConnectionPoint(self, 8, 0, 'n2'))
+        elif self.type == 'memory':
+            self.ports = []
+            naddr = int(parse_number(self.properties['naddr']))
+            ndata = int(parse_number(self.properties['ndata']))
+            y = 0
+            for port in range(int(parse_number(self.properties['nports']))):
+                p = {}
+                p['addr'] = self.add_connection(0, y, 'A_%d[%d%s]' % (port, naddr-1, ':0' if naddr > 1 else ''))
+                p['data'] = self.add_connection(72, y, 'D_%d[%d%s]' % (port, ndata-1, ':0' if ndata > 1 else ''))
+                p['oe'] = self.add_connection(0, y+8, 'OE_%d' % port)
+                p['wen'] = self.add_connection(0, y+16, 'WE_%d' % port)
+                p['clk'] = self.add_connection(0, y+24, 'CLK_%d' % port)
+                self.ports.append(p)
+                y += 40
+        elif self.module is not None:
+            # look for terminals in the icon
+            for c in self.module.get('icon', []):
+                if c[0] == 'terminal':
+                    self.add_connection(c[1][0], c[1][1], (c[2] if len(c) > 2 else {}).get('name'))
+
+    def add_connection(self, x, y, name):
+        cp = ConnectionPoint(self, x, y, name)
+        self.connections.append(cp)
+        return cp
+
+    # module instances and memories have names, other built-ins don't
+    def named(self):
+        return self.type == 'memory' or self.type not in builtin_properties
+
+    # properties passed along with a leaf's netlist entry: just the ones
+    # declared by the module that have a value
+    def clone_properties(self):
+        declared = self.module.get('properties', {}) if self.module else {}
+        return dict((p, v) for p, v in self.properties.items()
+                    if v is not None and v != '' and p in declared)
+
+# a module's schematic: its components and the connection points at
+# each location
+class Schematic(object):
+    def __init__(self, name, module, modules):
+        self.name = name
+        self.components = [Component(c, modules) for c in module.get('schematic', [])]
+        self.connection_points = {}
+        for c in self.components:
+            for cp in c.connections:
+                self.connection_points.setdefault(cp.location, []).append(cp)
+
+    ##################################################
+    ##  Labeling
+    ##################################################
+
+    # label every connection point with a list of signal names
+    def label_connection_points(self, globals, prefix, port_map):
+        for cplist in self.connection_points.values():
+            for cp in cplist:
+                cp.label = None
+                cp.width = None
+
+        # propagate any specified widths through connected wires
+        for c in reversed(self.components):
+            if c.type == 'wire' and c.properties.get('width'):
+                self.propagate_width(c.connections[0], int(parse_number(c.properties['width'])))
+
+        # let special components like GND or named wires label their connection(s)
+        for c in reversed(self.components):
+            self.add_default_labels(c, globals, prefix, port_map)
+
+        # now generate labels for unlabeled connections
+        self.next_label = 0
+        for c in reversed(self.components):
+            if c.type == 'wire': continue   # wires don't participate in this
+            for cp in reversed(c.connections):
+                if cp.label is None:
+                    n = cp.width or len(cp.nlist)
+                    label = []
+                    for i in range(n):
+                        self.next_label += 1
+                        label.append(prefix + str(self.next_label))
+                    self.propagate_label(cp, label)
+
+    # give components with a "global_signal" or "signal" property (eg,
+    # gnd, vdd, ports, wires) a chance to label their connection(s)
+    def add_default_labels(self, c, globals, prefix, port_map):
+        if c.properties.get('global_signal'):
+            # no mapping or prefixing for global signals
+            g = c.properties['global_signal']
+            nlist = parse_signal(g)
+            if g not in globals: globals.append(g)
+            width = c.connections[0].width
+            if (width or 0) > 1 and len(nlist) == 1: nlist = nlist * width
+        else:
+            nlist = parse_signal(c.properties.get('signal'))
+            for i, n in enumerate(nlist):
+                # substitute external names for local labels that are connected
+                # to ports or add prefix to local labels
+                if n in port_map: nlist[i] = port_map[n]
+                elif n not in globals: nlist[i] = prefix + n
+
+        if nlist:
+            for cp in c.connections: self.propagate_label(cp, nlist)
+
+    # labels spread to coincident connection points and across wires.
+    # Done with an explicit stack so long chains of wires don't run into
+    # the recursion limit.
+    def propagate_label(self, cp, label):
+        stack = [cp]
+        while stack:
+            cp = stack.pop()
+            if cp.width and cp.width != len(label):
+                raise NetlistError('Node label [%s] incompatible with specified width %d' % (','.join(unmarked(label)), cp.width))
+            if cp.label is None:
+                cp.label = label
+                stack.extend(self.connection_points[cp.location])
+                if cp.parent.type == 'wire': stack.extend(cp.parent.connections)
+            elif cp.label != label:
+                raise NetlistError('Node has two conflicting sets of labels: [%s], [%s]' % (', '.join(unmarked(cp.label)), ', '.join(unmarked(label))))
+
+    def propagate_width(self, cp, width):
+        stack = [cp]
+        while stack:
+            cp = stack.pop()
+            if cp.width is None:
+                cp.width = width
+                stack.extend(self.connection_points[cp.location])
+                w = cp.parent
+                if w.type == 'wire':
+                    if w.properties.get('width') and int(parse_number(w.properties['width'])) != width:
+                        raise NetlistError('Incompatible widths specified for wire: %s, %d' % (w.properties['width'], width))
+                    stack.extend(w.connections)
+            elif cp.width != width:
+                raise NetlistError('Node has two conflicting widths: %d, %d' % (cp.width, width))
+
+    # ensure unique names for each component
+    def ensure_component_names(self, prefix):
+        cnames = set()
+        for c in self.components:
+            if c.name:
+                if c.name in cnames:
+                    raise NetlistError('Duplicate component name: ' + prefix + c.name)
+                cnames.add(c.name)
+
+        counts = {}
+        for c in self.components:
+            if c.named() and not c.name:
+                base = c.type.lower().split('/')[-1]
+                while True:
+                    counts[base] = counts.get(base, 0) + 1
+                    name = '%s_%d' % (base, counts[base])
+                    if name not in cnames: break
+                c.name = name
+                cnames.add(name)
+
+##################################################
+##  Extraction
+##################################################
+
+# Extraction is memoized: each module is flattened once, in terms of its
+# own port and local node names, into a Template, which is then copied
+# into every instance of the module with the names filled in.  A 32-bit
+# adder labels the schematic of its full adder once, not 32 times.
+#
+# Names in a template are marked with their kind so they can be renamed
+# when the template is instantiated: local names (generated labels and
+# component names) get the instance's prefix, ports get the signals
+# connected to the instance's terminals, globals stay as they are.
+
+LOCAL = '\x00'
+PORT = '\x01'
+
+# label without the markers, for error messages
+def unmarked(label):
+    return [n.lstrip(LOCAL + PORT) for n in label]
+
+# terminals driven by leaf devices, everything else is an input
+def is_output(type, terminal):
+    if type == 'memory': return terminal.startswith('d_')
+    if type == '/analog/v_source': return terminal == 'nplus'
+    return terminal in ('z', 'y', 'q')
+
+# a flattened netlist held in arrays.  Nodes are interned: devices refer
+# to them by index.  Each device has a type code, naming its type and its
+# list of terminals, and the indicies of the nodes connected to each
+# terminal are in conn[conn_start[d]:conn_start[d+1]].
+class Template(object):
+    def __init__(self):
+        self.nodes = []         # node names
+        self.node_index = {}    # node name -> index
+        self.types = array('i')         # type code for each device
+        self.conn = array('i')          # node index for each device terminal
+        self.conn_start = array('i', [0])
+        self.names = []         # device names, None for ground and jumpers
+        self.props = []         # device properties, shared between instances
+        self.globals = []       # global signals declared in the hierarchy
+
+    def intern(self, name):
+        n = self.node_index.get(name)
+        if n is None:
+            n = len(self.nodes)
+            self.node_index[name] = n
+            self.nodes.append(name)
+        return n
+
+    def add_device(self, code, signals, name, props):
+        self.types.append(code)
+        self.conn.extend(self.intern(s) for s in signals)
+        self.conn_start.append(len(self.conn))
+        self.names.append(name)
+        self.props.append(props)
+
+    # copy in the devices of an instance: node_map maps the nodes of
+    # the instance's template to our nodes, prefix goes in front of
+    # device names
+    def add_instance(self, template, node_map, prefix):
+        base = len(self.conn)
+        self.types.extend(template.types)
+        self.conn.extend(node_map[n] for n in template.conn)
+        self.conn_start.extend(s + base for s in template.conn_start[1:])
+        self.names.extend(n and prefix + n[1:] for n in template.names)
+        self.props.extend(template.props)
+
+    def __len__(self):
+        return len(self.types)
+
+# the flattened netlist of a top-level module, see Template for layout.
+# For each device, the terminals that are outputs are listed in
+# outputs[output_start[d]:output_start[d+1]], the rest in inputs.
+class FlatNetlist(Template):
+    def __init__(self, template, type_list):
+        Template.__init__(self)
+        self.type_list = type_list   # type code -> (type, terminals)
+        # at the top level local names don't get a prefix, so a local node
+        # can turn out to be a global one (eg, a wire labeled gnd)
+        node_map = [self.intern(n[1:] if n[0] == LOCAL else n) for n in template.nodes]
+        self.types = template.types
+        self.conn = array('i', (node_map[n] for n in template.conn))
+        self.conn_start = template.conn_start
+        self.names = [n and n[1:] for n in template.names]
+        self.props = template.props
+        self.globals = template.globals
+
+        self.inputs = array('i')
+        self.input_start = array('i', [0])
+        self.outputs = array('i')
+        self.output_start = array('i', [0])
+        masks = [[is_output(type, t) for t in terminals] for type, terminals in type_list]
+        conn = self.conn
+        for d, code in enumerate(self.types):
+            start = self.conn_start[d]
+            for k, out in enumerate(masks[code]):
+                if out: self.outputs.append(conn[start + k])
+                else: self.inputs.append(conn[start + k])
+            self.input_start.append(len(self.inputs))
+            self.output_start.append(len(self.outputs))
+
+    def type(self, d):
+        return self.type_list[self.types[d]][0]
+
+    # {terminal: node name} for device d
+    def connections(self, d):
+        terminals = self.type_list[self.types[d]][1]
+        nodes = self.conn[self.conn_start[d]:self.conn_start[d+1]]
+        return dict((t, self.nodes[n]) for t, n in zip(terminals, nodes))
+
+    def properties(self, d):
+        props = dict(self.props[d])
+        if self.names[d] is not None: props['name'] = self.names[d]
+        if self.type(d) == 'memory':
+            # memory ports list terminals, turn them into signals
+            c = self.connections(d)
+            props['ports'] = [dict((k, [c[t] for t in terminals]) for k, terminals in port.items())
+                              for port in props['ports']]
+        return props
+
+    # netlist entries: [type, {terminal: signal, ...}, {property: value, ...}]
+    def entries(self):
+        return [[self.type(d), self.connections(d), self.properties(d)] for d in range(len(self))]
+
+# mlist is a list of module names that are the leaves of the extraction
+# tree.  Schematics are parsed once and each module is flattened once
+# for each way it's used.
+class Extractor(object):
+    def __init__(self, modules, mlist):
+        self.modules = modules
+        self.mlist = set(mlist)
+        self.schematics = {}
+        self.templates = {}   # (module, instance?, globals that matter) -> Template
+        self.signals = {}     # module -> signal names used in its hierarchy
+        self.type_codes = {}  # (type, terminals) -> type code
+        self.type_list = []
+
+    def schematic(self, name):
+        s = self.schematics.get(name)
+        if s is None:
+            module = self.modules.get(name)
+            if module is None or not module.get('schematic'): return None
+            s = self.schematics[name] = Schematic(name, module, self.modules)
+        return s
+
+    def type_code(self, type, terminals):
+        key = (type, tuple(terminals))
+        code = self.type_codes.get(key)
+        if code is None:
+            code = self.type_codes[key] = len(self.type_list)
+            self.type_list.append(key)
+        return code
+
+    # signal names used in module's hierarchy: a template only depends on
+    # which of these were declared global before it was built
+    def hierarchy_signals(self, name):
+        s = self.signals.get(name)
+        if s is None:
+            self.signals[name] = s = set()   # stops recursion, reported later
+            sch = self.schematic(name)
+            if sch is not None:
+                for c in sch.components:
+                    s.update(parse_signal(c.properties.get('signal')))
+                    if c.module is not None and c.type not in self.mlist:
+                        s.update(self.hierarchy_signals(c.type))
+        return s
+
+    # flattened netlist for module name, a FlatNetlist
+    def flatten(self, name, globals=None):
+        if globals is None: globals = []
+        return FlatNetlist(self.template(name, False, globals, []), self.type_list)
+
+    # list of netlist entries: [type, {terminal: signal, ...}, {property: value, ...}]
+    def netlist(self, name, globals=None):
+        return self.flatten(name, globals).entries()
+
+    # Template for module name.  Instances map their terminals to
+    # PORT-marked names, the top-level module doesn't have a port map.
+    def template(self, name, instance, globals, mstack):
+        if name in mstack:
+            raise NetlistError('Recursive inclusion of module:\n' + ' -> '.join(mstack + [name]))
+        sch = self.schematic(name)
+        if sch is None:
+            raise NetlistError('No schematic for ' + name)
+
+        signals = self.hierarchy_signals(name)
+        key = (name, instance, frozenset(g for g in globals if g in signals))
+        t = self.templates.get(key)
+        if t is not None:
+            for g in t.globals:
+                if g not in globals: globals.append(g)
+            return t
+
+        mstack.append(name)
+        declared = set(globals)
+        port_map = {}
+        if instance:
+            for c in self.modules[name].get('icon', []):
+                if c[0] == 'terminal':
+                    for n in parse_signal((c[2] if len(c) > 2 else {}).get('name')): port_map[n] = PORT + n
+
+        sch.label_connection_points(globals, LOCAL, port_map)
+        sch.ensure_component_names('')
+
+        t = Template()
+        for c in sch.components:
+            self.component_netlist(t, c, globals, mstack)
+        t.globals = [g for g in globals if g not in declared]
+
+        mstack.pop()
+        self.templates[key] = t
+        return t
+
+    def component_netlist(self, t, c, globals, mstack):
+        if c.type == 'ground':
+            return t.add_device(self.type_code('ground', ['gnd']), ['gnd'], None, {})
+        if c.type == 'jumper':
+            return self.jumper_netlist(t, c)
+        if c.type == 'memory':
+            return self.memory_netlist(t, c)
+        if c.type in builtin_properties:
+            return   # wires, ports, vdd, text
+
+        if c.module is None:
+            raise NetlistError('%s is an instance of %s, which isn\'t in any library' % (c.name, c.type))
+
+        # match up connections to the component's terminals, determine
+        # the number of instances implied by the connections.
+        connections = []
+        ninstances = 1
+        for cp in c.connections:
+            got = len(cp.label)
+            expected = len(cp.nlist)
+            if got % expected != 0:
+                raise NetlistError('Number of connections (%d) for terminal %s of %s not a multiple of %d' % (got, cp.name, c.name, expected))
+            ninstances = max(ninstances, got // expected)
+            connections.append((cp.nlist, cp.label))
+
+        # ensure we'll cycle through each signal list an integral number of times
+        for cp in c.connections:
+            consumed = ninstances * len(cp.nlist)
+            if consumed % len(cp.label) != 0:
+                raise NetlistError('Number of signals needed (%d) for terminal %s of %s not multiple of %d' % (consumed, cp.name, c.name, len(cp.label)))
+
+        leaf = c.type in self.mlist
+        if leaf:
+            props = c.clone_properties()
+            code = None
+        elif c.module.get('schematic'):
+            template = self.template(c.type, True, globals, mstack)
+        else:
+            raise NetlistError('No schematic for %s an instance of %s' % (c.properties.get('name', ''), c.type))
+
+        for i in range(ninstances):
+            port_map = {}
+            for nlist, slist in connections:
+                nlen = len(nlist)
+                bsize = len(slist) // nlen   # number of signals provided for each terminal
+                for k in range(nlen):
+                    port_map[nlist[k]] = slist[(i % bsize) + k*bsize]
+
+            # start generated names with index at MSB
+            name = LOCAL + c.name
+            if ninstances > 1: name += '[%d]' % (ninstances - 1 - i)
+
+            if leaf:
+                if code is None: code = self.type_code(c.type, list(port_map.keys()))
+                t.add_device(code, list(port_map.values()), name, props)
+            else:
+                prefix = name + '.'
+                node_map = []
+                for n in template.nodes:
+                    if n[0] == LOCAL: n = prefix + n[1:]
+                    elif n[0] == PORT: n = port_map[n[1:]]
+                    node_map.append(t.intern(n))
+                t.add_instance(template, node_map, prefix)
+
+    # widths have to be the same on both sides of a jumper, no replication
+    def jumper_netlist(self, t, c):
+        c1, c2 = c.connections
+        if len(c1.label) != len(c2.label):
+            raise NetlistError('Signals of different widths (%d,%d) connected by jumper.' % (len(c1.label), len(c2.label)))
+        code = self.type_code('jumper', ['n1', 'n2'])
+        for n1, n2 in zip(c1.label, c2.label):
+            t.add_device(code, [n1, n2], None, {})
+
+    def memory_netlist(self, t, c):
+        if 'memory' not in self.mlist: return
+
+        # ports list terminal names, FlatNetlist turns them into signals
+        plist = []
+        connections = {}
+        for port in c.ports:
+            p = {}
+            for terminal in ('addr', 'data', 'oe', 'wen', 'clk'):
+                cp = port[terminal]
+                if len(cp.label) != len(cp.nlist):
+                    raise NetlistError('Expected %d connections for terminal %s of memory %s, got %d' % (len(cp.nlist), cp.name, c.name, len(cp.label)))
+                for n, signal in zip(cp.nlist, cp.label): connections[n] = signal
+                p[terminal] = cp.nlist
+            plist.append(p)
+
+        # turn contents property into a list of integers
+        contents = [None if v is None else int(v // 1) for v in parse_nlist(c.properties.get('contents') or '')]
+
+        t.add_device(self.type_code('memory', list(connections.keys())), list(connections.values()), LOCAL + c.name, {
+            'ports': plist,
+            'width': int(parse_number(c.properties['ndata'])),
+            'nlocations': 1 << int(parse_number(c.properties['naddr'])),
+            'contents': contents,
+        })
+
+##################################################
+##  Gate-level netlists
+##################################################
+
+# list of gate properties expected by gatesim
+gate_properties = ['tcd', 'tpd', 'tr', 'tf', 'cin', 'size', 'ts', 'th']
+
+# leaves of a gate-level extraction
+def gate_mlist(modules):
+    mlist = ['ground', 'jumper', 'memory', '/analog/v_source', '/analog/v_probe']
+    mlist.extend(m for m in modules if m.startswith('/gates/'))
+    return mlist
+
+# flattened netlist for module name using the modules in the /gates
+# library as the leaves, a FlatNetlist
+def gate_flatten(modules, name, globals=None):
+    return Extractor(modules, gate_mlist(modules)).flatten(name, globals)
+
+# extract a flattened netlist for module name using the modules in the
+# /gates library as the leaves.  Result is a list of devices
+#   {"type": ..., "connections": {terminal: node, ...}, "properties": {...}}
+# in the form expected by gatesim.Network.
+def gate_netlist(modules, name, globals=None):
+    netlist = gate_flatten(modules, name, globals).entries()
+
+    # update device names, evaluate numeric args and eliminate entries
+    # we don't care about
+    revised = []
+    for type, c, props in netlist:
+        if type.startswith('/gates/'):
+            revised_props = {'name': props.get('name')}
+            for pname in gate_properties:
+                v = props.get(pname)
+                if v: revised_props[pname] = parse_number(v)
+            revised.append({'type': type.split('/')[2], 'connections': c, 'properties': revised_props})
+        elif type == '/analog/v_source':
+            revised.append({'type': 'voltage source', 'connections': c,
+                            'properties': {'name': props.get('name'), 'value': source_dict(props.get('value'))}})
+        elif type == 'ground':
+            revised.append({'type': 'ground', 'connections': {'gnd': c['gnd']}, 'properties': {}})
+        elif type == 'jumper':
+            revised.append({'type': 'connect', 'connections': c, 'properties': {}})
+        elif type == '/analog/v_probe':
+            revised.append({'type': 'voltage probe', 'connections': c,
+                            'properties': {'name': props.get('name'), 'color': props.get('color'),
+                                           'offset': parse_number(props.get('offset') or '0')}})
+        elif type == 'memory':
+            revised.append({'type': 'memory', 'connections': c, 'properties': props})
+    return revised
+
+##################################################
+##  Device-level netlists
+##################################################
+
+# /analog module -> (cktsim device type, module property, cktsim property)
+# for the devices with a single numeric value
+device_values = {
+    '/analog/resistor': ('resistor', 'r', 'value'),
+    '/analog/capacitor': ('capacitor', 'c', 'value'),
+    '/analog/inductor': ('inductor', 'l', 'value'),
+    '/analog/opamp': ('opamp', 'A', 'A'),
+    '/analog/diode': ('diode', 'area', 'area'),
+}
+
+# leaves of a device-level extraction
+def device_mlist(modules):
+    mlist = ['ground', 'jumper']
+    mlist.extend(m for m in modules if m.startswith('/analog/'))
+    return mlist
+
+# extract a flattened netlist for module name using the modules in the
+# /analog library as the leaves, in the form expected by cktsim.Circuit
+# (see device_netlist in device_level.js)
+def device_netlist(modules, name, globals=None):
+    netlist = Extractor(modules, device_mlist(modules)).netlist(name, globals)
+
+    revised = []
+    for type, c, props in netlist:
+        pname = props.get('name')
+        if type in ('/analog/nfet', '/analog/pfet'):
+            revised.append({'type': type.split('/')[2], 'connections': c,
+                            'properties': {'name': pname, 'W': parse_number(props.get('W')), 'L': parse_number(props.get('L'))}})
+        elif type in device_values:
+            dtype, p, cp = device_values[type]
+            revised.append({'type': dtype, 'connections': c,
+                            'properties': {'name': pname, cp: parse_number(props.get(p))}})
+        elif type == '/analog/v_source' or type == '/analog/i_source':
+            revised.append({'type': 'voltage source' if type == '/analog/v_source' else 'current source', 'connections': c,
+                            'properties': {'name': pname, 'value': source_dict(props.get('value'))}})
+        elif type == 'ground':
+            revised.append({'type': 'ground', 'connections': {'gnd': c['gnd']}, 'properties': {}})
+        elif type == 'jumper':
+            revised.append({'type': 'connect', 'connections': c, 'properties': {}})
+        elif type == '/analog/v_probe':
+            revised.append({'type': 'voltage probe', 'connections': c,
+                            'properties': {'name': pname, 'color': props.get('color'),
+                                           'offset': parse_number(props.get('offset') or '0')}})
+        elif type == '/analog/i_probe':
+            # a current probe is a 0V voltage source
+            revised.append({'type': 'voltage source', 'connections': c,
+                            'properties': {'name': pname, 'value': {'type': 'dc', 'args': [0]}}})
+        elif type == '/analog/initial_voltage':
+            revised.append({'type': 'initial voltage', 'connections': c,
+                            'properties': {'name': pname, 'IV': parse_number(props.get('IV'))}})
+    return revised
+
+# parse foo(1,2,3) into {type: foo, args: [1,2,3]}, a plain number is a dc source
+def source_dict(value):
+    m = re.search(r'(\w+)\s*\((.*?)\)\s*', value or '')
+    if m is None: return {'type': 'dc', 'args': [parse_number(value or '0')]}
+    return {'type': m.group(1), 'args': [parse_number(a) for a in m.group(2).split(',')]}
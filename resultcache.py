@@ -0,0 +1,142 @@
+# A disk cache of test results, addressed by what was tested.
+#
+# The same unchanged test is run on the same unchanged module over and
+# over, by students rerunning it and by graders rerunning every
+# submission.  A result is stored under a hash of the flattened netlist
+# of the module (so a change to any module it uses, including the parts
+# libraries, is a change), the test's source and the simulation options,
+# so looking it up needs no names or timestamps, and identical
+# submissions share an entry.  A result is whatever the caller stores,
+# eg grader.run_test's pass/fail, log, traced waveforms and timing.
+#
+# Entries are files of compressed JSON in a directory.  Reading an entry
+# marks it as recently used; when the directory grows past its size
+# limit, the least recently used entries are removed.  Several processes
+# can share a directory.
+#
+#   import resultcache
+#   cache = resultcache.ResultCache(resultcache.default_cache_dir)
+#   key = resultcache.result_key(nl, spec.md5sum, spec.options)
+#   result = cache.get(key)
+#   if result is None:
+#       result = ...
+#       cache.put(key, result)
+
+import hashlib
+import json
+import os
+import time
+import zlib
+
+VERSION = 1   # of the simulators, part of every key: change it when results would change
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'jade', 'results')
+
+# os.replace is atomic on posix and windows, but is python3 only
+_replace = getattr(os, 'replace', os.rename)
+
+# write data to path by way of a temporary file, so readers never see
+# part of it, making path's directory if need be.  Raises IOError or
+# OSError if it can't, having removed the temporary file.
+def write_file(path, data):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory): os.makedirs(directory)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f: f.write(data)
+        _replace(tmp, path)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+# key for the result of running test (eg the md5sum of its source) on
+# netlist with options
+def result_key(netlist, test, options=None):
+    text = json.dumps([VERSION, test, options or {}, netlist], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class ResultCache(object):
+    def __init__(self, directory=default_cache_dir, max_bytes=100*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None   # estimate of the bytes in the directory, None until we look
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    # the value stored under key, None if there isn't one
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f: value = json.loads(zlib.decompress(f.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error):
+            return None   # missing, or evicted or half-written by someone else
+        try:
+            os.utime(path, None)   # recently used
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        data = zlib.compress(json.dumps(value, sort_keys=True).encode('utf-8'))
+        try:
+            write_file(self.path(key), data)
+        except (IOError, OSError):
+            return   # eg a full disk, the result just isn't kept
+
+        if self.size is None: self.size = sum(size for mtime, size, path in self.entries())
+        else: self.size += len(data)
+        if self.size > self.max_bytes: self.evict()
+
+    # (mtime, size, path) for every entry
+    def entries(self):
+        result = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'): continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    # remove least recently used entries until we're comfortably under
+    # the limit, so there's room for a while before doing this again
+    def evict(self, fraction=0.9):
+        entries = sorted(self.entries())
+        self.size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self.size <= fraction * self.max_bytes: break
+            try:
+                os.remove(path)
+                self.size -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.size = 0
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect or empty a cache of test results')
+    parser.add_argument('directory', nargs='?', default=default_cache_dir, help='cache directory (default %s)' % default_cache_dir)
+    parser.add_argument('--clear', action='store_true', help='remove every entry')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.directory)
+    if args.clear: cache.clear()
+    entries = cache.entries()
+    oldest = min(mtime for mtime, size, path in entries) if entries else time.time()
+    print('%d entries, %.1f MB, least recently used %.1f days ago' %
+          (len(entries), sum(size for mtime, size, path in entries) / 1048576.0, (time.time() - oldest) / 86400))
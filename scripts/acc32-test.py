@@ -12,13 +12,6 @@ def head():
     print "//", "D", "D",
     print hd(" D[31:0] ", 32), hd(" S[31:0] ", 32)
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 S=0
 
 def trycase(ld, ad, d):
@@ -11,13 +11,6 @@ w=2
 def head():
     print "//", hd(" AA", w), hd("BB", w), "C", hd("SS", w)
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(a, b, cin):
     s = a+b+cin
     cout = (a+b+cin) >> w
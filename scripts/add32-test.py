@@ -12,13 +12,6 @@ w=32
 def head():
     print "//", hd(" A[31:0] ", w), hd(" B[31:0] ", w), "C", hd(" S[31:0] ", w), "C"
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(a, b, cin):
     s = a+b+cin
     cout = (a+b+cin) >> w
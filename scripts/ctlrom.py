@@ -2,17 +2,9 @@
 
 from testvecutils import *
 
-BETAOP = [
-    "???", "???", "???", "???", "???", "???", "???", "???",
-    "???", "???", "???", "???", "???", "???", "???", "???",
-    "???", "???", "???", "???", "???", "???", "???", "???",
-    "LD",  "ST",  "???", "JMP", "BEQ", "BNE", "???", "LDR",
-    "ADD", "SUB", "MUL", "DIV", "CMPEQ", "CMPLT", "CMPLE", "???", 
-    "AND", "OR",  "XOR", "XNOR","SHL", "SHR", "SRA", "???",
-    "ADDC", "SUBC", "MULC", "DIVC", "CMPEQC", "CMPLTC", "CMPLEC", "???",
-    "ANDC", "ORC", "XORC", "XNORC", "SHLC", "SHRC", "SRAC", "???"
-    ]
-
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from betasim import BETAOP
 
 ################################################################################
 ### Part I: Generate binary CTLROM contents
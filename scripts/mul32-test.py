@@ -10,13 +10,6 @@ title = """
 def head():
     print "//", hd(" A[31:0] ", 32), hd(" B[31:0] ", 32), hd(" P[31:0] ", 32)
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(a, b):
     p = ((a & 0xFFFFFFFF) * (b & 0xFFFFFFFF)) & 0xFFFFFFFF
     print "  ", bin(a, 32), bin(b, 32), lh(p, 32)
@@ -10,13 +10,6 @@ title = """
 def head():
     print "//", hd("AAAA", 4), hd("BBBB", 4), hd(" P[7:0] ", 8)
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(a, b):
     p = ((a & 0xF) * (b & 0xF)) & 0xFFFF
     print "  ", bin(a, 4), bin(b, 4), lh(p, 8)
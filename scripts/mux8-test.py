@@ -11,13 +11,6 @@ def head():
     print "// DDDDDDDD SSS"
     print "// 01234567 210 Y"
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(D, S):
     y = (D >> (7-S)) & 1
     print "  ", bin(D, 8), bin(S, 3), lh(y, 1)
@@ -11,13 +11,6 @@ w=32
 def head():
     print "//", hd(" PC[31:2] ", 30), hd(" Off[15:0] ", 16), hd(" BT[31:2] ", 30)
 
-def bin(x, width):
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
-
 def trycase(pc, off):
     s = (pc+off) & 0x3FFFFFFF
     print "  ", bin(pc, 30), bin(off, 16), bin(s, 30)
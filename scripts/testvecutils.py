@@ -1,25 +1,47 @@
 # Some simple utility routines for scripted test vector generation
 
+# Lookup tables rendering each byte as 8 characters, one per choices pair
+_byte_tables = {}
+
+def _byte_table(choices):
+    table = _byte_tables.get(choices)
+    if table is None:
+        table = [''.join([choices[(b >> (7-i)) & 1] for i in range(8)]) for b in range(256)]
+        _byte_tables[choices] = table
+    return table
+
+# Translation tables mapping '0'/'1' strings (eg, from a simulation log)
+# to choices, with ?, Z and X becoming don't cares
+_char_tables = {}
+
+def _char_table(choices):
+    table = _char_tables.get(choices)
+    if table is None:
+        table = ''.join([choices[0] if chr(i) == '0' else '-' if chr(i) in '?ZX' else choices[1]
+                         for i in range(256)])
+        _char_tables[choices] = table
+    return table
+
+# Render x as width characters, msb first, using choices[0] for 0 bits
+# and choices[1] for 1 bits.  x can be an integer (negative values are
+# two's complement), a string of 0/1/?/Z/X characters, or None or '-'
+# for don't cares.
+def bits(x, width, choices='01'):
+    if x is None or x == '-': return '-'*width
+    if isinstance(x, str): return x[:width].translate(_char_table(choices))
+    table = _byte_table(choices)
+    s = ''.join([table[(x >> shift) & 0xFF] for shift in range(((width-1) & ~7), -1, -8)])
+    return s[-width:]
+
 # Generate a binary number as a string.
 #   x='-': generates don't cares.
 def bin(x, width):
-    if x == '-': return '-'*width
-    s = ""
-    for i in range(width):
-        s = str(x & 1) + s
-        x >>= 1
-    return s
+    return bits(x, width, '01')
 
 # Generate a binary number as a string, using hokey L & H for 1 and 0.
 #   x='-': generates don't cares.
 def lh(x, width):
-    if x == '-': return '-'*width
-    s = ""
-    for i in range(width):
-        lhch = "LH"[x&1]
-        s = lhch + s
-        x >>= 1
-    return s
+    return bits(x, width, 'LH')
 
 # Generate a header text field of specified width, containing title chars padded with dots:
 def hd(title, width):
@@ -31,3 +53,47 @@ def hd(title, width):
 
 # Add a comment to the test data transcript:
 def cmt(msg): print "\n//", msg
+
+# A precompiled test vector row: a list of (width, choices[, suffix])
+# fields, suffix defaulting to ' '.  row.render(v1, v2, ...) returns the
+# fields for one vector as a single string.
+class Row(object):
+    def __init__(self, *fields):
+        self.fields = []
+        for field in fields:
+            width, choices = field[:2]
+            suffix = field[2] if len(field) > 2 else ' '
+            self.fields.append((width, choices, suffix))
+
+    def render(self, *values):
+        assert len(values) == len(self.fields), 'expected %d values' % len(self.fields)
+        return ''.join([bits(v, width, choices) + suffix
+                        for (width, choices, suffix), v in zip(self.fields, values)])
+
+# Collect lines of test vectors and write them to f in large chunks
+# rather than a character at a time.  Call flush() (or use a with
+# statement) when done.
+class VectorWriter(object):
+    def __init__(self, f, chunk=4096):
+        self.f = f
+        self.chunk = chunk
+        self.pending = []
+
+    def write(self, s):
+        self.pending.append(s)
+        if len(self.pending) >= self.chunk: self.flush()
+
+    def writelines(self, lines):
+        for line in lines: self.write(line)
+
+    def flush(self):
+        if self.pending:
+            self.f.write(''.join(self.pending))
+            self.pending = []
+        if hasattr(self.f, 'flush'): self.f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
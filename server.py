@@ -1,100 +1,313 @@
 # combo HTTP server (GETs) and key/value store (POSTs)
-# uses a json file to save user state
+# user state is kept by one of the stores in labstore.py
 
 try:
     from BaseHTTPServer import BaseHTTPRequestHandler
     import SocketServer as socketserver
+    from urlparse import parse_qs
+    import Queue as queue
 except:
     # python 3 compatibility
     from http.server import BaseHTTPRequestHandler
     import socketserver
+    from urllib.parse import parse_qs
+    import queue
 
 import mimetypes
 import posixpath
-import shutil
 import os
+import time
+import gzip
+import io
+import hashlib
+import collections
+import email.utils
 import cgi
 import json
 import atexit
 import urllib
+import threading
+import select
+import socket
+import argparse
+import labstore
+import libpatch
+
+# brotli is optional, we'll just offer gzip'd assets if it's not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 jsonfile = 'labs.json'
+logfile = 'labs.log'
 PORT = 8000
+WORKERS = 16   # number of requests served concurrently
+IDLE_TIMEOUT = 60   # seconds an idle keep-alive connection is kept open
+
+CACHE_BYTES = 64 << 20   # max size of the static asset cache
+
+# 'log' keeps user state in an append-only log indexed by key (see labstore.py),
+# 'json' reads and rewrites all of labs.json on every request
+storage = 'log'
+
+# contents of a static file, along with compressed variants, computed
+# once each time the file changes
+class Asset(object):
+    def __init__(self, path, st):
+        with open(path, 'rb') as f:
+            body = f.read()
+        self.mtime = st.st_mtime
+        self.size = st.st_size
+        self.checked = time.time()
+        self.etag = 'W/"%s"' % hashlib.md5(body).hexdigest()   # same for all encodings
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+
+        # encoding => bytes, only keep variants that are worth it
+        self.variants = {'identity': body}
+        self.variants['gzip'] = self.compress(body, self.gzip(body))
+        if brotli is not None:
+            self.variants['br'] = self.compress(body, brotli.compress(body))
+        self.nbytes = sum(len(v) for v in self.variants.values() if v is not None)
+
+    def gzip(self, body):
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+            f.write(body)
+        return buffer.getvalue()
+
+    def compress(self, body, compressed):
+        # eg, images and woff fonts are already compressed
+        return compressed if len(compressed) < 0.9*len(body) else None
+
+# LRU cache of Assets, keyed by path.  A file's mtime is checked at most
+# once a second, so a page load doesn't have to touch the disk.
+class AssetCache(object):
+    def __init__(self, max_bytes=CACHE_BYTES, check_interval=1.0):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.assets = collections.OrderedDict()
+        self.nbytes = 0
+
+    # return Asset for path, None if there's no such file
+    def get(self, path):
+        now = time.time()
+        with self.lock:
+            asset = self.assets.pop(path, None)
+            if asset is not None:
+                self.nbytes -= asset.nbytes
+        if asset is not None and now - asset.checked < self.check_interval:
+            return self.add(path, asset)
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        if asset is not None and asset.mtime == st.st_mtime and asset.size == st.st_size:
+            asset.checked = now
+        else:
+            asset = Asset(path, st)
+        return self.add(path, asset)
+
+    def add(self, path, asset):
+        with self.lock:
+            self.assets[path] = asset
+            self.nbytes += asset.nbytes
+            # evict least recently used assets, but always keep this one
+            while self.nbytes > self.max_bytes and len(self.assets) > 1:
+                old_path, old = self.assets.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return asset
+
+# choose best encoding from an Accept-Encoding header
+def choose_encoding(asset, accept):
+    q = {}
+    for item in (accept or '').split(','):
+        params = item.strip().split(';')
+        coding = params[0].strip().lower()
+        weight = 1.0
+        for p in params[1:]:
+            p = p.strip()
+            if p.startswith('q='):
+                try: weight = float(p[2:])
+                except ValueError: weight = 0.0
+        if coding: q[coding] = weight
+    for coding in ('br', 'gzip'):
+        if asset.variants.get(coding) is not None and q.get(coding, q.get('*', 0)) > 0:
+            return coding
+    return 'identity'
+
+assets = AssetCache()
+
+# parsed lab states, for applying patches.  The modules are in "state".
+documents = libpatch.DocumentCache(modules_key='state')
 
 class JadeRequestHandler(BaseHTTPRequestHandler):
+    # keep connections open so the browser can reuse them for the many
+    # .js and font files a page loads.  Every response has a Content-Length.
+    protocol_version = 'HTTP/1.1'
+    timeout = 15    # to finish reading a request once it's started
+
+    # PooledTCPServer hands a connection to a worker once per request
+    # (see below), so rather than handling every request on the
+    # connection here, it calls next_request for each one and finish
+    # when the connection is closed
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    # handle one request, return True if the connection stays open
+    def next_request(self):
+        self.close_connection = True
+        self.handle_one_request()
+        return not self.close_connection
+
+    # True if (part of) the next request has already been read, so
+    # waiting for the socket to be readable would wait forever
+    def pending(self):
+        rfile = self.rfile
+        if not hasattr(rfile, 'peek'):
+            return rfile._rbuf.tell() > 0   # python 2's socket._fileobject
+        self.connection.settimeout(0)
+        try:
+            return len(rfile.peek(1)) > 0
+        except (socket.error, ValueError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
     def log_message(self,format,*args):
         #print format % args
         return
 
     # serve up static files
     def do_GET(self):
+        self.send_asset(True)
+
+    def do_HEAD(self):
+        self.send_asset(False)
+
+    def send_asset(self, send_body):
         path = self.path
         path = path.split('?',1)[0]
         path = path.split('#',1)[0]
         path = path.replace('/','')
         if path == '': path = 'index.html'
-        ctype = self.guess_type(path)
-        try:
-            f = open(path, 'rb')
-        except IOError:
+        asset = assets.get(path)
+        if asset is None:
             self.send_error(404, "File not found")
             return None
-        try:
-            self.send_response(200)
-            self.send_header("Content-type", ctype)
-            fs = os.fstat(f.fileno())
-            self.send_header("Content-Length", str(fs[6]))
-            self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
+
+        if self.not_modified(asset):
+            self.send_response(304)
+            self.send_header("ETag", asset.etag)
+            self.send_header("Content-Length", "0")
             self.end_headers()
+            return None
 
-            shutil.copyfileobj(f,self.wfile)
-            f.close()
-        except:
-            f.close()
-            raise
+        encoding = choose_encoding(asset, self.headers.get('Accept-Encoding'))
+        body = asset.variants[encoding]
+        self.send_response(200)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(body)))
+        if encoding != 'identity':
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Last-Modified", asset.last_modified)
+        self.send_header("ETag", asset.etag)
+        self.send_header("Cache-Control", "no-cache")   # revalidate with us each time
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    # see if browser's cached copy is still good
+    def not_modified(self, asset):
+        etags = self.headers.get('If-None-Match')
+        if etags is not None:
+            return etags.strip() == '*' or asset.etag in [e.strip() for e in etags.split(',')]
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            t = email.utils.parsedate_tz(since)
+            if t is not None:
+                return int(asset.mtime) <= email.utils.mktime_tz(t)
+        return False
 
     def do_POST(self):
+        # read the whole body whatever its type, so the next request on
+        # the connection starts where it should
+        length = self.headers.get('content-length')
+        if length is None:
+            self.close_connection = True
+            content = b''
+        else:
+            content = self.rfile.read(int(length))
+
         # determine key, value
-        ctype, pdict = cgi.parse_header(self.headers['content-type'])
+        ctype, pdict = cgi.parse_header(self.headers.get('content-type', ''))
         postvars = {}
         if ctype == 'multipart/form-data':
-            for k,v in cgi.parse_multipart(self.rfile, pdict).items():
+            for k,v in cgi.parse_multipart(io.BytesIO(content), pdict).items():
                 # python3 returns everything as bytes, so decode into strings
                 if type(k) == bytes: k = k.decode()
                 postvars[k] = [s.decode() if type(s) == bytes else s for s in v]
         elif ctype == 'application/x-www-form-urlencoded':
-            length = int(self.headers['content-length'])
-            content = self.rfile.read(length)
-            for k,v in cgi.parse_qs(content, keep_blank_values=1).items():
+            for k,v in parse_qs(content, keep_blank_values=1).items():
                 # python3 returns everything as bytes, so decode into strings
                 if type(k) == bytes: k = k.decode()
                 postvars[k] = [s.decode() if type(s) == bytes else s for s in v]
 
         key = postvars.get('key',[None])[0]
         value = postvars.get('value',[None])[0]
-        self.log_message('%s',json.dumps([key,value]))
+        patch = postvars.get('patch',[None])[0]
+        self.log_message('%s',json.dumps([key,value,patch]))
         
-        # read json file with user's state
-        with open(jsonfile,'r') as f:
-            labs = json.load(f)
-
-        response = ''
-        if value is None:
-            # send state for particular lab to user
-            response = labs.get(key,'{}')
-            response = response.encode('utf-8')
-        else:
-            # update state for particular lab
-            response = value
-            labs[key] = value
-            with open(jsonfile,'w') as f:
-                json.dump(labs,f)
-                                                        
-        self.send_response(200)
+        status = 200
+        read = lambda: labs.get(key,'{}')
+        with labs.key_lock(key):
+            if patch is not None:
+                # apply changes to particular lab (see libpatch.py), reply
+                # with new version
+                try:
+                    value,version = documents.patch(key,patch,read)
+                    response = version
+                except libpatch.VersionMismatch:
+                    # client will have to send the whole state
+                    status = 409
+                    response = version = documents.get(key,read).version
+                except libpatch.PatchError as e:
+                    status = 400
+                    response = str(e)
+                    version = None
+                if status == 200:
+                    try:
+                        labs.put(key,value)
+                    except:
+                        documents.discard(key)
+                        raise
+            elif value is None:
+                # send state for particular lab to user
+                response = read()
+                version = libpatch.version(response)
+            else:
+                # update state for particular lab
+                response = value
+                labs.put(key,value)
+                documents.discard(key)
+                version = libpatch.version(value)
+
+        response = response.encode('utf-8')
+        self.send_response(status)
         self.send_header("Content-type", 'text/plain')
         self.send_header("Content-Length", str(len(response)))
+        if version is not None:
+            self.send_header("ETag", '"%s"' % version)
         self.end_headers()
-        self.wfile.write(response.encode())
+        self.wfile.write(response)
 
     def guess_type(self, path):
         base, ext = posixpath.splitext(path)
@@ -113,14 +326,101 @@ class JadeRequestHandler(BaseHTTPRequestHandler):
         '': 'application/octet-stream', # Default
     })
         
-httpd = socketserver.TCPServer(("",PORT),JadeRequestHandler)
+# hand requests to a fixed pool of worker threads so one slow upload
+# doesn't hold up everyone else's requests.  Between requests, idle
+# keep-alive connections wait in select() rather than in a worker, so
+# browsers holding several connections open don't use up the pool.
+class PooledTCPServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, server_address, RequestHandlerClass, workers=WORKERS, idle_timeout=IDLE_TIMEOUT):
+        socketserver.TCPServer.__init__(self, server_address, RequestHandlerClass)
+        self.idle_timeout = idle_timeout
+        self.requests = queue.Queue()   # handlers with a request to serve
+        self.idle = {}                  # socket => (handler, time it went idle)
+        self.parking = []               # handlers to add to idle
+        self.parking_lock = threading.Lock()
+        self.wakeup, self.waker = socket.socketpair()   # interrupts select() for new idle handlers
+        for target in [self.watcher] + [self.worker]*workers:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+
+    def process_request(self, request, client_address):
+        self.requests.put(self.RequestHandlerClass(request, client_address, self))
+
+    def worker(self):
+        while True:
+            handler = self.requests.get()
+            try:
+                keep = handler.next_request()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+                keep = False
+            if not keep:
+                self.close(handler)
+            elif handler.pending():
+                self.requests.put(handler)
+            else:
+                with self.parking_lock:
+                    self.parking.append(handler)
+                self.waker.send(b'x')
+
+    def close(self, handler):
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+
+    # queue idle connections when their next request arrives, close the
+    # ones that have been idle too long
+    def watcher(self):
+        while True:
+            with self.parking_lock:
+                for handler in self.parking:
+                    self.idle[handler.request] = (handler, time.time())
+                del self.parking[:]
+            timeout = None
+            if self.idle:
+                oldest = min(t for handler, t in self.idle.values())
+                timeout = max(0, oldest + self.idle_timeout - time.time())
+            readable = select.select([self.wakeup] + list(self.idle), [], [], timeout)[0]
+            for s in readable:
+                if s is self.wakeup:
+                    s.recv(4096)
+                else:
+                    self.requests.put(self.idle.pop(s)[0])
+            now = time.time()
+            for s, (handler, t) in list(self.idle.items()):
+                if now - t >= self.idle_timeout:
+                    del self.idle[s]
+                    self.close(handler)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Jade HTTP server and key/value store')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='number of requests served concurrently')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='seconds to keep an idle connection open')
+    parser.add_argument('--storage', choices=['log','json'], default=storage)
+    args = parser.parse_args()
+
+    if args.storage == 'log':
+        labs = labstore.LogStore(logfile, legacy=jsonfile)
+    else:
+        labs = labstore.JsonFileStore(jsonfile)
+
+    httpd = PooledTCPServer(("",args.port),JadeRequestHandler,args.workers,args.idle_timeout)
 
-def cleanup():
-  # free the socket
-  print("CLEANING UP!")
-  httpd.shutdown()
-  print("CLEANED UP")
+    def cleanup():
+      # free the socket
+      print("CLEANING UP!")
+      httpd.shutdown()
+      labs.close()
+      print("CLEANED UP")
 
-atexit.register(cleanup)
-print("Jade Server: port",PORT)
-httpd.serve_forever()
+    atexit.register(cleanup)
+    print("Jade Server: port",args.port,"workers",args.workers)
+    httpd.serve_forever()
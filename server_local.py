@@ -1,61 +1,260 @@
 #!/usr/bin/env python
 
-# this cgibin script expects to be run by a HTTPS server that accepts MIT certificates
-# and places the cert info in environment variables
+# load/save user files for jade_local.  Requests have a "file" field naming
+# the file in user_dir and, when saving, a "json" field with the new contents
+# or a "patch" field with just the modules that changed (see libpatch.py).
+#
+# This can be run three ways:
+#   - as a cgi-bin script (see jade.conf); each request starts a new process
+#   - as a WSGI application (see application below), eg, under mod_wsgi
+#   - as a long-lived HTTP server: python server_local.py --port 8001
+# The last two keep a warm process with a cache of recently used files, so
+# loads and saves don't pay for interpreter startup.
 
-import sys,os,cgi
+from __future__ import print_function
+import sys,os,threading,collections,tempfile
+import libpatch
+from labstore import KeyLocks
 
-# debuggin
-import cgitb; cgitb.enable()
+try:
+    from urlparse import parse_qs
+except ImportError:
+    # python 3 compatibility
+    from urllib.parse import parse_qs
 
 user_dir = 'files'
+CACHE_BYTES = 64 << 20   # max size of the cache of user files
 
-# respond with specified status
-def http_status(status):
-    print 'Status:',status
-    print
-    sys.exit(0)
+class HTTPError(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+# LRU cache of file contents, keyed by file name.  We're the only one
+# writing user files, so cached contents are updated as part of a save.
+class FileCache(object):
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = collections.OrderedDict()
+        self.nbytes = 0
+
+    def get(self, filename):
+        with self.lock:
+            contents = self.files.pop(filename, None)
+            if contents is not None:
+                self.files[filename] = contents   # now most recently used
+            return contents
+
+    def put(self, filename, contents):
+        with self.lock:
+            old = self.files.pop(filename, None)
+            if old is not None: self.nbytes -= len(old)
+            self.files[filename] = contents
+            self.nbytes += len(contents)
+            while self.nbytes > self.max_bytes and len(self.files) > 1:
+                old_filename, old = self.files.popitem(last=False)
+                self.nbytes -= len(old)
+
+cache = FileCache()
+documents = libpatch.DocumentCache()   # parsed libraries, for applying patches
+file_lock = KeyLocks()
 
 # locate user's directory, create if necessary
-if not os.path.exists(user_dir):
-    try:
-        os.mkdir(user_dir)   # default mode 0777
-    except:
-        http_status('500 Cannot create user directory: %s' % sys.exc_info()[0])
+def ensure_user_dir():
+    if not os.path.exists(user_dir):
+        try:
+            os.mkdir(user_dir)   # default mode 0777
+        except:
+            raise HTTPError('500 Cannot create user directory: %s' % sys.exc_info()[0])
 
-args = cgi.FieldStorage()
-json = args.getfirst('json')
-file = args.getfirst('file')
+# map file name from request to a path in the user's directory
+def user_filename(file):
+    if file is None:
+        raise HTTPError('400 No file name specified')
+    filename = os.path.normpath(os.path.join(user_dir,file))
+    if not filename.startswith(os.path.normpath(user_dir) + os.sep):
+        raise HTTPError('400 Bad file name')
+    return filename
 
-if file is None:
-    http_status('400 No file name specified')
-filename = os.path.join(user_dir,file)
+# return contents of file as json
+def load(file):
+    filename = user_filename(file)
+    json = cache.get(filename)
+    if json is None:
+        if not os.path.exists(filename):
+            json = '{}'   # empty library
+        else:
+            try:
+                with open(filename,'r') as f:
+                    json = f.read()
+            except:
+                raise HTTPError('500 Read failed: %s' % sys.exc_info()[0])
+        cache.put(filename,json)
+    return json
 
-# if user supplied json, save as new file contents
-if json is not None:
+# save json as new file contents.  Write a temp file and rename it over the
+# old one so a failed write never leaves a partial file behind.
+def save(file, json):
+    filename = user_filename(file)
+    ensure_user_dir()
     try:
-        f = open(filename,'w')
-        f.write(json)
-        f.close()
+        fd,tmpname = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.save')
+        try:
+            with os.fdopen(fd,'w') as f:
+                f.write(json)
+                f.flush()
+                os.fsync(f.fileno())
+            mode = os.stat(filename).st_mode if os.path.exists(filename) else 0o644
+            os.chmod(tmpname, mode & 0o777)
+            os.rename(tmpname, filename)   # atomic on posix
+        except:
+            if os.path.exists(tmpname): os.remove(tmpname)
+            raise
     except:
         err = sys.exc_info()
-        http_status('500 Write failed: %s' % err[1])
-    http_status('200 OK')
+        raise HTTPError('500 Write failed: %s' % err[1])
+    cache.put(filename,json)
+
+# apply patch to file, return new version
+def save_patch(file, patch):
+    filename = user_filename(file)
+    with file_lock(filename):
+        try:
+            json,version = documents.patch(filename,patch,lambda: load(file))
+        except libpatch.VersionMismatch:
+            raise HTTPError('409 Library has changed, send all of it')
+        except libpatch.PatchError as e:
+            raise HTTPError('400 %s' % e)
+        try:
+            save(file,json)
+        except:
+            documents.discard(filename)
+            raise
+    return version
+
+# save whole library
+def save_json(file, json):
+    filename = user_filename(file)
+    with file_lock(filename):
+        save(file,json)
+        documents.discard(filename)
+
+##################################################
+##  WSGI
+##################################################
 
-# request for a file, return as json
-if not os.path.exists(filename):
-    json = '{}'   # empty library
-else:
+def request_fields(environ):
+    fields = parse_qs(environ.get('QUERY_STRING',''), keep_blank_values=1)
+    if environ.get('REQUEST_METHOD') == 'POST':
+        ctype = environ.get('CONTENT_TYPE','').split(';')[0].strip()
+        if ctype == 'multipart/form-data':
+            import cgi
+            form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
+            for k in form.keys(): fields[k] = form.getlist(k)
+        else:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            content = environ['wsgi.input'].read(length)
+            for k,v in parse_qs(content.decode('utf-8'), keep_blank_values=1).items():
+                fields[k] = v
+    return fields
+
+def application(environ, start_response):
+    fields = request_fields(environ)
+    file = fields.get('file',[None])[0]
+    json = fields.get('json',[None])[0]
+    patch = fields.get('patch',[None])[0]
+    headers = []
     try:
-        with open(filename,'r') as f:
-            json = f.read()
-        json = '%s' % json;
-    except:
-        http_status('500 Read failed: %s' % sys.exc_info()[0])
-
-# send file to the user
-print 'Status: 200 OK'
-print 'Content-Type: application/json'
-print 'Content-Length:',len(json)
-print
-print json,
+        if patch is not None:
+            version = save_patch(file,patch)
+            body = version.encode('utf-8')
+        elif json is not None:
+            save_json(file,json)
+            version = libpatch.version(json)
+            body = b''
+        else:
+            json = load(file)
+            version = libpatch.version(json)
+            body = json.encode('utf-8')
+            headers.append(('Content-Type','application/json'))
+        headers.append(('ETag','"%s"' % version))
+        status = '200 OK'
+    except HTTPError as e:
+        status = e.status
+        body = b''
+    headers.append(('Content-Length',str(len(body))))
+    start_response(status, headers)
+    return [body]
+
+##################################################
+##  CGI
+##################################################
+
+# respond with specified status
+def http_status(status):
+    print('Status:',status)
+    print()
+    sys.exit(0)
+
+def cgi_main():
+    import cgi
+    # debuggin
+    import cgitb; cgitb.enable()
+
+    args = cgi.FieldStorage()
+    json = args.getfirst('json')
+    file = args.getfirst('file')
+    patch = args.getfirst('patch')
+
+    try:
+        # if user supplied a patch, apply it and send back the new version
+        if patch is not None:
+            version = save_patch(file,patch)
+            print('Status: 200 OK')
+            print('Content-Type: text/plain')
+            print('ETag: "%s"' % version)
+            print()
+            print(version,end='')
+            sys.exit(0)
+
+        # if user supplied json, save as new file contents
+        if json is not None:
+            save(file,json)
+            http_status('200 OK')
+
+        # request for a file, return as json
+        json = load(file)
+    except HTTPError as e:
+        http_status(e.status)
+
+    # send file to the user
+    print('Status: 200 OK')
+    print('Content-Type: application/json')
+    print('ETag: "%s"' % libpatch.version(json))
+    print('Content-Length:',len(json))
+    print()
+    print(json,end='')
+
+if __name__ == '__main__':
+    if 'GATEWAY_INTERFACE' in os.environ:
+        cgi_main()
+    else:
+        import argparse
+        from wsgiref.simple_server import make_server, WSGIServer
+        try:
+            from SocketServer import ThreadingMixIn
+        except ImportError:
+            from socketserver import ThreadingMixIn
+
+        class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        parser = argparse.ArgumentParser(description='Jade load/save server for user files')
+        parser.add_argument('--port', type=int, default=8001)
+        args = parser.parse_args()
+
+        ensure_user_dir()
+        httpd = make_server('', args.port, application, server_class=ThreadingWSGIServer)
+        print('Jade local server: port',args.port)
+        httpd.serve_forever()
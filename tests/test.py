@@ -1,43 +1,40 @@
-import sys,random,re
+import sys,os,random,re
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(here,'..','scripts'))
+sys.path.insert(0,os.path.join(here,'..'))
+from testvecutils import Row,VectorWriter
+import betasim
 
 cycle = 0   # used to count test cycles
 
-# output TEST aspect representation for a value of the specified width
+# each test vector is rendered as a single line by a Row of
+# (width, choices[, suffix]) fields:
 # specify choices as '01' for inputs
 # specify choices as 'LH' for outputs
 # value of None is always output as '-'
-def field(f,width,value,choices,suffix=' '):
-    for i in xrange(width):
-        if value is None:
-            f.write('-')
-        else:
-            f.write(choices[1] if (1 << (width-1-i)) & value else choices[0])
-    f.write(suffix)
-
-def xfield(f,width,s,choices,suffix=' '):
-    for i in xrange(width):
-        v = '-' if ((s is None) or s[i] in '?ZX') else choices[0] if s[i]=='0' else choices[1]
-        f.write(v)
-    f.write(suffix)
+# string values (eg, from a log) map ?, Z and X to '-'
 
 ##################################################
 ##  lab2
 ##################################################
 
+lab2_row = Row((3,'01'),(3,'01'),(4,'LH'))
+
 def lab2_test_cycle(f,a,b,y):
     global cycle
     cycle += 1
-    field(f,3,a,'01')
-    field(f,3,b,'01')
-    field(f,4,y,'LH')
-    f.write('// {:2d}: a={:d}, b={:d}, y={:d}\n'.format(cycle,a,b,y))
+    f.write(lab2_row.render(a,b,y) +
+            '// {:2d}: a={:d}, b={:d}, y={:d}\n'.format(cycle,a,b,y))
 
 def lab2_test(f):
+    f = VectorWriter(f)
     cycle = 0
     for a,b in ((0,1), (1,1), (2, 2), (4, 4), (0, 0), (1, 7), (2, 5), (7,7)):
         lab2_test_cycle(f,a,b,a+b)
         if a != b:
             lab2_test_cycle(f,b,a,a+b)
+    f.flush()
 
 #lab2_test(sys.stdout)
 
@@ -45,16 +42,16 @@ def lab2_test(f):
 ##  bool
 ##################################################
 
+bool_row = Row((4,'01'),(32,'01'),(32,'01'),(32,'LH'))
+
 def bool_test_cycle(f,fn,a,b,y):
     global cycle
     cycle += 1
-    field(f,4,fn,'01')
-    field(f,32,a,'01')
-    field(f,32,b,'01')
-    field(f,32,y,'LH')
-    f.write('// {:2d}: fn={:#06b}, a={:#010X}, b={:#010X}, y={:#010X}\n'.format(cycle,fn,a & 0xFFFFFFFF,b & 0xFFFFFFFF,y & 0xFFFFFFFF))
+    f.write(bool_row.render(fn,a,b,y) +
+            '// {:2d}: fn={:#06b}, a={:#010X}, b={:#010X}, y={:#010X}\n'.format(cycle,fn,a & 0xFFFFFFFF,b & 0xFFFFFFFF,y & 0xFFFFFFFF))
 
 def bool_test(f):
+    f = VectorWriter(f)
     cycle = 0
     a = 0xFF00FF00
     b = 0xFFFF0000
@@ -74,6 +71,7 @@ def bool_test(f):
     bool_test_cycle(f,0b1101,a,b,~a | b)
     bool_test_cycle(f,0b1110,a,b,a | b)
     bool_test_cycle(f,0b1111,a,b,-1)
+    f.flush()
 
 #bool_test(sys.stdout)
 
@@ -81,17 +79,18 @@ def bool_test(f):
 ##  cmp
 ##################################################
 
+cmp_row = Row((2,'01'),(3,'01'),(32,'LH'))
+
 def cmp_test_cycle(f,fn,z,v,n,y):
     global cycle
     cycle += 1
-    field(f,2,fn,'01')
-    field(f,3,(z << 2)+(v << 1)+n,'01')
-    field(f,32,y,'LH')
+    fields = cmp_row.render(fn,(z << 2)+(v << 1)+n,y)
     fn = ['???','CMPEQ','CMPLT','CMPLE'][fn]
-    f.write('// {:2d}: fn={:s}, z={:d}, v={:d}, n={:d}, y={:d}\n'.format(cycle,fn,z,v,n,y & 1))
+    f.write(fields + '// {:2d}: fn={:s}, z={:d}, v={:d}, n={:d}, y={:d}\n'.format(cycle,fn,z,v,n,y & 1))
 
 def cmp_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
     for zvn in xrange(7):
         z = (zvn >> 2) & 1
@@ -100,6 +99,7 @@ def cmp_test(f):
         cmp_test_cycle(f,0b01,z,v,n,z)
         cmp_test_cycle(f,0b10,z,v,n,n ^ v)
         cmp_test_cycle(f,0b11,z,v,n,z | (n ^ v))
+    f.flush()
 
 #cmp_test(sys.stdout)
 
@@ -107,15 +107,13 @@ def cmp_test(f):
 ##  arith
 ##################################################
 
+arith_row = Row((1,'01'),(32,'01'),(32,'01'),(32,'LH'),(3,'LH'))
+
 def arith_test_cycle(f,fn,a,b,y,z,v,n):
     global cycle
     cycle += 1
-    field(f,1,fn,'01')
-    field(f,32,a,'01')
-    field(f,32,b,'01')
-    field(f,32,y,'LH')
-    field(f,3,(z << 2)+(v << 1)+n,'LH')
-    f.write('// {:2d}: fn={:d}, a={:#010X}, b={:#010X}, y={:#010X}\n'.format(cycle,fn,a & 0xFFFFFFFF,b & 0xFFFFFFFF,y & 0xFFFFFFFF))
+    f.write(arith_row.render(fn,a,b,y,(z << 2)+(v << 1)+n) +
+            '// {:2d}: fn={:d}, a={:#010X}, b={:#010X}, y={:#010X}\n'.format(cycle,fn,a & 0xFFFFFFFF,b & 0xFFFFFFFF,y & 0xFFFFFFFF))
 
 def arith_result(fn,a,b):
     amsb = (a >> 31) & 1;
@@ -134,12 +132,14 @@ def arith_result(fn,a,b):
 
 def arith_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
     for fn in (0,1):
         for a in (0,1,-1,0xAAAAAAAA,0x55555555):
             for b in (0,1,-1,0xAAAAAAAA,0x55555555):
                 y,z,v,n = arith_result(fn,a,b)
                 arith_test_cycle(f,fn,a,b,y,z,v,n)
+    f.flush()
 
 #arith_test(sys.stdout)
 
@@ -147,24 +147,25 @@ def arith_test(f):
 ##  shift
 ##################################################
 
+shift_row = Row((2,'01'),(32,'01'),(5,'01'),(32,'LH'))
+
 def shift_test_cycle(f,fn,a,b,y):
     global cycle
     cycle += 1
-    field(f,2,fn,'01')
-    field(f,32,a,'01')
-    field(f,5,b,'01')
-    field(f,32,y,'LH')
     op = ['SHL','SHR','???','SRA'][fn]
-    f.write('// {:3d}: fn={:s}, a={:#010X}, b={:2d}, y={:#010X}\n'.format(cycle,op,a & 0xFFFFFFFF,b,y & 0xFFFFFFFF))
+    f.write(shift_row.render(fn,a,b,y) +
+            '// {:3d}: fn={:s}, a={:#010X}, b={:2d}, y={:#010X}\n'.format(cycle,op,a & 0xFFFFFFFF,b,y & 0xFFFFFFFF))
 
 def shift_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
     for a in (0,1,0xFFFFFFFF,0x12345678,0xFEDCBA98):
         for b in (0,1,2,4,8,16,31):
             shift_test_cycle(f,0b00,a,b,a << b)
             shift_test_cycle(f,0b01,a,b,a >> b)
             shift_test_cycle(f,0b11,a,b,(a if a < 0x80000000 else 0xFFFFFFFF00000000+a) >> b)
+    f.flush()
 
 #shift_test(sys.stdout)
 
@@ -179,19 +180,18 @@ op = [
     "SHL", "SHR", "?", "SRA", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?", "?",
 ]
 
+alu_row = Row((6,'01'),(32,'01'),(32,'01'),(32,'LH'),(3,'LH'))
+
 def alu_test_cycle(f,fn,a,b,y):
     global cycle
     cycle += 1
     aluy,z,v,n = arith_result(fn & 1,a,b)
-    field(f,6,fn,'01')
-    field(f,32,a,'01')
-    field(f,32,b,'01')
-    field(f,32,y,'LH')
-    field(f,3,(z << 2)+(v<<1)+n,'LH')
-    f.write('// %3d: fn=%5s, a=0x%08x, b=0x%08x, y=0x%08x\n' % (cycle,op[fn],a,b,y & 0xFFFFFFFF))
+    f.write(alu_row.render(fn,a,b,y,(z << 2)+(v<<1)+n) +
+            '// %3d: fn=%5s, a=0x%08x, b=0x%08x, y=0x%08x\n' % (cycle,op[fn],a,b,y & 0xFFFFFFFF))
 
 def alu_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
 
     # test boole
@@ -257,6 +257,7 @@ def alu_test(f):
     alu_test_cycle(f,CMPEQ,0x7FFFFFFF,0xFFFFFFFF,0) # z=0, v=1, n=1
     alu_test_cycle(f,CMPLT,0x7FFFFFFF,0xFFFFFFFF,0) # z=0, v=1, n=1
     alu_test_cycle(f,CMPLE,0x7FFFFFFF,0xFFFFFFFF,0) # z=0, v=1, n=1
+    f.flush()
 
 #alu_test(sys.stdout)
 
@@ -266,22 +267,22 @@ def alu_test(f):
 
 last_y = None
 
+alu_timing_row = Row((6,'01'),(32,'01'),(32,'01'),(32,'LH'))
+
 def alu_timing_test_cycle(f,fn,a,b,y):
     global cycle,last_y
     cycle += 1
-    field(f,6,fn,'01')
-    field(f,32,a,'01')
-    field(f,32,b,'01')
-    field(f,32,last_y,'LH')
+    fields = alu_timing_row.render(fn,a,b,last_y)
     if last_y is None:
         ytxt = 'not checked'
     else:
         ytxt = '0x%08x' % (last_y & 0xFFFFFFFF)
-    f.write('// %3d: fn=%5s, a=0x%08x, b=0x%08x, y=%s\n' % (cycle,op[fn],a,b,ytxt))
+    f.write(fields + '// %3d: fn=%5s, a=0x%08x, b=0x%08x, y=%s\n' % (cycle,op[fn],a,b,ytxt))
     last_y = y
 
 def alu_timing_test(f):
     global cycle,last_y
+    f = VectorWriter(f)
     cycle = 0
     last_y = None
 
@@ -354,6 +355,7 @@ def alu_timing_test(f):
     alu_timing_test_cycle(f,CMPLT,0x7FFFFFFF,0xFFFFFFFF,0) # z=0, v=1, n=1
     alu_timing_test_cycle(f,0,0,0,None)
     alu_timing_test_cycle(f,0,0,0,None)
+    f.flush()
 
 #alu_timing_test(sys.stdout)
 
@@ -361,25 +363,21 @@ def alu_timing_test(f):
 ##  regfile
 ##################################################
 
+regfile_row = Row((2,'01'),(1,'01'),(5,'01'),(5,'01'),(5,'01'),(32,'01'),(32,'LH'),(32,'LH'))
+
 def regfile_test_cycle(f,ra2sel,wasel,werf,ra,rb,rc,wdata,radata,rbdata):
     global cycle
     cycle += 1
 
-    field(f,2,2*ra2sel + wasel,'01')
-    field(f,1,werf,'01')
-    field(f,5,ra,'01')
-    field(f,5,rb,'01')
-    field(f,5,rc,'01')
-    field(f,32,wdata,'01')
-    field(f,32,radata,'LH')
-    field(f,32,rbdata,'LH')
-    f.write(' // %3d: Ra[%s]==%s, %s[%s]==%s' % (cycle,ra,radata,'Rc' if ra2sel else 'Rb',rc if ra2sel else rb,rbdata))
+    line = regfile_row.render(2*ra2sel + wasel,werf,ra,rb,rc,wdata,radata,rbdata)
+    line += ' // %3d: Ra[%s]==%s, %s[%s]==%s' % (cycle,ra,radata,'Rc' if ra2sel else 'Rb',rc if ra2sel else rb,rbdata)
     if werf:
-        f.write(' Reg[%s]=%s' % (30 if wasel else rc,wdata))
-    f.write('\n')
+        line += ' Reg[%s]=%s' % (30 if wasel else rc,wdata)
+    f.write(line + '\n')
 
 def regfile_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
 
     regfile_test_cycle(f,0,0,0,31,31,0,0,0,0)
@@ -410,6 +408,7 @@ def regfile_test(f):
     # make sure werf isn't tied to 1
     regfile_test_cycle(f,0,0,0,1,2,3,12345678,1,2) # no write
     regfile_test_cycle(f,0,0,0,3,3,3,12345678,3,3) # ensure R3 unchanged
+    f.flush()
 
 regfile_test(sys.stdout)
 
@@ -417,25 +416,22 @@ regfile_test(sys.stdout)
 ##  PC
 ##################################################
 
+pc_row = Row((1,'01'),(3,'01'),(16,'01'),(32,'01'),(32,'LH'),(32,'LH'),(32,'LH'))
+
 def pc_test_cycle(f,reset,pcsel,id,jt,pc,comment=''):
     global cycle
     cycle += 1
 
-    field(f,1,reset,'01')
-    field(f,3,pcsel,'01')
-    field(f,16,id & 0xFFFF,'01')
-    field(f,32,jt & 0xFFFFFFFF,'01')
-
     offset = (id - 0x10000) if id >= 0x8000 else id   # sign extension
     pc_inc = (pc & 0x80000000) + ((pc + 4) & 0x7FFFFFFC)
     pc_offset = (pc & 0x80000000) + ((pc + 4 + 4*offset) & 0x7FFFFFFC)
 
-    field(f,32,pc,'LH')
-    field(f,32,pc_inc,'LH')
-    field(f,32,pc_offset,'LH',suffix=' // %3d: %s\n' % (cycle,comment))
+    f.write(pc_row.render(reset,pcsel,id & 0xFFFF,jt & 0xFFFFFFFF,pc,pc_inc,pc_offset) +
+            '// %3d: %s\n' % (cycle,comment))
 
 def pc_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
 
     # test reset, illop, xadr
@@ -470,6 +466,7 @@ def pc_test(f):
     pc_test_cycle(f,0,0,0,0,0x01000000,'inc')
     pc_test_cycle(f,0,2,0,0x7FFFFFFC,0x7FFFFFFC,'jmp, PC==0x7FFFFFFC')
     pc_test_cycle(f,0,0,-2,0,0x00000000,'inc')
+    f.flush()
 
 #pc_test(sys.stdout)
 
@@ -575,10 +572,6 @@ ctlrom = """
 0b??????_??_?0_011_?_1001  // 0b101111
 """
 
-betaop = [
-"???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "???", "LD", "ST", "???", "JMP", "BEQ", "BNE", "???", "LDR", "ADD", "SUB", "MUL", "DIV", "CMPEQ", "CMPLT", "CMPLE", "???", "AND", "OR", "XOR", "XNOR", "SHL", "SHR", "SRA", "???", "ADDC", "SUBC", "MULC", "DIVC", "CMPEQC", "CMPLTC", "CMPLEC", "???", "ANDC", "ORC", "XORC", "XNORC", "SHLC", "SHRC", "SRAC", "???"
-]
-
 def read_rom(rom):
     # reformat master into a list of values
     rom = re.sub(r'\/\*(.|\n)*?\*\/','',rom)   # remove multi-line comments
@@ -587,25 +580,20 @@ def read_rom(rom):
     rom = re.sub(r'^0b','',rom,flags=re.M)     # 0b at front
     return rom.split()
 
+ctl_row = Row((6,'01'),(3,'01'),
+              (6,'LH'),(1,'LH',''),(1,'LH'),(1,'LH',''),(1,'LH'),(3,'LH'),
+              (1,'LH'),(1,'LH',''),(2,'LH',''),(1,'LH'))
+
 def ctl_test_cycle(f,op,reset,irq,z,alufn,asel,bsel,moe,mwr,pcsel,ra2sel,wasel,wdsel,werf,comment):
     global cycle
     cycle += 1
-    field(f,6,op,'01')
-    field(f,3,reset*4 + irq*2 + z,'01')
-
-    xfield(f,6,alufn,'LH')
-    xfield(f,1,asel,'LH','')
-    xfield(f,1,bsel,'LH')
-    xfield(f,1,moe,'LH','')
-    xfield(f,1,mwr,'LH')
-    xfield(f,3,pcsel,'LH')
-    xfield(f,1,ra2sel,'LH')
-    xfield(f,1,wasel,'LH','')
-    xfield(f,2,wdsel,'LH','')
-    xfield(f,1,werf,'LH',suffix= ' // %3d: %s\n' % (cycle,comment))
+    f.write(ctl_row.render(op,reset*4 + irq*2 + z,
+                           alufn,asel,bsel,moe,mwr,pcsel,ra2sel,wasel,wdsel,werf) +
+            '// %3d: %s\n' % (cycle,comment))
 
 def ctl_test(f):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
 
     # process control rom
@@ -628,7 +616,7 @@ def ctl_test(f):
         for reset in (0,1):
             for irq in (0,1):
                 for z in (0,1):
-                    comment = str.format('op=0b{:06b} {:s}',op,betaop[op])
+                    comment = str.format('op=0b{:06b} {:s}',op,betasim.BETAOP[op])
                     if reset:
                         ctl_test_cycle(f,op,reset,irq,z,None,None,None,None,'0',None,None,None,None,None,comment)
                     elif irq:
@@ -638,6 +626,7 @@ def ctl_test(f):
                             xpcsel = '001' if z ^ int(pcsel[2]) else '000'
                         else: xpcsel = pcsel
                         ctl_test_cycle(f,op,reset,irq,z,alufn,asel,bsel,moe,mwr,xpcsel,ra2sel,wasel,wdsel,werf,comment)
+    f.flush()
 
 #ctl_test(sys.stdout)
 
@@ -646,7 +635,10 @@ def ctl_test(f):
 ##################################################
 
 # built from log created by running lab5checkoff.uasm on a good beta
-# using the following test
+# using the following test.  A log can also come from betasim.py, which
+# emulates the Beta and writes the same trace for any program, eg:
+#   python ../betasim.py lab5checkoff.bin --cycles 567 --irq 416 --trace beta_log
+# Packed traces (see tracefile.py) work too: beta_test(f,tracefile.Trace('beta.trc'))
 
 """
 .power Vdd=1
@@ -668,19 +660,14 @@ def ctl_test(f):
 00
 """
 
+beta_row = Row((1,'01',''),(1,'01'),
+               (32,'LH'),(32,'LH'),(32,'LH'),(1,'LH',''),(1,'LH'),(32,'LH'),(32,'LH'))
+
 def beta_test_cycle(f,reset,irq,ia,id,ma,moe,mwr,mrd,mwd,comment = ''):
     global cycle
     cycle += 1
-    xfield(f,1,reset,'01','')
-    xfield(f,1,irq,'01')
-
-    xfield(f,32,ia,'LH')
-    xfield(f,32,id,'LH')
-    xfield(f,32,ma,'LH')
-    xfield(f,1,moe,'LH','')
-    xfield(f,1,mwr,'LH')
-    xfield(f,32,mrd,'LH')
-    xfield(f,32,mwd,'LH',suffix= ' // %3d: %s\n' % (cycle,comment))
+    f.write(beta_row.render(reset,irq,ia,id,ma,moe,mwr,mrd,mwd) +
+            '// %3d: %s\n' % (cycle,comment))
 
 def disassemble(reset,irq,ia,id):
     if reset=='1':
@@ -689,45 +676,19 @@ def disassemble(reset,irq,ia,id):
         return 'interrupt'
     if not id[:2] in ['00', '01', '10', '11']:
         return ''
+    return betasim.disassemble(int(ia,2),int(id,2))
 
-    pc = str.format('[{:03x}] ',int(ia[1:],2))
-    opcode = betaop[int(id[:6],2)]
-    if opcode[0] == '?':
-        return pc+ str.format('illop op=0b%s' % id[:6])
-
-    rc = int(id[6:11],2)
-    ra = int(id[11:16],2)
-    rb = int(id[16:21],2)
-    literal = int(id[16:32],2)
-    if literal >= 0x8000: literal -= 0x10000
-    offset_addr = int(ia[1:32],2) + 4*literal + 4
-
-    if id[:2] == '10':
-        return pc + '%s(R%d,R%d,R%d)' % (opcode,ra,rb,rc)
-    elif id[:2] == '11':
-        return pc + '%s(R%d,0x%x,R%d)' % (opcode,ra,literal & 0xFFFF,rc)
-    elif opcode == 'LD':
-        return pc + 'LD(R%d,0x%x,R%d)' % (ra,literal & 0xFFFF,rc)
-    elif opcode == 'ST':
-        return pc + 'ST(R%d,0x%x,R%d)' % (rc,literal & 0xFFFF,ra)
-    elif opcode == 'LDR':
-        return pc + 'LDR(0x%x,R%d)' % (offset_addr,rc)
-    elif opcode == 'JMP':
-        return pc + 'JMP(R%d,R%d)' % (ra,rc)
-    elif opcode == 'BEQ' or opcode == 'BNE':
-        return pc + '%s(R%d,0x%x,R%d)' % (opcode,ra,offset_addr,rc)
-    else:
-        return 'unknown instruction'
-
-def beta_test(f):
+def beta_test(f,log=None):
     global cycle
+    f = VectorWriter(f)
     cycle = 0
 
     # process control rom
     content = read_rom(ctlrom)
     assert len(content)==64, 'ctlrom does not have 64 entries'
 
-    log = open('beta_log')
+    # log: any iterable of trace lines, eg, betasim.Beta(...).trace(...)
+    if log is None: log = open('beta_log')
     for line in log:
         # break down log entry into useful values
         lreset = line[0]
@@ -765,5 +726,6 @@ def beta_test(f):
         if lmwr != '1': lmwd = None
 
         beta_test_cycle(f,lreset,lirq,lia,lid,lma,lmoe,lmwr,lmrd,lmwd,disassemble(lreset,lirq,lia,lid))
-        
+    f.flush()
+
 #beta_test(sys.stdout)
@@ -0,0 +1,50 @@
+# Forking a gatesim checkpoint into a different test of the same circuit.
+# Run with pytest or as
+#
+#   python tests/test_checkpoint.py
+
+import os, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..'))
+import netlist, grader
+
+modules = netlist.merge_libraries(netlist.load_library(os.path.join(here, '..', 'files', 'gates')),
+                                  netlist.load_library(os.path.join(here, '..', 'files', 'ward')))
+source = grader.test_source(modules['/notes/ha'])
+vectors = '00 LL\n01 HL\n10 HL\n11 LH'
+
+def ha_test(rows):
+    return grader.parse_test(source.replace(vectors, rows))
+
+# checkpoint after the first cycle of the test with rows, then run the
+# test with other_rows from it and from scratch
+def fork(rows, other_rows):
+    nl, errors = grader.test_netlist(modules, '/notes/ha', ha_test(rows))
+    checkpoint = grader.test_checkpoint(nl, ha_test(rows))
+    results = []
+    for data in (checkpoint, None):
+        nl, errors = grader.test_netlist(modules, '/notes/ha', ha_test(other_rows))
+        result = {'errors': []}
+        grader.simulate_test(nl, ha_test(other_rows), result, data)
+        results.append(result)
+    return results
+
+def test_fork_with_input_change_at_checkpoint():
+    # the second cycle changes a different input right at the checkpoint
+    for rows, other_rows in ((vectors, '00 LL\n10 HL\n11 LH\n01 HL'),
+                             ('00 LL\n10 HL\n11 LH\n01 HL', vectors)):
+        forked, straight = fork(rows, other_rows)
+        assert forked['errors'] == []
+        assert forked['status'] == straight['status'] == 'passed'
+        assert forked['log'] == straight['log']
+
+def test_fork_with_different_prefix():
+    forked, straight = fork(vectors, '01 HL\n00 LL\n10 HL\n11 LH')
+    assert forked.get('status') is None
+    assert 'different before the checkpoint' in forked['errors'][0]
+
+if __name__ == '__main__':
+    test_fork_with_input_change_at_checkpoint()
+    test_fork_with_different_prefix()
+    print('ok')
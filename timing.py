@@ -0,0 +1,395 @@
+# Static timing analysis of gate-level netlists without a browser.
+#
+# A port of timing_analysis in gatesim.js: the same tCD and tPD for every
+# node, computed from the same device delays and node capacitances, and
+# the same report of the worst-case paths for each clock and of hold-time
+# violations.  Rather than recursing from every node, the timing infos
+# are put in topological order once, so after the delays of some devices
+# change (update) only the infos in their fan-out cone are recomputed, and
+# only as far as a tCD or tPD actually changes.  Netlists come from
+# netlist.gate_netlist.
+#
+#   import netlist, timing
+#   modules = netlist.merge_libraries(netlist.load_library('files/gates'),
+#                                     netlist.load_library('files/ward'))
+#   sta = timing.Analysis(netlist.gate_netlist(modules, '/beta/beta'))
+#   print(sta.report())
+#   sta.update(sta.devices('alu'), scale=1.2)   # a slower alu
+#   print(sta.report())
+
+import heapq
+
+import gatesim
+
+class TimingError(Exception):
+    pass
+
+RISING = u'\u2191'   # appended to the name of a clock for its rising edge
+
+# delays update knows about; tpd sets both tpdr and tpdf
+delay_names = ('tcd', 'tpdr', 'tpdf', 'tr', 'tf', 'ts', 'th')
+
+def is_input(node):
+    return node.driver is None or isinstance(node.driver, gatesim.Source)
+
+def is_output(node):
+    return (not node.fanouts and node.driver is not None and
+            not isinstance(node.driver, gatesim.Source) and '.' not in node.name)
+
+class TimingInfo(object):
+    def __init__(self, name, node, device=None):
+        self.name = name       # name to use in reports (sometimes differs from node.name)
+        self.node = node       # associated node
+        self.device = device   # what device determined this info
+        self.tcd = 0           # specs for driving device, capacitance accounted for
+        self.tpd = 0
+        self.cd_sum = 0        # min cumulative tCD from inputs to here
+        self.cd_link = None    # previous TimingInfo in tCD path
+        self.pd_sum = 0        # max cumulative tPD from inputs to here
+        self.pd_link = None    # previous TimingInfo in tPD path
+
+        self.inputs = []       # infos the sums are computed from
+        self.fanouts = []      # infos computed from this one
+        self.check = False     # setup/hold check at a clocked device
+        self.clock = None      # info of a clock this one copies, for register outputs
+        self.order = 0         # position in topological order
+
+    def tcd_source(self):
+        t = self
+        while t.cd_link is not None: t = t.cd_link
+        return t
+
+    def tpd_source(self):
+        t = self
+        while t.pd_link is not None: t = t.pd_link
+        return t
+
+    # using timing info from an input, update timing info for associated node
+    def set_delays(self, tinfo):
+        t = tinfo.cd_sum + self.tcd
+        if self.cd_link is None or t < self.cd_sum:
+            self.cd_link = tinfo
+            self.cd_sum = t
+
+        t = tinfo.pd_sum + self.tpd
+        if self.pd_link is None or t > self.pd_sum:
+            self.pd_link = tinfo
+            self.pd_sum = t
+
+    # recompute tcd and tpd from the device's current delays, then the
+    # sums from the inputs' infos
+    def compute(self):
+        c = self.clock
+        if c is not None:
+            # register outputs start at a copy of the clock's info
+            self.device, self.tcd, self.tpd = c.device, c.tcd, c.tpd
+            self.cd_sum, self.cd_link, self.pd_sum, self.pd_link = c.cd_sum, c.cd_link, c.pd_sum, c.pd_link
+            return
+        d = self.device
+        if d is None: return
+        if self.check:
+            # account for setup and hold times
+            self.tcd, self.tpd = -d.th, d.ts
+        else:
+            cap = self.node.capacitance
+            self.tcd, self.tpd = d.tcd, max(d.tpdr + d.tr*cap, d.tpdf + d.tf*cap)
+        self.cd_sum = self.pd_sum = 0
+        self.cd_link = self.pd_link = None
+        for tinfo in self.inputs: self.set_delays(tinfo)
+
+    # infos along the tCD or tPD path, starting at its source
+    def path(self, link='pd_link'):
+        result = []
+        t = self
+        while t is not None:
+            result.append(t)
+            t = getattr(t, link)
+        result.reverse()
+        return result
+
+    def describe_tpd(self):
+        lines = []
+        for t in self.path('pd_link'):
+            driver = ' [%s %s]' % (t.device.name, t.device.type) if t.device is not None else ''
+            lines.append('    + %6.3fns = %6.3fns %s%s' % (t.tpd*1e9, t.pd_sum*1e9, t.name, driver))
+        return '\n'.join(lines)
+
+    def describe_tcd(self):
+        lines = []
+        for t in self.path('cd_link'):
+            driver = ' [%s]' % t.device.name if t.device is not None else ''
+            # when calculating hold time violations, tcd for register is negative...
+            lines.append('    %s %6.3fns = %6.3fns %s%s' % ('-' if t.tcd < 0 else '+', abs(t.tcd)*1e9,
+                                                           t.cd_sum*1e9, t.name, driver))
+        return '\n'.join(lines)
+
+class Analysis(object):
+    def __init__(self, netlist, options=None):
+        options = dict(options or {})
+        options['timing_analysis'] = True
+        self.network = network = gatesim.Network(netlist, options)
+
+        # an info for every node, then the copies of clock infos and the
+        # setup/hold checks
+        self.info = {}      # Node -> TimingInfo
+        infos = []
+        for n in network.nodes:
+            tinfo = TimingInfo(n.name, n, None if is_input(n) else n.driver)
+            self.info[n] = tinfo
+            infos.append(tinfo)
+        for tinfo in list(infos):
+            if tinfo.device is not None: tinfo.inputs = self._inputs(tinfo, infos)
+
+        # checks at the devices clocked by each clock, in the order of the
+        # clock's fanouts
+        self.clocks = []
+        self.checks = {}    # clock Node -> [TimingInfo]
+        for name in gatesim.js_order(list(network.node_map.keys())):
+            clk = network.node_map[name]
+            if not getattr(clk, 'clock', False) or clk in self.checks: continue
+            self.clocks.append(clk)
+            self.checks[clk] = []
+            for device in clk.fanouts:
+                inputs = self._clock_inputs(device, clk)
+                if inputs is None: continue
+                tinfo = TimingInfo(clk.name + RISING, clk, device)
+                tinfo.check = True
+                tinfo.inputs = inputs
+                self.checks[clk].append(tinfo)
+                infos.append(tinfo)
+
+        # every node name's info, as reported
+        self.timing = [(name, self.info[network.node_map[name]])
+                       for name in gatesim.js_order(list(network.node_map.keys()))]
+
+        # infos whose delays come from each device
+        self.driven = {}
+        for tinfo in infos:
+            if tinfo.device is not None and tinfo.clock is None:
+                self.driven.setdefault(tinfo.device, []).append(tinfo)
+
+        self.infos = self._sort(infos)
+        for tinfo in self.infos: tinfo.compute()
+
+    # infos that determine the timing of a device's output
+    def _inputs(self, tinfo, infos):
+        d = tinfo.device
+        info = self.info
+        if isinstance(d, gatesim.LogicGate):
+            # constant inputs don't contribute to timing
+            return [info[i] for i in d.inputs if not i.constant_value]
+        if isinstance(d, gatesim.Storage):
+            clk = TimingInfo(d.clk.name + RISING, d.clk)
+            clk.clock = info[d.clk]
+            clk.inputs = [clk.clock]
+            infos.append(clk)
+            # latch timing also depends on D input
+            return [clk] if d.type == 'dreg' else [clk, info[d.d]]
+        inputs = []
+        for port in d.ports:
+            # read ports with data connections to the output
+            if port['read_port'] and tinfo.node in port['data_out']:
+                inputs.append(info[port['oe']])
+                inputs.extend(info[a] for a in port['addr'][:d.naddr])
+        return inputs
+
+    # inputs checked against setup and hold times at a clk edge, or None
+    def _clock_inputs(self, device, clk):
+        info = self.info
+        if isinstance(device, gatesim.Storage):
+            return [info[device.d]] if device.type == 'dreg' else None
+        if not isinstance(device, gatesim.Memory): return None
+        inputs = None
+        for port in device.ports:
+            # write ports clocked by clk
+            if not port['write_port'] or port['clk'] is not clk: continue
+            if inputs is None: inputs = []
+            inputs.append(info[port['wen']])
+            inputs.extend(info[a] for a in port['addr'][:device.naddr])
+            inputs.extend(info[n] for n in port['data'][:device.width])
+        return inputs
+
+    # topological order of the infos, so each comes after all its inputs
+    def _sort(self, infos):
+        pending = {}
+        for tinfo in infos:
+            distinct = set(tinfo.inputs)
+            pending[tinfo] = len(distinct)
+            for i in distinct: i.fanouts.append(tinfo)
+        ready = [t for t in reversed(infos) if pending[t] == 0]
+        order = []
+        while ready:
+            tinfo = ready.pop()
+            tinfo.order = len(order)
+            order.append(tinfo)
+            for f in tinfo.fanouts:
+                pending[f] -= 1
+                if pending[f] == 0: ready.append(f)
+
+        if len(order) < len(infos):
+            # follow unordered inputs from an unordered info until one repeats
+            t = next(t for t in infos if pending[t] > 0)
+            cycle = []
+            while t not in cycle:
+                cycle.append(t)
+                t = next(i for i in t.inputs if pending[i] > 0)
+            cycle = cycle[cycle.index(t):]
+            raise TimingError('Combinational cycle detected:\n  ' + '\n  '.join(t.name for t in cycle))
+        return order
+
+    # devices of a module instance, eg 'alu.add'
+    def devices(self, instance):
+        prefix = instance + '.'
+        return [d for d in self.network.devices
+                if d.name and (d.name == instance or d.name.startswith(prefix))]
+
+    # Change the delays of devices, either multiplying all of them by
+    # scale or setting the named ones, eg update(devices, tpd=50e-12),
+    # then recompute the timing of their fan-out cone.  Returns the number
+    # of infos recomputed.
+    def update(self, devices, scale=None, **delays):
+        for name in delays:
+            if name != 'tpd' and name not in delay_names: raise TimingError('Unknown delay: ' + name)
+        changed = []
+        for d in devices:
+            if scale is not None:
+                for name in delay_names:
+                    if hasattr(d, name): setattr(d, name, getattr(d, name) * scale)
+            for name, v in delays.items():
+                if name == 'tpd': d.tpdr = d.tpdf = v
+                else: setattr(d, name, v)
+            changed.extend(self.driven.get(d, []))
+        return self._propagate(changed)
+
+    # recompute infos in topological order, passing on to fanouts only
+    # when the result changed
+    def _propagate(self, infos):
+        heap = [(t.order, t) for t in set(infos)]
+        heapq.heapify(heap)
+        queued = set(t for order, t in heap)
+        count = 0
+        while heap:
+            order, t = heapq.heappop(heap)
+            before = (t.tcd, t.tpd, t.cd_sum, t.cd_link, t.pd_sum, t.pd_link)
+            t.compute()
+            count += 1
+            if (t.tcd, t.tpd, t.cd_sum, t.cd_link, t.pd_sum, t.pd_link) == before: continue
+            for f in t.fanouts:
+                if f not in queued:
+                    queued.add(f)
+                    heapq.heappush(heap, (f.order, f))
+        return count
+
+    # setup checks at devices clocked by clk whose worst-case path starts
+    # at clk's rising edge
+    def clock_paths(self, clk):
+        return [t for t in self.checks[clk] if t.tpd_source().node is clk]
+
+    def hold_violations(self, clk):
+        return [t for t in self.checks[clk] if not is_input(t.tpd_source().node) and t.cd_sum < 0]
+
+    # top-level outputs whose worst-case path starts at clk, or at an
+    # input if clk is None
+    def output_paths(self, clk=None):
+        result = []
+        for name, t in self.timing:
+            if not is_output(t.node): continue
+            src = t.tpd_source().node
+            if clk is None: ok = not getattr(src, 'clock', False)
+            else: ok = src is clk
+            if ok: result.append(t)
+        return result
+
+    # worst paths first, ties in node order as in gatesim.js
+    @staticmethod
+    def worst(paths):
+        return sorted(paths, key=lambda t: -t.pd_sum)
+
+    def report(self, maxpaths=10):
+        sections = []
+
+        def describe_tpd(src, dst, paths):
+            if not paths: return
+            lines = ['Worst-case tPD from %s to %s' % (src, dst)]
+            for t in self.worst(paths)[:maxpaths]:
+                lines.append('')
+                lines.append('  tPD from %s to %s (%.3fns):' % (t.tpd_source().name, t.name, t.pd_sum*1e9))
+                lines.append(t.describe_tpd())
+            sections.append('\n'.join(lines))
+
+        for clk in self.clocks:
+            edge = clk.name + RISING
+            describe_tpd(edge, edge, self.clock_paths(clk))
+            violations = self.hold_violations(clk)
+            if violations:
+                lines = ['Hold-time violations for %s:' % edge]
+                for t in violations:
+                    lines.append('')
+                    lines.append('  tCD from %s to %s violates hold time by %.3fns:' %
+                                 (t.tcd_source().name, t.cd_link.name, t.cd_sum*1e9))
+                    lines.append(t.describe_tcd())
+                sections.append('\n'.join(lines))
+            describe_tpd(edge, 'top-level outputs', self.output_paths(clk))
+        describe_tpd('inputs', 'top-level outputs', self.output_paths())
+        return '\n\n'.join(sections)
+
+    # worst-case tPDs (seconds) and hold-time violations, eg for grading
+    def summary(self):
+        def worst(paths):
+            if not paths: return None
+            t = self.worst(paths)[0]
+            return {'tpd': t.pd_sum, 'from': t.tpd_source().name, 'to': t.name}
+        clocks = {}
+        for clk in self.clocks:
+            clocks[clk.name] = {
+                'tpd': worst(self.clock_paths(clk)),
+                'outputs': worst(self.output_paths(clk)),
+                'hold_violations': [{'from': t.tcd_source().name, 'to': t.cd_link.name, 'slack': t.cd_sum}
+                                    for t in self.hold_violations(clk)],
+            }
+        return {'clocks': clocks, 'outputs': worst(self.output_paths())}
+
+# report on the timing of netlist, like timing_analysis in gatesim.js
+def timing_analysis(netlist, options=None, maxpaths=10):
+    return Analysis(netlist, options).report(maxpaths)
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    import time
+    import netlist
+
+    parser = argparse.ArgumentParser(description='Static timing analysis of a Jade module')
+    parser.add_argument('libraries', nargs='+', help='module libraries (see files/)')
+    parser.add_argument('module', help='name of module to analyze, eg /beta/beta')
+    parser.add_argument('--paths', type=int, default=10, help='worst-case paths to report per section (default 10)')
+    parser.add_argument('--scale', action='append', default=[], metavar='INSTANCE=FACTOR',
+                        help='then scale the delays of a module instance, eg alu=1.2, and report again')
+    parser.add_argument('--json', action='store_true', help='print a summary of the worst-case paths as JSON')
+    args = parser.parse_args()
+
+    modules = netlist.merge_libraries(*[netlist.load_library(f) for f in args.libraries])
+    try:
+        start = time.time()
+        sta = Analysis(netlist.gate_netlist(modules, args.module))
+        sys.stderr.write('analyzed %d timing infos in %.3fs\n' % (len(sta.infos), time.time() - start))
+        for s in args.scale:
+            instance, eq, factor = s.rpartition('=')
+            devices = sta.devices(instance)
+            if not eq or not devices: sys.exit('No such module instance: ' + s)
+            start = time.time()
+            count = sta.update(devices, scale=float(factor))
+            sys.stderr.write('scaled %s by %s: recomputed %d timing infos in %.3fs\n' %
+                             (instance, factor, count, time.time() - start))
+    except (netlist.NetlistError, gatesim.SimulationError, TimingError, ValueError) as e:
+        sys.exit(str(e))
+
+    if args.json:
+        json.dump(sta.summary(), sys.stdout)
+        print()
+    else:
+        out = sta.report(args.paths)
+        # python 2 won't print the rising edge arrow to a pipe
+        if not isinstance(out, str): out = out.encode('utf-8')
+        print(out)
@@ -0,0 +1,147 @@
+# Find the first cycle where a trace differs from a reference trace, eg,
+# the checkoff log of a student's Beta against tests/beta_log.
+#
+# As in the checkoff vectors tests/test.py builds from a log (see xfield),
+# reference values of X or Z are don't cares: only the reference's 0s and
+# 1s have to match.  Traces are compared as packed records (tracefile.py)
+# a chunk of cycles at a time.  A chunk whose records are identical is
+# passed over with one comparison of its bytes.  In one that isn't, the
+# first differing record is found by binary search on the length of the
+# identical prefix, then checked again with the don't cares masked off
+# (all at once with numpy, when it's available).  For mostly-matching
+# traces the work is a byte comparison per chunk plus a few per
+# difference, with no text to parse when both traces are packed.
+#
+#   import tracediff, tracefile
+#   ref = tracefile.Trace('ref.trc')
+#   cycle = tracediff.first_divergence(ref, tracefile.Trace('student.trc'))
+#   print(tracediff.report(ref, tracefile.Trace('student.trc'), cycle))
+
+import tracefile
+import betasim
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class TraceDiffError(Exception):
+    pass
+
+# Does a simulated record differ from a reference record anywhere the
+# reference is 0 or 1?
+def _differs(ref, sim, cycle):
+    r0, r1 = ref.planes(cycle)
+    s0, s1 = sim.planes(cycle)
+    return ((r0 ^ s0) | (r1 ^ s1)) & ~r1 != 0
+
+# First cycle in [start, end) where the traces differ other than at don't
+# cares, or None.  The records are known to be different somewhere.
+def _first_in_chunk(ref, sim, start, end):
+    if np is not None:
+        n = end - start
+        r = np.frombuffer(ref.records(start, n), np.uint8).reshape(n, 2, ref.nbytes)
+        s = np.frombuffer(sim.records(start, n), np.uint8).reshape(n, 2, ref.nbytes)
+        care = ~r[:, 1, :]
+        bad = ((r ^ s) & care[:, np.newaxis, :]).reshape(n, -1).any(axis=1)
+        i = int(np.argmax(bad))
+        return start + i if bad[i] else None
+
+    lo = start
+    while lo < end:
+        if ref.records(lo, end - lo) == sim.records(lo, end - lo): return None
+        # records [lo, a) are identical, the first difference is in [a, b)
+        a, b = lo, end
+        while b - a > 1:
+            mid = (a + b) // 2
+            if ref.records(a, mid - a) == sim.records(a, mid - a): a = mid
+            else: b = mid
+        if _differs(ref, sim, a): return a
+        lo = a + 1
+    return None
+
+# The first cycle where sim differs from ref, or where the shorter trace
+# ends, or None if they match.
+def first_divergence(ref, sim, chunk=4096):
+    if ref.nbits != sim.nbits:
+        raise TraceDiffError('traces log different signals: %s vs %s' % (ref.signal_list, sim.signal_list))
+    n = min(len(ref), len(sim))
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        if ref.records(start, end - start) == sim.records(start, end - start): continue
+        cycle = _first_in_chunk(ref, sim, start, end)
+        if cycle is not None: return cycle
+    return n if len(ref) != len(sim) else None
+
+# What the Beta was doing in a cycle of a trace with the checkoff
+# signals, as in the comments of the checkoff vectors
+def describe(trace, cycle):
+    if 'IA' not in trace.offsets or 'ID' not in trace.offsets: return ''
+    if 'RESET' in trace.offsets and trace.value(cycle, 'RESET') == 1: return 'reset'
+    ia = trace.value(cycle, 'IA')
+    id = trace.value(cycle, 'ID')
+    if ia is None or id is None: return ''
+    if 'IRQ' in trace.offsets and trace.value(cycle, 'IRQ') == 1 and not ia & 0x80000000:
+        return 'interrupt'
+    return betasim.disassemble(ia, id)
+
+def _show(text):
+    if len(text) > 1 and text.strip('01') == '':
+        return '0x%0*x' % ((len(text) + 3) // 4, int(text, 2))
+    return text
+
+# Describe the difference found by first_divergence, with the
+# reference's preceding "context" cycles.
+def report(ref, sim, cycle, context=3):
+    if cycle is None:
+        return 'traces match (%d cycles)' % len(ref)
+    lines = []
+    for c in range(max(0, cycle - context), min(cycle, len(ref))):
+        lines.append('  %6d: %s' % (c, describe(ref, c)))
+    if cycle >= len(sim) or cycle >= len(ref):
+        shorter, other = ('simulated', 'reference') if cycle >= len(sim) else ('reference', 'simulated')
+        lines.append('%s trace ends at cycle %d, %s trace has %d cycles' %
+                     (shorter, cycle, other, max(len(ref), len(sim))))
+        return '\n'.join(lines)
+
+    lines.append('first difference at cycle %d:' % cycle)
+    expected = describe(ref, cycle)
+    actual = describe(sim, cycle)
+    if expected or actual:
+        lines.append('  expected %s' % (expected or '?'))
+        if actual != expected: lines.append('  got      %s' % (actual or '?'))
+    r = ref[cycle]
+    s = sim[cycle]
+    for name, width in ref.signals:
+        offset = ref.offsets[name][0]
+        rv = r[offset:offset + width]
+        sv = s[offset:offset + width]
+        if any(a in '01' and a != b for a, b in zip(rv, sv)):
+            lines.append('  %s: expected %s, got %s' % (name, _show(rv), _show(sv)))
+    return '\n'.join(lines)
+
+def load_trace(filename, signals=tracefile.BETA_SIGNALS):
+    trace = tracefile.open_trace(filename)
+    if isinstance(trace, tracefile.Trace): return trace
+    return tracefile.Trace.from_lines(trace, signals, filename)
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Report where a simulated trace first differs from a reference trace')
+    parser.add_argument('reference', help='reference trace, eg tests/beta_log (text or packed); X and Z are don\'t cares')
+    parser.add_argument('simulated', help='trace to check (text or packed)')
+    parser.add_argument('--signals', default=tracefile.BETA_SIGNALS, help='.log signal list of text traces (default: "%s")' % tracefile.BETA_SIGNALS)
+    parser.add_argument('--chunk', type=int, default=4096, help='cycles compared at a time (default 4096)')
+    parser.add_argument('--context', type=int, default=3, help='reference cycles to show before the difference (default 3)')
+    args = parser.parse_args()
+
+    try:
+        ref = load_trace(args.reference, args.signals)
+        sim = load_trace(args.simulated, args.signals)
+        cycle = first_divergence(ref, sim, args.chunk)
+    except (IOError, tracefile.TraceError, TraceDiffError) as e:
+        sys.exit(str(e))
+    print(report(ref, sim, cycle, args.context))
+    sys.exit(0 if cycle is None else 1)
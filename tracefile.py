@@ -0,0 +1,250 @@
+# Packed binary traces of .log signals, eg, tests/beta_log.
+#
+# A text trace has one line per cycle with a 0, 1, X or Z character per
+# bit of the logged signals.  A packed trace holds the same values as two
+# bit-planes per cycle, so each value takes 2 bits instead of 8:
+#
+#   0 = (0,0)   1 = (1,0)   X = (0,1)   Z = (1,1)
+#
+# The don't cares of test vectors, - and ?, are packed as X, which is how
+# a reference trace says a value isn't checked (see tracediff.py).
+#
+# The file is a header followed by fixed-size records, one per cycle:
+#
+#   header:  "JTRC", version (uint16), header size (uint16),
+#            bits per cycle (uint32), the .log signal list (ascii),
+#            padded with NULs to a multiple of 8 bytes
+#   record:  plane 0 then plane 1, each ceil(bits/8) bytes, first
+#            signal's msb first
+#
+# so cycle n is at a known offset and Trace reads it through mmap without
+# touching the rest of the file.
+#
+#   import tracefile
+#   with tracefile.TraceWriter('beta.trc', tracefile.BETA_SIGNALS) as t:
+#       t.writelines(open('tests/beta_log'))
+#   trace = tracefile.Trace('beta.trc')
+#   print(len(trace), trace[417], trace.value(417, 'IA'))
+
+import binascii
+import mmap
+import re
+import struct
+
+MAGIC = b'JTRC'
+VERSION = 1
+_header = struct.Struct('<4sHHI')
+
+# signals logged by the lab 5 Beta checkoff (see tests/test.py)
+BETA_SIGNALS = 'RESET IRQ MOE MWR IA[31:0] ID[31:0] MA[31:0] MRD[31:0] MWD[31:0]'
+
+class TraceError(Exception):
+    pass
+
+# Parse a .log signal list into (name, width) pairs.  name[hi:lo] is a
+# bus of hi-lo+1 bits, anything else a single bit.
+def parse_signals(signals):
+    result = []
+    for sig in signals.replace(',', ' ').split():
+        m = re.match(r'^(.+)\[(\d+):(\d+)\]$', sig)
+        if m: result.append((m.group(1), abs(int(m.group(2)) - int(m.group(3))) + 1))
+        else: result.append((sig, 1))
+    if not result: raise TraceError('empty signal list')
+    return result
+
+# translation tables from text to each plane's bits (- and ? are X), and
+# from the base-4 digit (plane0*2 + plane1) back to text
+_plane0 = dict((ord(c), ord(p)) for c, p in zip('01XZ-?', '010100'))
+_plane1 = dict((ord(c), ord(p)) for c, p in zip('01XZ-?', '001111'))
+_text = dict((ord(d), ord(c)) for d, c in zip('0123', '0X1Z'))
+_values = re.compile(r'^[01XZ?-]*$')
+
+def _translate(s, table):
+    # unicode.translate takes a dict in python 2 and 3
+    return s.decode('ascii').translate(table) if isinstance(s, bytes) else s.translate(table)
+
+# Pack a text trace line of nbits values into a record
+def pack_line(line, nbits):
+    line = line.strip()
+    if len(line) != nbits or not _values.match(line):
+        raise TraceError('expected %d values of 0, 1, X, Z, - or ?' % nbits)
+    nbytes = (nbits + 7) // 8
+    shift = 8 * nbytes - nbits
+    # '%x' of the int parsed in base 2 packs 8 values per byte
+    return (binascii.unhexlify('%0*x' % (2 * nbytes, int(_translate(line, _plane0), 2) << shift)) +
+            binascii.unhexlify('%0*x' % (2 * nbytes, int(_translate(line, _plane1), 2) << shift)))
+
+def _header_bytes(signals, nbits):
+    text = ' '.join(signals.split()).encode('ascii')
+    size = _header.size + len(text)
+    size += -size % 8
+    return _header.pack(MAGIC, VERSION, size, nbits) + text + b'\x00' * (size - _header.size - len(text))
+
+class TraceWriter(object):
+    def __init__(self, filename, signals):
+        self.signals = parse_signals(signals)
+        self.nbits = sum(w for n, w in self.signals)
+        self.nbytes = (self.nbits + 7) // 8
+        self.f = open(filename, 'wb')
+        self.f.write(_header_bytes(signals, self.nbits))
+        self.cycles = 0
+
+    # append one cycle, given as a text trace line
+    def write(self, line):
+        try:
+            self.f.write(pack_line(line, self.nbits))
+        except TraceError as e:
+            raise TraceError('cycle %d: %s' % (self.cycles, e))
+        self.cycles += 1
+
+    def writelines(self, lines):
+        for line in lines:
+            if line.strip(): self.write(line)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class Trace(object):
+    # data: the contents of a packed trace, instead of reading filename
+    def __init__(self, filename, data=None):
+        self.f = None
+        if data is not None:
+            self.data = data
+        else:
+            self.f = open(filename, 'rb')
+            try:
+                self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise TraceError('%s: empty file' % filename)
+        if len(self.data) < _header.size:
+            raise TraceError('%s: not a packed trace' % filename)
+        magic, version, size, self.nbits = _header.unpack(self.data[:_header.size])
+        if magic != MAGIC: raise TraceError('%s: not a packed trace' % filename)
+        if version != VERSION: raise TraceError('%s: unsupported trace version %d' % (filename, version))
+        self.signal_list = self.data[_header.size:size].rstrip(b'\x00').decode('ascii')
+        self.signals = parse_signals(self.signal_list)
+        self.nbytes = (self.nbits + 7) // 8
+        self.record_size = 2 * self.nbytes
+        self.start = size
+        self.cycles = (len(self.data) - size) // self.record_size
+
+        # bit offset of each signal from the start of the line
+        self.offsets = {}
+        offset = 0
+        for name, width in self.signals:
+            self.offsets[name] = (offset, width)
+            offset += width
+
+    # A packed trace held in memory, from text trace lines
+    @classmethod
+    def from_lines(cls, lines, signals=BETA_SIGNALS, name='<lines>'):
+        nbits = sum(w for n, w in parse_signals(signals))
+        records = [_header_bytes(signals, nbits)]
+        for line in lines:
+            if not line.strip(): continue
+            try:
+                records.append(pack_line(line, nbits))
+            except TraceError as e:
+                raise TraceError('%s, cycle %d: %s' % (name, len(records) - 1, e))
+        return cls(name, b''.join(records))
+
+    def __len__(self):
+        return self.cycles
+
+    # raw record for a cycle: plane 0 and plane 1 as bytes
+    def record(self, cycle):
+        if cycle < 0: cycle += self.cycles
+        if not 0 <= cycle < self.cycles: raise IndexError('cycle %d not in trace' % cycle)
+        base = self.start + cycle * self.record_size
+        return self.data[base:base + self.record_size]
+
+    # raw records for count cycles starting at start
+    def records(self, start, count):
+        base = self.start + start * self.record_size
+        return self.data[base:base + count * self.record_size]
+
+    # the planes of a cycle as integers, first value in the msb
+    def planes(self, cycle):
+        record = self.record(cycle)
+        shift = 8 * self.nbytes - self.nbits
+        return (int(binascii.hexlify(record[:self.nbytes]), 16) >> shift,
+                int(binascii.hexlify(record[self.nbytes:]), 16) >> shift)
+
+    # text trace line for a cycle (without newline)
+    def __getitem__(self, cycle):
+        p0, p1 = self.planes(cycle)
+        # spread each plane's bits into hex digits, then combine them so
+        # every digit is plane0*2 + plane1
+        n = self.nbits
+        h0 = int('{0:0{1}b}'.format(p0, n), 16)
+        h1 = int('{0:0{1}b}'.format(p1, n), 16)
+        return _translate('%0*x' % (n, 2 * h0 + h1), _text)
+
+    def __iter__(self):
+        for cycle in range(self.cycles):
+            yield self[cycle] + '\n'
+
+    # value of a signal in a cycle as an integer, or None if any of its
+    # bits are X or Z
+    def value(self, cycle, name):
+        offset, width = self.offsets[name]
+        p0, p1 = self.planes(cycle)
+        shift = self.nbits - offset - width
+        mask = (1 << width) - 1
+        if (p1 >> shift) & mask: return None
+        return (p0 >> shift) & mask
+
+    def close(self):
+        if self.f is not None:
+            self.data.close()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Open a trace given either form: packed traces are read with Trace,
+# anything else is read as text lines.
+def open_trace(filename):
+    with open(filename, 'rb') as f:
+        packed = f.read(len(MAGIC)) == MAGIC
+    if packed: return Trace(filename)
+    with open(filename) as f:
+        return [line for line in f if line.strip()]
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Convert traces between text (eg, tests/beta_log) and packed form')
+    parser.add_argument('input', help='trace to read, text or packed')
+    parser.add_argument('output', nargs='?', default='-', help='trace to write: packed if input is text, text if packed (default: stdout)')
+    parser.add_argument('--signals', default=BETA_SIGNALS, help='.log signal list of a text trace (default: "%s")' % BETA_SIGNALS)
+    parser.add_argument('--cycles', default=None, help='range of cycles to print from a packed trace, eg 400:420')
+    args = parser.parse_args()
+
+    try:
+        trace = open_trace(args.input)
+        if isinstance(trace, Trace):
+            cycles = range(len(trace))
+            if args.cycles:
+                lo, colon, hi = args.cycles.partition(':')
+                if not colon: hi = int(lo) + 1
+                cycles = cycles[int(lo or 0):int(hi) if hi else None]
+            out = sys.stdout if args.output == '-' else open(args.output, 'w')
+            for cycle in cycles: out.write(trace[cycle] + '\n')
+            if out is not sys.stdout: out.close()
+        else:
+            if args.output == '-': sys.exit('a packed trace needs an output file')
+            with TraceWriter(args.output, args.signals) as t:
+                t.writelines(trace)
+    except (IOError, TraceError) as e:
+        sys.exit(str(e))
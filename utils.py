@@ -0,0 +1,387 @@
+# Python versions of the parsing utilities in utils.js, used by the
+# headless netlister and simulators.  Keep these in sync with utils.js:
+# simulation results are compared against what the browser produces.
+
+import re
+import math
+
+##################################################
+##  Numbers in engineering notation
+##################################################
+
+_hex = re.compile(r'^\s*([\-+]?)0x([0-9a-fA-F]+)\s*$')
+_binary = re.compile(r'^\s*([\-+]?)0b([0-1]+)\s*$')
+_octal = re.compile(r'^\s*([\-+]?)0([0-7]+)\s*$')
+_decimal = re.compile(r'^\s*[\-+]?[0-9]*(\.([0-9]+)?)?([eE][\-+]?[0-9]+)?\s*$')
+_scaled = re.compile(r'^\s*([\-+]?[0-9]*(\.([0-9]+)?)?)(a|A|f|F|g|G|k|K|m|M|n|N|p|P|t|T|u|U)\s*$')
+
+_scale_factors = {
+    'P': 1e15,
+    't': 1e12, 'T': 1e12,
+    'g': 1e9, 'G': 1e9,
+    'M': 1e6,
+    'k': 1e3, 'K': 1e3,
+    'm': 1e-3,
+    'u': 1e-6, 'U': 1e-6,
+    'n': 1e-9, 'N': 1e-9,
+    'p': 1e-12,
+    'f': 1e-15, 'F': 1e-15,
+    'a': 1e-18, 'A': 1e-18,
+}
+
+def _float(s):
+    # parseFloat accepts things like "5." and "-.5", but not "" or "-"
+    try:
+        return float(s)
+    except ValueError:
+        return float('nan')
+
+# convert string argument to a number, accepting usual notations
+# (hex, octal, binary, decimal, floating point) plus engineering
+# scale factors (eg, 1k = 1000.0 = 1e3).
+# return default_v if argument couldn't be interpreted as a number
+def parse_number(x, default_v=None):
+    if isinstance(x, (int, float)): return x
+    if default_v is None: default_v = float('nan')
+    if x is None: return default_v
+
+    m = _hex.match(x)
+    if m: return int(m.group(1) + m.group(2), 16)
+
+    m = _binary.match(x)
+    if m: return int(m.group(1) + m.group(2), 2)
+
+    m = _octal.match(x)
+    if m: return int(m.group(1) + m.group(2), 8)
+
+    m = _decimal.match(x)
+    if m:
+        v = _float(m.group(0))
+        return default_v if math.isnan(v) else v
+
+    m = _scaled.match(x)
+    if m:
+        v = _float(m.group(1))
+        if math.isnan(v): return default_v
+        return v * _scale_factors[m.group(4)]
+
+    return default_v
+
+# format a number the way JavaScript's toString does
+def js_string(x):
+    if isinstance(x, float):
+        if math.isnan(x): return 'NaN'
+        if math.isinf(x): return 'Infinity' if x > 0 else '-Infinity'
+        if x == int(x) and abs(x) < 1e21: return str(int(x))
+        s = repr(x)
+        m = re.match(r'^(.*)e([\-+])0*(\d+)$', s)
+        if m: s = '%se%s%s' % m.groups()
+        return s
+    return str(x)
+
+_eng_suffixes = {-5: 'f', -4: 'p', -3: 'n', -2: 'u', -1: 'm', 0: '', 1: 'K', 2: 'M', 3: 'G'}
+
+# format number using engineering notation with nplaces after the
+# decimal point, eg, 1.5e-9 -> 1.5n
+def engineering_notation(n, nplaces, trim=True):
+    if n == 0: return '0'
+    if n is None: return 'undefined'
+
+    sign = -1 if n < 0 else 1
+    log10 = math.log(sign * n) / math.log(10)
+    exp = int(math.floor(log10 / 3))   # powers of 1000
+    mantissa = sign * math.pow(10, log10 - 3 * exp)
+
+    # keep specified number of places following decimal point
+    mstring = js_string(mantissa + sign * 0.5 * math.pow(10, -nplaces))
+    mlen = len(mstring)
+    endindex = mstring.find('.')
+    if endindex != -1:
+        if nplaces > 0:
+            endindex += nplaces + 1
+            if endindex > mlen: endindex = mlen
+            if trim:
+                while mstring[endindex - 1] == '0': endindex -= 1
+                if mstring[endindex - 1] == '.': endindex -= 1
+        if endindex < mlen: mstring = mstring[:endindex]
+
+    if exp in _eng_suffixes: return mstring + _eng_suffixes[exp]
+
+    # don't have a good suffix, so just print the number
+    return '%.*g' % (nplaces, n)
+
+# parse a number, raise ValueError if there's a syntax error
+def parse_number_alert(s):
+    v = parse_number(s)
+    if isinstance(v, float) and math.isnan(v):
+        raise ValueError('The string "%s" could not be interpreted as an integer, a floating-point number or a number using engineering notation. Sorry, expressions are not allowed in this context.' % s)
+    return v
+
+# parse list of numeric values, return list of values (None for
+# locations that weren't specified).  Use "@number" to change index
+# of next location to be filled to number
+def parse_nlist(s):
+    # remove multiline comments, in-line comments
+    s = re.sub(r'/\*(.|\n)*?\*/', '', s)
+    s = re.sub(r'//.*', '', s)
+
+    # remove various formatting chars, change don't care to 0
+    s = re.sub(r'[+_]', '', s)
+    s = s.replace('?', '0')
+
+    result = []
+    locn = 0
+    for item in s.split():
+        if item[0] == '@':
+            locn = int(parse_number(item[1:]))
+        else:
+            if locn >= len(result): result.extend([None] * (locn + 1 - len(result)))
+            result[locn] = parse_number(item)
+            locn += 1
+    return result
+
+##################################################
+##  Sources
+##################################################
+
+# helper function: return args[index] if present, else default_v
+def _arg_value(args, index, default_v):
+    if index < len(args) and args[index] is not None: return args[index]
+    return default_v
+
+def fmod(numerator, denominator):
+    return numerator - math.floor(numerator / denominator) * denominator
+
+# a source waveform, as described by a string like "pwl(0,0,1n,1)" or
+# a {"type": ..., "args": [...]} dictionary (see utils.js for details).
+#   fun -- name of source function
+#   args -- list of argument values (with defaults filled in)
+#   tvpairs -- [t0,v0,t1,v1,...] for piecewise-linear sources
+#   period -- repeat period for periodic sources (0 if not periodic)
+#   value(t) -- source value at time t
+class SourceFunction(object):
+    def __init__(self, v):
+        self.period = 0
+        self.tvpairs = None
+
+        if isinstance(v, dict):
+            self.fun = v['type']
+            self.args = list(v['args'])
+        else:
+            m = re.match(r'^\s*(\w+)\s*\(([^\)]*)\)\s*$', v)
+            if m:
+                self.fun = m.group(1)
+                self.args = [parse_number_alert(a) for a in re.split(r'\s*,\s*', m.group(2))]
+            else:
+                self.fun = 'dc'
+                self.args = [parse_number_alert(v)]
+
+        args = self.args
+        fun = self.fun
+        if fun == 'dc':
+            v1 = _arg_value(args, 0, 0)
+            self.args = [v1]
+            self.value = lambda t: v1
+        elif fun == 'impulse':
+            v1 = _arg_value(args, 0, 1)
+            v2 = abs(_arg_value(args, 2, 1e-9))
+            self.args = [v1, v2]
+            self._pwl([0, 0, v2/2, v1, v2, 0], False)
+        elif fun == 'step':
+            v1 = _arg_value(args, 0, 0)
+            v2 = _arg_value(args, 1, 1)
+            td = max(0, _arg_value(args, 2, 0))
+            tr = abs(_arg_value(args, 3, 1e-9))
+            self.args = [v1, v2, td, tr]
+            self._pwl([td, v1, td + tr, v2], False)
+        elif fun == 'square' or fun == 'clock':
+            v1 = _arg_value(args, 0, 0)
+            v2 = _arg_value(args, 1, 1)
+            if fun == 'square':
+                freq = abs(_arg_value(args, 2, 1))
+                per = float('inf') if freq == 0 else 1.0/freq
+            else:
+                per = abs(_arg_value(args, 2, 100e-9))
+            duty_cycle = min(100, abs(_arg_value(args, 3, 50)))
+            t_change = abs(_arg_value(args, 4, 0.1e-9))
+            self.args = [v1, v2, freq if fun == 'square' else per, duty_cycle, t_change]
+            pw = (.01 * duty_cycle) * (per - 2*t_change)
+            self._pwl([0, v1, pw, v1, pw + t_change, v2, 2*pw + t_change,
+                       v2, 2*t_change + 2*pw, v1, per, v1], True)
+        elif fun == 'triangle':
+            v1 = _arg_value(args, 0, 0)
+            v2 = _arg_value(args, 1, 1)
+            freq = abs(_arg_value(args, 2, 1))
+            self.args = [v1, v2, freq]
+            per = float('inf') if freq == 0 else 1.0/freq
+            self._pwl([0, v1, per/2, v2, per, v1], True)
+        elif fun == 'pwl' or fun == 'pwl_repeating':
+            self._pwl(args, fun == 'pwl_repeating')
+        elif fun == 'pulse':
+            v1 = _arg_value(args, 0, 0)
+            v2 = _arg_value(args, 1, 1)
+            td = max(0, _arg_value(args, 2, 0))
+            tr = abs(_arg_value(args, 3, 1e-9))
+            tf = abs(_arg_value(args, 4, 1e-9))
+            pw = abs(_arg_value(args, 5, 1e9))
+            per = abs(_arg_value(args, 6, 1e9))
+            self.args = [v1, v2, td, tr, tf, pw, per]
+            t1 = td          # time when v1 -> v2 transition starts
+            t2 = t1 + tr     # time when v1 -> v2 transition ends
+            t3 = t2 + pw     # time when v2 -> v1 transition starts
+            t4 = t3 + tf     # time when v2 -> v1 transition ends
+            self._pwl([t1, v1, t2, v2, t3, v2, t4, v1, per, v1], True)
+        elif fun == 'sin':
+            voffset = _arg_value(args, 0, 0)
+            va = _arg_value(args, 1, 1)
+            freq = abs(_arg_value(args, 2, 1))
+            self.period = 1.0/freq
+            td = max(0, _arg_value(args, 3, 0))
+            phase = _arg_value(args, 4, 0)
+            self.args = [voffset, va, freq, td, phase]
+            phase /= 360.0
+
+            def value(t):
+                if t < td: return voffset + va*math.sin(2*math.pi*phase)
+                return voffset + va*math.sin(2*math.pi*(freq*(t - td) + phase))
+            self.value = value
+        else:
+            raise ValueError('Unrecognized source function ' + fun)
+
+        self.dc = self.value(0)   # DC value is value at time 0
+
+    def _pwl(self, tv_pairs, repeat):
+        nvals = len(tv_pairs)
+        self.tvpairs = tv_pairs
+        self.period = tv_pairs[nvals - 2] if repeat else 0
+        if nvals % 2 == 1: nvals -= 1   # make sure it's even!
+
+        if nvals <= 2:
+            # handle degenerate case
+            v = tv_pairs[1] if nvals == 2 else 0
+            self.value = lambda t: v
+            return
+
+        def value(t):
+            if repeat: t = fmod(t, tv_pairs[nvals - 2])
+            last_t = tv_pairs[0]
+            last_v = tv_pairs[1]
+            if t > last_t:
+                for i in range(2, nvals, 2):
+                    next_t = tv_pairs[i]
+                    next_v = tv_pairs[i+1]
+                    if next_t > last_t and t < next_t:   # defend against bogus tv pairs
+                        return last_v + (next_v - last_v)*(t - last_t)/(next_t - last_t)
+                    last_t = next_t
+                    last_v = next_v
+            return last_v
+        self.value = value
+
+def parse_source(v):
+    return SourceFunction(v)
+
+##################################################
+##  Signal names
+##################################################
+
+_numeric_constant = re.compile(r"^[\-+]?(0x[0-9a-fA-F]+|0b[01]+|0[0-7]+|[0-9]+)'([1-9]\d*)$")
+_replicated = re.compile(r'(.*)#\s*(\d+)$')
+_iterated = re.compile(r'(.*)\[\s*(\-?\d+)\s*:\s*(\-?\d+)\s*(:\s*(\-?\d+)\s*)?\]$')
+
+def _parse_sig(sig):
+    # numeric constant: number'size, expands into list of vdd and gnd
+    if _numeric_constant.match(sig):
+        m = re.match(r"(.*)'([1-9]\d*)$", sig)
+        n = int(parse_number(m.group(1)))
+        size = int(m.group(2))
+        return ['vdd' if n & (1 << i) else 'gnd' for i in range(size-1, -1, -1)]
+
+    # replicated signal: sig#number
+    m = _replicated.match(sig)
+    if m:
+        return _parse_sig(m.group(1).strip()) * int(m.group(2))
+
+    # iterated signal: sig[start:stop:step] or sig[start:stop]
+    m = _iterated.match(sig)
+    if m:
+        expansion = _parse_sig(m.group(1).strip())
+        start = int(m.group(2))
+        end = int(m.group(3))
+        step = abs(int(m.group(5) or 0) or 1)
+        if end < start: step = -step
+        result = []
+        while True:
+            for e in expansion: result.append('%s[%d]' % (e, start))
+            start += step
+            if (step > 0 and start > end) or (step < 0 and start < end): break
+        return result
+
+    # what's left is treated as a simple signal name
+    return [sig.lower()] if sig else []
+
+# parse string into a list of signal names, all in lower case.
+#  sig_list := sig[,sig]...
+#  sig := symbol
+#      := sig#count         -- replicate sig specified number of times
+#      := sig[start:stop:step]   -- expands to sig[start],sig[start+step],...,sig[end]
+#      := number'size       -- generate appropriate list of vdd, gnd to represent number
+def parse_signal(s):
+    result = []
+    if s is not None:
+        for sig in s.split(','):
+            result.extend(_parse_sig(sig.strip()))
+    return result
+
+##################################################
+##  Checksums
+##################################################
+
+_md5_shifts = [7, 12, 17, 22] * 4 + [5, 9, 14, 20] * 4 + [4, 11, 16, 23] * 4 + [6, 10, 15, 21] * 4
+_md5_constants = [int(abs(math.sin(i + 1)) * 2**32) & 0xFFFFFFFF for i in range(64)]
+
+def _md5_cycle(state, k):
+    a, b, c, d = state
+    for i in range(64):
+        if i < 16: f, g = (b & c) | (~b & d), i
+        elif i < 32: f, g = (b & d) | (c & ~d), (5*i + 1) % 16
+        elif i < 48: f, g = b ^ c ^ d, (3*i + 5) % 16
+        else: f, g = c ^ (b | ~d), (7*i) % 16
+        x = (a + (f & 0xFFFFFFFF) + k[g] + _md5_constants[i]) & 0xFFFFFFFF
+        s = _md5_shifts[i]
+        a, d, c = d, c, b
+        b = (b + (((x << s) | (x >> (32 - s))) & 0xFFFFFFFF)) & 0xFFFFFFFF
+    for i, v in enumerate((a, b, c, d)):
+        state[i] = (state[i] + v) & 0xFFFFFFFF
+
+# md5 checksum as computed by utils.js, which Jade sends with test
+# results for server-side verification.  It works on UTF-16 code units
+# and, unlike the standard md5, pads strings of 64 or more characters
+# incorrectly, so don't substitute hashlib.
+def md5(s):
+    codes = bytearray(s.encode('utf-16-le'))
+    codes = [codes[i] | (codes[i+1] << 8) for i in range(0, len(codes), 2)]
+    n = len(codes)
+
+    state = [1732584193, 4023233417, 2562383102, 271733878]
+    i = 64
+    while i <= n:
+        block = codes[i-64:i]
+        _md5_cycle(state, [(block[j] + (block[j+1] << 8) + (block[j+2] << 16) + (block[j+3] << 24)) & 0xFFFFFFFF
+                           for j in range(0, 64, 4)])
+        i += 64
+
+    rest = codes[i-64:]
+    tail = [0] * 16
+    # utils.js runs this loop to the length of the whole string, so for
+    # long strings the 0x80 terminator lands past the end of the block
+    for i in range(n):
+        if i < len(rest) and (i >> 2) < 16: tail[i >> 2] |= (rest[i] << ((i % 4) << 3)) & 0xFFFFFFFF
+    i = n
+    if (i >> 2) < 16: tail[i >> 2] |= 0x80 << ((i % 4) << 3)
+    if i > 55:
+        _md5_cycle(state, tail)
+        tail = [0] * 16
+    tail[14] = (n * 8) & 0xFFFFFFFF
+    _md5_cycle(state, tail)
+
+    return ''.join('%02x%02x%02x%02x' % (v & 0xFF, (v >> 8) & 0xFF, (v >> 16) & 0xFF, v >> 24) for v in state)